@@ -0,0 +1,248 @@
+"""Resumable bulk backfill of an archive of contracts and addenda.
+
+    python -m app.backfill ARCHIVE_DIR [--workers 4] [--concurrency 4] [--checkpoint FILE] [--dry-run]
+
+Layout: each sub-directory of ``ARCHIVE_DIR`` is one contract (its name is the
+contract_id) holding the base PDF and its addenda; PDFs directly under
+``ARCHIVE_DIR`` are standalone base contracts. Within a contract documents are
+ordered by the date in the file name (``2024-03-01``, ``20240301``), falling
+back to the file mtime; a file named like ``base``/``contract``/``hop-dong`` is
+always ingested first.
+
+Contracts are spread over a process pool so the CPU-bound stages (segmenting,
+merging, rendering) use all cores; inside each worker an asyncio loop runs
+``--concurrency`` contracts at once to overlap Docling/LLM I/O. LLM calls use
+the ``bulk`` priority and the ``LLM_RPM_LIMIT``/``LLM_TPM_LIMIT`` budgets are
+divided between workers. Every finished document is appended to a JSONL
+checkpoint; a rerun skips documents already recorded as done.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+CHECKPOINT_NAME = ".backfill-checkpoint.jsonl"
+BASE_NAME_RE = re.compile(r"(^|[^a-z])(base|contract|hop[-_ ]?dong)([^a-z]|$)", re.IGNORECASE)
+DATE_RE = re.compile(r"(?<!\d)(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})(?!\d)")
+
+
+@dataclass
+class Document:
+    path: str
+    rel: str
+    doc_date: date
+    is_base: bool
+
+
+@dataclass
+class ContractGroup:
+    contract_id: str
+    documents: List[Document] = field(default_factory=list)
+
+
+def document_date(path: str) -> date:
+    m = DATE_RE.search(os.path.basename(path))
+    if m:
+        try:
+            return date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except ValueError:
+            pass
+    return date.fromtimestamp(os.path.getmtime(path))
+
+
+def _order(documents: List[Document]) -> List[Document]:
+    return sorted(documents, key=lambda d: (not d.is_base, d.doc_date, d.rel))
+
+
+def discover(root: str) -> List[ContractGroup]:
+    """Group the PDFs under ``root`` by contract, documents in ingest order."""
+    groups: Dict[str, ContractGroup] = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.lower().endswith(".pdf"):
+                continue
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            parts = rel.split(os.sep)
+            contract_id = parts[0] if len(parts) > 1 else name.rsplit(".", 1)[0]
+            doc = Document(path=path, rel=rel, doc_date=document_date(path), is_base=bool(BASE_NAME_RE.search(name.rsplit(".", 1)[0])))
+            groups.setdefault(contract_id, ContractGroup(contract_id)).documents.append(doc)
+    for g in groups.values():
+        g.documents = _order(g.documents)
+    return [groups[k] for k in sorted(groups)]
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Relative paths of documents recorded as done."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # dòng ghi dở khi bị ngắt
+            if rec.get("status") == "done":
+                done.add(rec["rel"])
+    return done
+
+
+def _append_checkpoint(path: str, record: dict) -> None:
+    # một write() với O_APPEND cho mỗi dòng: an toàn khi nhiều worker cùng ghi
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def _stored_filename(group: ContractGroup, doc: Document) -> str:
+    # PDF đã lưu theo contract/version; giữ tiền tố contract_id để source_doc giống các lần backfill trước
+    name = os.path.basename(doc.path)
+    return name if os.sep not in doc.rel else f"{group.contract_id}--{name}"
+
+
+async def _run_group(pipe, group: ContractGroup, done: Set[str], checkpoint: str) -> Dict[str, int]:
+    from . import storage
+
+    counts = {"done": 0, "skipped": 0, "failed": 0, "duplicate": 0}
+    has_base = storage.latest_version(group.contract_id) is not None
+    for i, doc in enumerate(group.documents):
+        if doc.rel in done:
+            counts["skipped"] += 1
+            has_base = True
+            continue
+        with open(doc.path, "rb") as f:
+            data = f.read()
+        record = {"rel": doc.rel, "contract_id": group.contract_id, "sha256": hashlib.sha256(data).hexdigest()}
+        t0 = time.perf_counter()
+        try:
+            filename = _stored_filename(group, doc)
+            if not has_base or (i == 0 and doc.is_base):
+                result = await pipe.ingest_base(filename, data, contract_id=group.contract_id)
+            else:
+                result = await pipe.ingest_addendum(group.contract_id, filename, data)
+            has_base = True
+        except Exception as e:
+            logger.exception("Backfill failed: %s", doc.rel)
+            record.update({"status": "failed", "error": f"{type(e).__name__}: {e}", "seconds": round(time.perf_counter() - t0, 3)})
+            _append_checkpoint(checkpoint, record)
+            counts["failed"] += 1
+            # các addendum sau phụ thuộc vào version này: dừng hợp đồng, lần chạy sau thử lại
+            counts["skipped"] += len(group.documents) - i - 1
+            break
+        record.update({"status": "done", "version": result["version"], "duplicate": bool(result.get("duplicate")),
+                       "seconds": round(time.perf_counter() - t0, 3)})
+        _append_checkpoint(checkpoint, record)
+        counts["done"] += 1
+        counts["duplicate"] += int(bool(result.get("duplicate")))
+    return counts
+
+
+async def _run_batch(groups: List[ContractGroup], done: Set[str], checkpoint: str, concurrency: int) -> Dict[str, int]:
+    from .llm_client import LLMClient
+    from .pipeline import ContractPipeline
+    from .services import ExtractionService
+
+    pipe = ContractPipeline(extractor=ExtractionService(client=LLMClient(priority="bulk")))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(g: ContractGroup) -> Dict[str, int]:
+        async with sem:
+            return await _run_group(pipe, g, done, checkpoint)
+
+    totals = {"done": 0, "skipped": 0, "failed": 0, "duplicate": 0}
+    for counts in await asyncio.gather(*(one(g) for g in groups)):
+        for k, v in counts.items():
+            totals[k] += v
+    return totals
+
+
+def _worker_init(workers: int) -> None:
+    # chia ngân sách LLM của cả lần chạy cho từng worker (mỗi process có scheduler riêng)
+    from . import config
+
+    settings = config.get_settings()
+    os.environ["LLM_RPM_LIMIT"] = str(max(1, settings.llm_rpm_limit // workers))
+    os.environ["LLM_TPM_LIMIT"] = str(max(1, settings.llm_tpm_limit // workers))
+    config._settings = None
+
+
+def _worker_run(groups: List[ContractGroup], done: Set[str], checkpoint: str, concurrency: int) -> Dict[str, int]:
+    return asyncio.run(_run_batch(groups, done, checkpoint, concurrency))
+
+
+def run_backfill(root: str, workers: int, concurrency: int, checkpoint: Optional[str] = None) -> Dict[str, object]:
+    checkpoint = checkpoint or os.path.join(root, CHECKPOINT_NAME)
+    groups = discover(root)
+    done = load_checkpoint(checkpoint)
+    pending = [g for g in groups if any(d.rel not in done for d in g.documents)]
+    totals = {"done": 0, "skipped": sum(len(g.documents) for g in groups if g not in pending), "failed": 0, "duplicate": 0}
+    t0 = time.perf_counter()
+    if pending:
+        # mỗi task là một lô `concurrency` hợp đồng chạy chung một event loop
+        batches = [pending[i:i + concurrency] for i in range(0, len(pending), concurrency)]
+        workers = max(1, min(workers, len(batches)))
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_worker_init, initargs=(workers,)) as pool:
+            futures = [pool.submit(_worker_run, b, done, checkpoint, concurrency) for b in batches]
+            for fut in as_completed(futures):
+                for k, v in fut.result().items():
+                    totals[k] += v
+                logger.info("Backfill progress: %s", totals)
+    elapsed = time.perf_counter() - t0
+    return {
+        "contracts": len(groups),
+        "documents": sum(len(g.documents) for g in groups),
+        **totals,
+        "elapsed_s": round(elapsed, 1),
+        "docs_per_min": round(totals["done"] / elapsed * 60.0, 1) if elapsed > 0 else 0.0,
+        "checkpoint": checkpoint,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("root", help="archive directory")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    ap.add_argument("--concurrency", type=int, default=4, help="contracts in flight per worker")
+    ap.add_argument("--checkpoint", help=f"JSONL checkpoint (default ROOT/{CHECKPOINT_NAME})")
+    ap.add_argument("--dry-run", action="store_true", help="print the ingest plan and exit")
+    args = ap.parse_args(argv)
+
+    if args.dry_run:
+        done = load_checkpoint(args.checkpoint or os.path.join(args.root, CHECKPOINT_NAME))
+        from . import storage
+
+        for g in discover(args.root):
+            exists = storage.latest_version(g.contract_id) is not None
+            for i, d in enumerate(g.documents):
+                kind = "base" if i == 0 and (d.is_base or not exists) else "addendum"
+                mark = "done" if d.rel in done else "todo"
+                print(f"{g.contract_id}\t{kind}\t{d.doc_date}\t{mark}\t{d.rel}")
+        return 0
+    summary = run_backfill(args.root, args.workers, args.concurrency, args.checkpoint)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
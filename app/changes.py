@@ -0,0 +1,221 @@
+"""Append-only change feed of saved contract versions.
+
+One JSON line per ``save_contract_version`` in ``DATA_DIR/changes/changes.log``.
+The cursor is the byte offset just after an entry, so ``read_changes(since)``
+returns exactly the entries written after the consumer's last one. Appends take
+an exclusive ``flock`` so workers never interleave lines.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+from . import storage
+from .metrics import timed, add_bytes
+from .models import BaseContract
+import logging
+logger = logging.getLogger(__name__)
+
+
+MAX_LIMIT = 1000
+OPEN_END = "9999-12-31"
+# SSE: chu kỳ kiểm tra file log và gửi comment giữ kết nối
+STREAM_POLL_S = 1.0
+STREAM_HEARTBEAT_S = 15.0
+# giới hạn số byte đọc mỗi lần để một trang không kéo cả file vào bộ nhớ
+READ_BLOCK = 1 << 20
+
+
+class InvalidCursor(ValueError):
+    """The cursor is not an entry boundary of the change log."""
+
+
+def log_path() -> str:
+    return os.path.join(storage.DATA_DIR, "changes", "changes.log")
+
+
+def _windows(rows: List[Dict[str, Any]]) -> List[List[str]]:
+    return [list(w) for w in sorted({(str(r["date_from"]), str(r["date_to"])) for r in rows})]
+
+
+def _minus(a: List[Any], b: List[Any]) -> List[Any]:
+    rest = list(b)
+    out = []
+    for x in a:
+        if x in rest:
+            rest.remove(x)
+        else:
+            out.append(x)
+    return out
+
+
+def _policy_windows(policy_diff: Dict[str, Dict[str, Any]]) -> List[List[str]]:
+    # lớp promotion/stop-sell mới hoặc bị bỏ: các phần tử {"from", "to"} chỉ có ở một phía
+    out = set()
+    for ch in policy_diff.values():
+        old = ch["old"] if isinstance(ch["old"], list) else []
+        new = ch["new"] if isinstance(ch["new"], list) else []
+        for item in _minus(new, old) + _minus(old, new):
+            if isinstance(item, dict) and "from" in item:
+                out.add((str(item["from"]), str(item.get("to"))))
+    return [list(w) for w in sorted(out)]
+
+
+def summarize(diff: Dict[str, Any], contract: BaseContract) -> Dict[str, Any]:
+    """Compact description of a structured diff (:func:`app.diffing.diff_contracts`) for the feed."""
+    by_id = {c.id: c for c in contract.clauses}
+    clauses = []
+    starts: List[str] = []
+    ends: List[Optional[str]] = []
+    for e in diff["clauses"]:
+        item: Dict[str, Any] = {"id": e["id"], "type": e["type"], "status": e["status"]}
+        c = by_id.get(e["id"])
+        if c is not None:
+            item["effective_from"] = c.effective_from.isoformat()
+            item["effective_to"] = c.effective_to.isoformat() if c.effective_to else None
+        else:
+            item["effective_from"], item["effective_to"] = e.get("effective_from"), e.get("effective_to")
+        starts.append(item["effective_from"])
+        ends.append(item["effective_to"])
+        if e["status"] == "modified":
+            item["fields"] = sorted([*e.get("fields", {}), *(f"{g}.{k}" for g in ("scope", "policy") for k in e.get(g, {}))])
+            table = e.get("table")
+            if table:
+                # các khung ngày của dòng giá bị thêm/bỏ/sửa
+                item["rate_windows"] = _windows(table["added"] + table["removed"] + table["changed"])
+            if e.get("policy"):
+                item["policy_windows"] = _policy_windows(e["policy"])
+            for w in item.get("rate_windows", []) + item.get("policy_windows", []):
+                starts.append(w[0])
+                ends.append(None if w[1] in (None, "None", OPEN_END) else w[1])
+        clauses.append(item)
+    window = None
+    if starts:
+        window = {"from": min(s for s in starts if s), "to": None if None in ends else max(ends)}
+    return {
+        "summary": {k: diff["summary"][k] for k in ("added", "removed", "modified")},
+        "meta": sorted(diff.get("meta") or {}),
+        "window": window,
+        "clauses": clauses,
+    }
+
+
+@timed("changes.append")
+def append_change(contract: BaseContract, version: int, diff: Dict[str, Any], source_doc: Optional[str] = None) -> int:
+    """Append the entry of a saved version; returns its cursor."""
+    entry = {
+        "contract_id": contract.contract_id,
+        "version": version,
+        "source_doc": source_doc or contract.meta.source_file,
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **summarize(diff, contract),
+    }
+    line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    path = log_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, line)
+        cursor = os.fstat(fd).st_size
+    finally:
+        os.close(fd)  # đóng fd cũng nhả flock
+    add_bytes("changes.append", "out", len(line))
+    return cursor
+
+
+def current_cursor() -> int:
+    """Cursor after the last entry (consumers that only want new changes start here)."""
+    try:
+        return os.path.getsize(log_path())
+    except FileNotFoundError:
+        return 0
+
+
+def parse_cursor(value: Optional[str]) -> int:
+    if value in (None, ""):
+        return 0
+    if value == "latest":
+        return current_cursor()
+    try:
+        cursor = int(value)
+    except ValueError:
+        raise InvalidCursor(f"Invalid cursor: {value}")
+    if cursor < 0:
+        raise InvalidCursor(f"Invalid cursor: {value}")
+    return cursor
+
+
+@timed("changes.read")
+def read_changes(since: int = 0, limit: int = 100, contract_id: Optional[str] = None) -> Dict[str, Any]:
+    """Entries written after cursor ``since`` (oldest first), each with its own ``cursor``."""
+    limit = max(1, min(limit, MAX_LIMIT))
+    changes: List[Dict[str, Any]] = []
+    try:
+        f = open(log_path(), "rb")
+    except FileNotFoundError:
+        if since:
+            raise InvalidCursor(f"Invalid cursor: {since}")
+        return {"changes": [], "next_cursor": "0"}
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if since > size:
+            raise InvalidCursor(f"Invalid cursor: {since}")
+        if since:
+            f.seek(since - 1)
+            if f.read(1) != b"\n":
+                raise InvalidCursor(f"Invalid cursor: {since}")
+        pos = since
+        while len(changes) < limit and pos < size:
+            block = f.read(min(READ_BLOCK, size - pos))
+            end = block.rfind(b"\n")
+            if end < 0:
+                if len(block) == size - pos:
+                    break  # dòng cuối đang được ghi dở
+                block = block + f.readline()
+                end = block.rfind(b"\n")
+                if end < 0:
+                    break
+            start = 0
+            while start <= end and len(changes) < limit:
+                nl = block.index(b"\n", start)
+                pos += nl + 1 - start
+                entry = json.loads(block[start:nl])
+                start = nl + 1
+                if contract_id is None or entry["contract_id"] == contract_id:
+                    entry["cursor"] = str(pos)
+                    changes.append(entry)
+            f.seek(pos)
+        add_bytes("changes.read", "in", pos - since)
+    return {"changes": changes, "next_cursor": str(pos)}
+
+
+async def iter_sse(since: int, contract_id: Optional[str] = None,
+                   disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncIterator[str]:
+    """Server-sent events of new entries; the event ``id`` is the entry cursor (``Last-Event-ID`` resumes)."""
+    cursor = since
+    last_sent = time.monotonic()
+    while True:
+        if disconnected is not None and await disconnected():
+            return
+        page = await asyncio.to_thread(read_changes, cursor, MAX_LIMIT, contract_id)
+        for entry in page["changes"]:
+            yield f"id: {entry['cursor']}\nevent: change\ndata: {json.dumps(entry, ensure_ascii=False)}\n\n"
+        cursor = int(page["next_cursor"])
+        if page["changes"]:
+            last_sent = time.monotonic()
+            continue
+        if time.monotonic() - last_sent >= STREAM_HEARTBEAT_S:
+            yield f": keep-alive {cursor}\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(STREAM_POLL_S)
@@ -1,15 +1,51 @@
 from __future__ import annotations
 
 import os
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 from pydantic import Field, AnyHttpUrl
 
 
 class Settings(BaseSettings):
     docling_api_url: AnyHttpUrl = Field(..., alias="DOCLING_API_URL")
+    # Nhiều backend Docling, phân tách bằng dấu phẩy (ưu tiên hơn DOCLING_API_URL)
+    docling_api_urls: Optional[str] = Field(default=None, alias="DOCLING_API_URLS")
+    docling_timeout_s: float = Field(default=120.0, alias="DOCLING_TIMEOUT_S")
+    # số lỗi liên tiếp trước khi loại backend, và thời gian loại
+    docling_eject_after: int = Field(default=3, alias="DOCLING_EJECT_AFTER")
+    docling_eject_s: float = Field(default=30.0, alias="DOCLING_EJECT_S")
+    docling_probe_interval_s: float = Field(default=10.0, alias="DOCLING_PROBE_INTERVAL_S")
+    # gửi thêm tới backend thứ hai nếu chuyển đổi chưa xong sau ngần ấy giây (trống = tắt)
+    docling_hedge_after_s: Optional[float] = Field(default=None, alias="DOCLING_HEDGE_AFTER_S")
     openai_api_key: str = Field(..., alias="OPENAI_API_KEY")
+    # Đổi sang stand-in local (bench/standins.py) khi đo tải
+    openai_base_url: str = Field(default="https://api.openai.com/v1", alias="OPENAI_BASE_URL")
     # Mặc định trỏ tới thư mục data trong project nếu không thiết lập
     data_dir: str = Field(default_factory=lambda: os.path.join(os.path.dirname(os.path.dirname(__file__)), "data"), alias="DATA_DIR")
+    # Ngân sách token cho phần chunk của prompt addendum
+    addendum_prompt_token_budget: int = Field(default=12000, alias="ADDENDUM_PROMPT_TOKEN_BUDGET")
+    # Bật stream từ LLM: dựng/kiểm tra Clause/Change ngay khi từng phần tử JSON hoàn tất
+    llm_streaming: bool = Field(default=False, alias="LLM_STREAMING")
+    # Giới hạn gọi LLM toàn process (xem llm_scheduler)
+    llm_rpm_limit: int = Field(default=500, alias="LLM_RPM_LIMIT")
+    llm_tpm_limit: int = Field(default=200000, alias="LLM_TPM_LIMIT")
+    llm_max_concurrency: int = Field(default=8, alias="LLM_MAX_CONCURRENCY")
+    llm_target_latency_s: float = Field(default=60.0, alias="LLM_TARGET_LATENCY_S")
+    llm_max_attempts: int = Field(default=4, alias="LLM_MAX_ATTEMPTS")
+    # auto: dùng json_schema strict, provider từ chối thì chuyển sang json_object + validate local
+    llm_structured_outputs: Literal["auto", "on", "off"] = Field(default="auto", alias="LLM_STRUCTURED_OUTPUTS")
+    # Profiling theo request (header X-Profile / ?profile=); tắt mặc định
+    profiling_enabled: bool = Field(default=False, alias="PROFILING_ENABLED")
+    # nếu đặt, X-Profile/profile phải bằng đúng giá trị này
+    profiling_token: Optional[str] = Field(default=None, alias="PROFILING_TOKEN")
+    # Thời gian tối đa chờ khoá hợp đồng (ingest cùng contract được xếp hàng, kể cả giữa các worker)
+    ingest_lock_timeout_s: float = Field(default=900.0, alias="INGEST_LOCK_TIMEOUT_S")
+    # Hỏi lại LLM riêng cho clause/change độ tin cậy thấp và field meta/clause phải điền mặc định
+    refine_enabled: bool = Field(default=False, alias="REFINE_ENABLED")
+    refine_confidence_threshold: float = Field(default=0.6, alias="REFINE_CONFIDENCE_THRESHOLD")
+    refine_max_targets: int = Field(default=20, alias="REFINE_MAX_TARGETS")
+    # Đọc nhanh PDF trước khi gọi Docling để chọn do_ocr/force_ocr/table_mode theo tài liệu
+    pdf_triage_enabled: bool = Field(default=True, alias="PDF_TRIAGE_ENABLED")
 
     class Config:
         env_file = ".env"
@@ -34,5 +70,17 @@ def get_openai_key() -> str:
     return get_settings().openai_api_key
 
 
+def get_openai_base_url() -> str:
+    return get_settings().openai_base_url.rstrip("/")
+
+
 def get_data_dir(default: str | None = None) -> str:
-    return get_settings().data_dir 
\ No newline at end of file
+    return get_settings().data_dir 
+
+
+def get_addendum_token_budget() -> int:
+    return get_settings().addendum_prompt_token_budget
+
+
+def get_llm_streaming() -> bool:
+    return get_settings().llm_streaming
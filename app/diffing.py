@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .models import BaseContract, Clause, RateRow
+
+
+# các field so sánh trực tiếp; table và dict (scope/policy) có diff riêng
+SCALAR_FIELDS = ["type", "title", "season", "blackout", "text", "effective_from", "effective_to", "source_anchor", "confidence"]
+DICT_FIELDS = ["scope", "policy"]
+META_FIELDS = ["hotel", "sign_date", "currency", "source_file"]
+
+
+def _jsonable(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", by_alias=True)
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if hasattr(value, "value") and not isinstance(value, (int, float, str)):
+        return value.value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _row_key(r) -> Tuple[str, str, str]:
+    if isinstance(r, RateRow):
+        return (r.date_from.isoformat(), r.date_to.isoformat(), r.currency)
+    return (str(r.get("date_from")), str(r.get("date_to")), str(r.get("currency")))
+
+
+def _keyed_rows(rows) -> List[Tuple[Tuple[str, str, str, int], Any]]:
+    """Rows sorted by :func:`_row_key`, each key extended with the row's index among rows sharing it."""
+    out: List[Tuple[Tuple[str, str, str, int], Any]] = []
+    seen: Dict[Tuple[str, str, str], int] = {}
+    # sort ổn định: các dòng trùng khoá giữ thứ tự trong bảng, dòng thứ n cũ ghép với dòng thứ n mới
+    for r in sorted(rows or [], key=_row_key):
+        k = _row_key(r)
+        n = seen.get(k, 0)
+        seen[k] = n + 1
+        out.append(((*k, n), r))
+    return out
+
+
+def _row_payload(r) -> Dict[str, Any]:
+    if isinstance(r, RateRow):
+        return {"date_from": r.date_from.isoformat(), "date_to": r.date_to.isoformat(), "rate": r.rate,
+                "currency": r.currency, "notes": r.notes}
+    return _jsonable(dict(r))
+
+
+def diff_rate_tables(old_rows, new_rows) -> Dict[str, List[Dict[str, Any]]]:
+    """Diff two rate tables with one merge-walk over rows sorted by (date_from, date_to, currency).
+
+    ``RateRow`` has no room-type column, so rows sharing that key are paired
+    in table order. Paired rows with a different rate/notes are reported as
+    ``changed``; the rest as ``added``/``removed``.
+    """
+    old_sorted = _keyed_rows(old_rows)
+    new_sorted = _keyed_rows(new_rows)
+    added: List[Dict[str, Any]] = []
+    removed: List[Dict[str, Any]] = []
+    changed: List[Dict[str, Any]] = []
+    i = j = 0
+    while i < len(old_sorted) and j < len(new_sorted):
+        (ko, ro), (kn, rn) = old_sorted[i], new_sorted[j]
+        if ko == kn:
+            po, pn = _row_payload(ro), _row_payload(rn)
+            if po["rate"] != pn["rate"] or po.get("notes") != pn.get("notes"):
+                changed.append({"old": po, "new": pn})
+            i += 1
+            j += 1
+        elif ko < kn:
+            removed.append(_row_payload(ro))
+            i += 1
+        else:
+            added.append(_row_payload(rn))
+            j += 1
+    removed.extend(_row_payload(r) for _, r in old_sorted[i:])
+    added.extend(_row_payload(r) for _, r in new_sorted[j:])
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def diff_dicts(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    old = _jsonable(old or {})
+    new = _jsonable(new or {})
+    out: Dict[str, Dict[str, Any]] = {}
+    for k in list(old.keys()) + [k for k in new.keys() if k not in old]:
+        if old.get(k) != new.get(k):
+            out[k] = {"old": old.get(k), "new": new.get(k)}
+    return out
+
+
+def diff_clause(old: Clause, new: Clause) -> Optional[Dict[str, Any]]:
+    fields: Dict[str, Dict[str, Any]] = {}
+    for name in SCALAR_FIELDS:
+        ov, nv = getattr(old, name), getattr(new, name)
+        if ov != nv:
+            fields[name] = {"old": _jsonable(ov), "new": _jsonable(nv)}
+    entry: Dict[str, Any] = {}
+    if fields:
+        entry["fields"] = fields
+    for name in DICT_FIELDS:
+        ov, nv = getattr(old, name), getattr(new, name)
+        if ov != nv:
+            d = diff_dicts(ov, nv)
+            if d:
+                entry[name] = d
+    if old.table != new.table:
+        table = diff_rate_tables(old.table, new.table)
+        if table["added"] or table["removed"] or table["changed"]:
+            entry["table"] = table
+    if not entry:
+        return None
+    entry.update({"id": new.id, "status": "modified", "type": new.type.value, "title": new.title})
+    return entry
+
+
+def _clause_summary(c: Clause, status: str) -> Dict[str, Any]:
+    return {
+        "id": c.id,
+        "status": status,
+        "type": c.type.value,
+        "title": c.title,
+        "effective_from": c.effective_from.isoformat(),
+        "effective_to": c.effective_to.isoformat() if c.effective_to else None,
+    }
+
+
+def diff_contracts(old: Optional[BaseContract], new: BaseContract) -> Dict[str, Any]:
+    """Structured clause-by-clause, field-by-field diff of two contract versions."""
+    old_by_id = {c.id: c for c in (old.clauses if old else [])}
+    new_ids = set()
+    clauses: List[Dict[str, Any]] = []
+    unchanged = 0
+    for c in new.clauses:
+        new_ids.add(c.id)
+        prev = old_by_id.get(c.id)
+        if prev is None:
+            clauses.append(_clause_summary(c, "added"))
+            continue
+        entry = diff_clause(prev, c)
+        if entry is None:
+            unchanged += 1
+        else:
+            clauses.append(entry)
+    for c in (old.clauses if old else []):
+        if c.id not in new_ids:
+            clauses.append(_clause_summary(c, "removed"))
+    meta = {}
+    if old:
+        for name in META_FIELDS:
+            ov, nv = _jsonable(getattr(old.meta, name)), _jsonable(getattr(new.meta, name))
+            if ov != nv:
+                meta[name] = {"old": ov, "new": nv}
+    counts = {"added": 0, "removed": 0, "modified": 0}
+    for e in clauses:
+        counts[e["status"]] += 1
+    return {
+        "contract_id": new.contract_id,
+        "meta": meta,
+        "summary": {**counts, "unchanged": unchanged},
+        "clauses": clauses,
+    }
+
+
+def _short(value: Any, limit: int = 160) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _row_str(r: Dict[str, Any]) -> str:
+    notes = f" ({r['notes']})" if r.get("notes") else ""
+    return f"{r['date_from']}..{r['date_to']} {r['rate']} {r['currency']}{notes}"
+
+
+def iter_diff_markdown(diff: Dict[str, Any]) -> Iterator[str]:
+    """Yield the markdown redline of a structured diff line by line."""
+    yield "# Redline"
+    yield ""
+    for e in diff["clauses"]:
+        if e["status"] == "added":
+            yield f"+ ADD {e['id']} {e['type']} {e['title']} {e['effective_from']}→{e['effective_to'] or 'open'}"
+    for e in diff["clauses"]:
+        if e["status"] == "modified":
+            yield f"~ MODIFY {e['id']} {e['type']} {e['title']}"
+            for name, ch in e.get("fields", {}).items():
+                yield f"    - {name}: {_short(ch['old'])} → {_short(ch['new'])}"
+            for group in DICT_FIELDS:
+                for key, ch in e.get(group, {}).items():
+                    yield f"    - {group}.{key}: {_short(ch['old'])} → {_short(ch['new'])}"
+            table = e.get("table")
+            if table:
+                for r in table["added"]:
+                    yield f"    + rate {_row_str(r)}"
+                for r in table["removed"]:
+                    yield f"    - rate {_row_str(r)}"
+                for ch in table["changed"]:
+                    yield f"    ~ rate {_row_str(ch['old'])} → {ch['new']['rate']}"
+    for e in diff["clauses"]:
+        if e["status"] == "removed":
+            yield f"- REMOVE {e['id']} {e['type']} {e['title']} {e['effective_from']}→{e['effective_to'] or 'open'}"
+    for name, ch in diff.get("meta", {}).items():
+        yield f"~ META {name}: {_short(ch['old'])} → {_short(ch['new'])}"
+    yield ""
+
+
+class DiffCache:
+    """Small thread-safe LRU of diffs keyed by (contract_id, from, to, validators)."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+DIFF_CACHE = DiffCache()
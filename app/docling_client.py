@@ -2,20 +2,20 @@ from __future__ import annotations
 
 import os
 import json
-from typing import List, Dict, Any
-
-import requests
+from typing import List, Dict, Any, Optional
 
 from .models import Segment
-from .config import get_docling_url
+from .docling_pool import DoclingPool, get_pool
+from .metrics import track, add_bytes
 import logging
 logger = logging.getLogger(__name__)
 from pathlib import Path
 
 
 class DoclingClient:
-    def __init__(self, endpoint_url: str | None = None):
-        self.endpoint_url = endpoint_url or get_docling_url()
+    def __init__(self, endpoint_url: str | None = None, pool: Optional[DoclingPool] = None):
+        # mặc định dùng pool chung của process (DOCLING_API_URLS / DOCLING_API_URL)
+        self.pool = pool or (DoclingPool([endpoint_url]) if endpoint_url else get_pool())
 
     def _default_params(self) -> Dict[str, Any]:
         return {
@@ -32,7 +32,7 @@ class DoclingClient:
             "include_images": False,
         }
 
-    def parse_pdf(self, file_path: str) -> List[Segment]:
+    def parse_pdf(self, file_path: str, params_override: Optional[Dict[str, Any]] = None) -> List[Segment]:
         # MOCK MODE: skip actual HTTP call to Docling and return a synthetic markdown
         # logger.warning("DoclingClient MOCK mode enabled. Skipping HTTP call. file=%s", file_path)
         # # Read mock markdown strictly from app/file.txt
@@ -47,14 +47,21 @@ class DoclingClient:
         # return [Segment(page_range=[], heading=None, raw_md=text, table_blocks=[])]
         # --- Real Docling HTTP call ---
         params = self._default_params()
+        # thiết lập OCR/table do bước triage chọn cho tài liệu này
+        params.update(params_override or {})
 
         try:
+            # đọc một lần: pool có thể gửi lại (backend khác) hoặc hedge cùng nội dung
             with open(file_path, "rb") as fh:
-                files = {"files": (os.path.basename(file_path), fh, "application/pdf")}
-                logger.info("Docling request: url=%s file=%s", self.endpoint_url, file_path)
-                r = requests.post(self.endpoint_url, data=params, files=files,timeout=120)
+                content = fh.read()
+            files = {"files": (os.path.basename(file_path), content, "application/pdf")}
+            logger.info("Docling request: file=%s do_ocr=%s force_ocr=%s table_mode=%s",
+                        file_path, params["do_ocr"], params["force_ocr"], params["table_mode"])
+            add_bytes("docling.request", "out", len(content))
+            with track("docling.request"):
+                r = self.pool.post(data=params, files=files)
                 r.raise_for_status()
-
+            add_bytes("docling.request", "in", len(r.content))
 
             resp_json = r.json()
             if isinstance(resp_json, dict):
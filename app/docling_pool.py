@@ -0,0 +1,286 @@
+"""Pool of Docling backends shared by every DoclingClient of the process.
+
+Requests go to the healthy backend with the fewest outstanding conversions
+(ties: lower latency EWMA). Connection errors, timeouts and 429/5xx count as
+backend failures: the request is retried on another backend and a backend with
+``DOCLING_EJECT_AFTER`` consecutive failures is ejected for ``DOCLING_EJECT_S``.
+A daemon thread probes ``/health`` of every backend so ejected ones come back as
+soon as they answer (and dead ones are ejected before a conversion waits on
+them). With ``DOCLING_HEDGE_AFTER_S`` a conversion still running after that
+long is also sent to a second backend and the first answer wins.
+
+Calls are synchronous (the pipeline runs Docling in ``asyncio.to_thread``).
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from .config import get_settings
+from . import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+PROBE_TIMEOUT_S = 5.0
+EWMA_ALPHA = 0.3
+
+
+class BackendError(RuntimeError):
+    """A backend failed in a way another backend may not (connection, timeout, 429/5xx)."""
+
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url
+        parts = urlsplit(url)
+        self.health_url = f"{parts.scheme}://{parts.netloc}/health"
+        # requests.Session không được đảm bảo thread-safe: convert (hedge) và probe chạy trên nhiều thread
+        self._sessions = threading.local()
+        self.outstanding = 0
+        self.failures = 0  # lỗi liên tiếp
+        self.ejected_until = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.counters = {"requests": 0, "errors": 0, "ejections": 0, "hedges": 0}
+
+    @property
+    def session(self) -> requests.Session:
+        """This thread's keep-alive session to the backend."""
+        session = getattr(self._sessions, "session", None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        return session
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.available(now),
+            "ejected_for_s": round(max(0.0, self.ejected_until - now), 1),
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.failures,
+            "latency_ewma_s": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            **self.counters,
+        }
+
+
+class DoclingPool:
+    def __init__(self, urls: List[str], timeout_s: float = 120.0, eject_after: int = 3, eject_s: float = 30.0,
+                 probe_interval_s: float = 10.0, hedge_after_s: Optional[float] = None):
+        if not urls:
+            raise ValueError("DoclingPool needs at least one backend URL")
+        self.backends = [Backend(u) for u in urls]
+        self.timeout_s = timeout_s
+        self.eject_after = eject_after
+        self.eject_s = eject_s
+        self.probe_interval_s = probe_interval_s
+        self.hedge_after_s = hedge_after_s if hedge_after_s and len(urls) > 1 else None
+        self._lock = threading.Lock()
+        self._rr = itertools.count()
+        self._prober: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # luồng cho request hedge; request thua vẫn chạy nốt rồi bị bỏ kết quả
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(urls)), thread_name_prefix="docling") if self.hedge_after_s else None
+
+    # --- chọn backend -----------------------------------------------------
+
+    def _acquire(self, exclude: set) -> Optional[Backend]:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                return None
+            healthy = [b for b in candidates if b.available(now)]
+            if healthy:
+                # xoay vòng để các backend cùng tải không bị dồn vào backend đầu danh sách
+                turn = next(self._rr)
+                order = {id(b): (i - turn) % len(self.backends) for i, b in enumerate(self.backends)}
+                backend = min(healthy, key=lambda b: (b.outstanding, b.latency_ewma or 0.0, order[id(b)]))
+            else:
+                # tất cả đang bị loại: thử backend sắp được thả sớm nhất thay vì từ chối ngay
+                backend = min(candidates, key=lambda b: b.ejected_until)
+            backend.outstanding += 1
+            backend.counters["requests"] += 1
+        self._ensure_prober()
+        return backend
+
+    def _release(self, backend: Backend, ok: bool, elapsed: Optional[float] = None) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+                backend.ejected_until = 0.0
+                if elapsed is not None:
+                    prev = backend.latency_ewma
+                    backend.latency_ewma = elapsed if prev is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * prev
+                return
+            backend.failures += 1
+            backend.counters["errors"] += 1
+            if backend.failures >= self.eject_after and backend.available(time.monotonic()):
+                self._eject(backend, "consecutive failures")
+
+    def _eject(self, backend: Backend, reason: str) -> None:
+        backend.ejected_until = time.monotonic() + self.eject_s
+        backend.counters["ejections"] += 1
+        logger.warning("Docling backend ejected for %ss (%s): %s", self.eject_s, reason, backend.url)
+
+    # --- gửi request ------------------------------------------------------
+
+    def _send(self, backend: Backend, data: Dict[str, Any], files: Dict[str, Any]) -> requests.Response:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            try:
+                r = backend.session.post(backend.url, data=data, files=files, timeout=self.timeout_s)
+            except requests.RequestException as e:
+                # gồm cả backend ngắt giữa response (ChunkedEncodingError, ...)
+                raise BackendError(f"{backend.url}: {type(e).__name__}: {e}") from e
+            if r.status_code in RETRYABLE_STATUS:
+                raise BackendError(f"{backend.url}: HTTP {r.status_code}")
+            # 4xx khác là lỗi của request, không phải của backend
+            ok = True
+            return r
+        finally:
+            # luôn trả slot, kể cả lỗi không lường trước: outstanding không được rò
+            self._release(backend, ok=ok, elapsed=time.perf_counter() - t0 if ok else None)
+
+    def _hedged(self, backend: Backend, data: Dict[str, Any], files: Dict[str, Any], tried: set) -> requests.Response:
+        primary = self._executor.submit(self._send, backend, data, files)
+        done, _ = wait([primary], timeout=self.hedge_after_s)
+        if done:
+            return primary.result()
+        second = self._acquire(tried)
+        if second is None:
+            return primary.result()
+        tried.add(second)
+        second.counters["hedges"] += 1
+        logger.info("Docling hedge: %s slow after %ss, also sending to %s", backend.url, self.hedge_after_s, second.url)
+        pending = {primary, self._executor.submit(self._send, second, data, files)}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    return fut.result()
+                except BackendError as e:
+                    error = e
+        raise error  # type: ignore[misc]
+
+    def post(self, data: Dict[str, Any], files: Dict[str, Any]) -> requests.Response:
+        """POST a conversion, failing over across backends; raises the last BackendError if all fail."""
+        tried: set = set()
+        last: Optional[BackendError] = None
+        while True:
+            backend = self._acquire(tried)
+            if backend is None:
+                raise last or BackendError("no Docling backend available")
+            tried.add(backend)
+            try:
+                if self._executor is not None:
+                    return self._hedged(backend, data, files, tried)
+                return self._send(backend, data, files)
+            except BackendError as e:
+                logger.warning("Docling backend failed, trying another: %s", e)
+                last = e
+
+    # --- health probe -----------------------------------------------------
+
+    def _ensure_prober(self) -> None:
+        if self._prober is not None or self.probe_interval_s <= 0:
+            return
+        with self._lock:
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_loop, name="docling-health", daemon=True)
+                self._prober.start()
+
+    def probe(self) -> None:
+        """Probe every backend once: reinstate the ones that answer, eject the ones that do not."""
+        for b in self.backends:
+            try:
+                ok = b.session.get(b.health_url, timeout=PROBE_TIMEOUT_S).status_code < 500
+            except requests.RequestException:
+                ok = False
+            with self._lock:
+                now = time.monotonic()
+                if ok and not b.available(now):
+                    b.failures = 0
+                    b.ejected_until = 0.0
+                    logger.info("Docling backend reinstated: %s", b.url)
+                elif not ok and b.available(now):
+                    b.failures = max(b.failures, self.eject_after)
+                    self._eject(b, "health probe failed")
+
+    def _probe_loop(self) -> None:
+        while not self._stop.wait(self.probe_interval_s):
+            try:
+                self.probe()
+            except Exception:
+                logger.warning("Docling health probe failed", exc_info=True)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            backends = [b.stats(now) for b in self.backends]
+        return {
+            "backends": backends,
+            "healthy": sum(1 for b in backends if b["healthy"]),
+            "outstanding": sum(b["outstanding"] for b in backends),
+            "hedge_after_s": self.hedge_after_s,
+        }
+
+
+_pool: DoclingPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> DoclingPool:
+    """Process-wide pool built from DOCLING_API_URLS (or DOCLING_API_URL)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                s = get_settings()
+                urls = [u.strip() for u in (s.docling_api_urls or "").split(",") if u.strip()] or [str(s.docling_api_url)]
+                _pool = DoclingPool(
+                    urls,
+                    timeout_s=s.docling_timeout_s,
+                    eject_after=s.docling_eject_after,
+                    eject_s=s.docling_eject_s,
+                    probe_interval_s=s.docling_probe_interval_s,
+                    hedge_after_s=s.docling_hedge_after_s,
+                )
+    return _pool
+
+
+def _pool_samples(fn):
+    def read():
+        if _pool is None:
+            return {}
+        return {(("backend", b["url"]),): fn(b) for b in _pool.stats()["backends"]}
+    return read
+
+
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    "contract_docling_backend_outstanding",
+    "Docling conversions in flight per backend.",
+    _pool_samples(lambda b: b["outstanding"]),
+))
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    "contract_docling_backend_healthy",
+    "1 when the Docling backend is in rotation, 0 while ejected.",
+    _pool_samples(lambda b: 1 if b["healthy"] else 0),
+))
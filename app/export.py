@@ -0,0 +1,265 @@
+"""Bulk export of effective rate rows for channel-manager feeds.
+
+One row per rate-table row that has not ended before ``as_of``, with the
+stop-sell windows and promotions of its clause that overlap the row window.
+Contracts are read one at a time through the compact read model, so memory
+stays flat however many contracts are exported.
+
+    python -m app.export --format csv --as-of 2025-06-01 > rates.csv
+    python -m app.export --hotel "ABC" --since 1265          # only rows changed after a change-feed cursor
+    python -m app.export --contract HOTEL_A --since-version 3
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+
+from . import changes, portfolio, readmodel, storage
+from .metrics import track, add_bytes
+import logging
+logger = logging.getLogger(__name__)
+
+
+FORMATS = ("ndjson", "csv")
+COLUMNS = ["contract_id", "version", "hotel", "clause_id", "clause_type", "title", "scope",
+           "date_from", "date_to", "rate", "currency", "stop_sell", "promotions"]
+# gom dòng thành khối ~64KB trước khi gửi ra stream
+FLUSH_BYTES = 64 * 1024
+PAGE_SIZE = 500
+
+RowKey = Tuple[str, str, str, str, str]
+
+
+def _overlaps(item: Dict[str, Any], date_from: str, date_to: str) -> bool:
+    start, end = item.get("from"), item.get("to")
+    return (start is None or str(start) <= date_to) and (end is None or str(end) >= date_from)
+
+
+def iter_contract_rows(contract: readmodel.CompactContract, version: int, as_of: date) -> Iterator[Dict[str, Any]]:
+    """Rate rows of one contract still running on or after ``as_of``."""
+    o = as_of.toordinal()
+    hotel = contract.meta.get("hotel")
+    for c in contract.clauses:
+        table = c.table
+        if table is None or not len(table):
+            continue
+        policy = c.policy or {}
+        stops = policy.get("stop_sell") or []
+        promos = policy.get("promotions") or []
+        rows = table.rows()
+        for i, row in enumerate(rows):
+            if table.date_to[i] < o:
+                continue
+            df, dt = row["date_from"], row["date_to"]
+            yield {
+                "contract_id": contract.contract_id,
+                "version": version,
+                "hotel": hotel,
+                "clause_id": c.id,
+                "clause_type": c.type,
+                "title": c.title,
+                "scope": c.scope,
+                "date_from": df,
+                "date_to": dt,
+                "rate": row["rate"],
+                "currency": row["currency"],
+                "stop_sell": [{"from": s.get("from"), "to": s.get("to")} for s in stops if _overlaps(s, df, dt)],
+                "promotions": [p for p in promos if _overlaps(p, df, dt)],
+            }
+
+
+def row_key(row: Dict[str, Any]) -> RowKey:
+    return (row["contract_id"], row["clause_id"], row["date_from"], row["date_to"], row["currency"])
+
+
+def _delta(old_rows: Iterable[Dict[str, Any]], new_rows: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    # so sánh theo khoá dòng, bỏ qua cột version (đổi ở mọi version); một khoá có thể lặp lại trong bảng
+    old: Dict[RowKey, List[Dict[str, Any]]] = {}
+    for r in old_rows:
+        old.setdefault(row_key(r), []).append(r)
+    for r in new_rows:
+        same = old.get(row_key(r))
+        prev = same.pop(0) if same else None
+        if prev is None or {**prev, "version": r["version"]} != r:
+            yield {"op": "upsert", **r}
+    for rest in old.values():
+        for r in rest:
+            yield {"op": "delete", **r}
+
+
+def select_contracts(
+    contract_ids: Optional[List[str]] = None,
+    hotel: Optional[str] = None,
+    currency: Optional[str] = None,
+    clause_type: Optional[str] = None,
+) -> Iterator[str]:
+    """Contract ids to export.
+
+    Explicit ``contract_ids`` and the unfiltered export come from the version
+    files, so contracts missing from the portfolio index (stored before it
+    existed, or whose index update failed) are still exported; only the
+    hotel/currency/clause-type filters query the index. Filters given together
+    with ``contract_ids`` are checked per contract by :func:`matches`.
+    """
+    if contract_ids:
+        yield from dict.fromkeys(contract_ids)
+        return
+    if not (hotel or currency or clause_type):
+        yield from storage.list_contract_ids()
+        return
+    cursor = None
+    while True:
+        page = portfolio.query_contracts(hotel=hotel, currency=currency, clause_type=clause_type,
+                                         cursor=cursor, limit=PAGE_SIZE)
+        for item in page["items"]:
+            yield item["contract_id"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return
+
+
+def matches(contract: readmodel.CompactContract, hotel: Optional[str] = None, currency: Optional[str] = None,
+            clause_type: Optional[str] = None) -> bool:
+    """The portfolio index filters, applied to one loaded contract."""
+    if hotel and portfolio.hotel_key(contract.meta.get("hotel") or "") != portfolio.hotel_key(hotel):
+        return False
+    if clause_type and not any(c.type == clause_type for c in contract.clauses):
+        return False
+    if currency:
+        wanted = currency.upper()
+        if (contract.meta.get("currency") or "").upper() != wanted and not any(
+                c.table is not None and any(r["currency"].upper() == wanted for r in c.table.rows())
+                for c in contract.clauses):
+            return False
+    return True
+
+
+def changed_since(cursor: int) -> Tuple[Dict[str, int], int]:
+    """{contract_id: first changed version} from the change feed after ``cursor``, and the new cursor."""
+    first: Dict[str, int] = {}
+    while True:
+        page = changes.read_changes(cursor, limit=changes.MAX_LIMIT)
+        for e in page["changes"]:
+            first[e["contract_id"]] = min(e["version"], first.get(e["contract_id"], e["version"]))
+        cursor = int(page["next_cursor"])
+        if not page["changes"]:
+            return first, cursor
+
+
+def iter_rows(
+    as_of: Optional[date] = None,
+    contract_ids: Optional[List[str]] = None,
+    hotel: Optional[str] = None,
+    currency: Optional[str] = None,
+    clause_type: Optional[str] = None,
+    since_version: Optional[int] = None,
+    since_changes: Optional[Dict[str, int]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Export rows of the selected contracts; in delta mode rows carry ``op`` (upsert/delete).
+
+    Delta compares the latest version with ``since_version``, or with the
+    version before the first one recorded in ``since_changes``
+    (see :func:`changed_since`).
+    """
+    as_of = as_of or date.today()
+    for contract_id in select_contracts(contract_ids, hotel, currency, clause_type):
+        if since_changes is not None and contract_id not in since_changes:
+            continue
+        latest = storage.latest_version(contract_id)
+        if latest is None:
+            continue
+        with track("export.read"):
+            contract = readmodel.read_compact(contract_id, latest)
+        if contract is None:
+            continue
+        if contract_ids and not matches(contract, hotel, currency, clause_type):
+            continue
+        rows = iter_contract_rows(contract, latest, as_of)
+        if since_changes is None and since_version is None:
+            yield from rows
+            continue
+        base = since_version if since_changes is None else since_changes[contract_id] - 1
+        if base >= latest:
+            continue
+        old = readmodel.read_compact(contract_id, base) if base >= 1 else None
+        yield from _delta(iter_contract_rows(old, base, as_of) if old is not None else (), rows)
+
+
+def _csv_cell(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str) if value else ""
+    return "" if value is None else value
+
+
+def iter_encoded(rows: Iterable[Dict[str, Any]], fmt: str = "ndjson", delta: bool = False) -> Iterator[bytes]:
+    """Encode rows as NDJSON or CSV (with header), in blocks of about ``FLUSH_BYTES``."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    buf = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow((["op"] if delta else []) + COLUMNS)
+    out = bytearray()
+    for row in rows:
+        if writer is None:
+            out += orjson.dumps(row, default=str)
+            out += b"\n"
+        else:
+            writer.writerow(([row["op"]] if delta else []) + [_csv_cell(row[k]) for k in COLUMNS])
+        if buf.tell():
+            out += buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+        if len(out) >= FLUSH_BYTES:
+            add_bytes("export", "out", len(out))
+            yield bytes(out)
+            out.clear()
+    if buf.tell():
+        out += buf.getvalue().encode("utf-8")
+    if out:
+        add_bytes("export", "out", len(out))
+        yield bytes(out)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--format", choices=FORMATS, default="ndjson")
+    ap.add_argument("--as-of", type=date.fromisoformat, help="keep rate rows ending on/after this date (default today)")
+    ap.add_argument("--contract", action="append", dest="contract_ids", help="contract id (repeatable)")
+    ap.add_argument("--hotel")
+    ap.add_argument("--currency")
+    ap.add_argument("--clause-type")
+    delta = ap.add_mutually_exclusive_group()
+    delta.add_argument("--since", help="change-feed cursor: only rows changed after it")
+    delta.add_argument("--since-version", type=int, help="only rows changed after this version of each contract")
+    ap.add_argument("-o", "--output", help="output file (default stdout)")
+    args = ap.parse_args(argv)
+
+    since_changes = None
+    if args.since is not None:
+        since_changes, next_cursor = changed_since(changes.parse_cursor(args.since))
+        # cursor cho lần export delta kế tiếp
+        print(f"next_cursor={next_cursor}", file=sys.stderr)
+    rows = iter_rows(args.as_of, args.contract_ids, args.hotel, args.currency, args.clause_type,
+                     since_version=args.since_version, since_changes=since_changes)
+    is_delta = since_changes is not None or args.since_version is not None
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for block in iter_encoded(rows, args.format, delta=is_delta):
+            out.write(block)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+
+
+def file_validators(path: str) -> Tuple[str, str, float]:
+    """Strong ETag, Last-Modified header value and mtime for a stored file."""
+    st = os.stat(path)
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    return etag, formatdate(st.st_mtime, usegmt=True), st.st_mtime
+
+
+def version_etag(contract_id: str, version: int, mtime_ns: int, *parts: object) -> str:
+    """Strong ETag for a contract version; ``parts`` add request-specific inputs (e.g. as_of)."""
+    raw = "|".join([contract_id, str(version), str(mtime_ns)] + ["" if p is None else str(p) for p in parts])
+    return '"v{}-{}"'.format(version, hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16])
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # so sánh weak theo RFC 9110 cho If-None-Match
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        c = candidate.strip()
+        if c.startswith("W/"):
+            c = c[2:]
+        if c == bare:
+            return True
+    return False
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, mtime: Optional[float] = None) -> bool:
+    """Evaluate If-None-Match (preferred) or If-Modified-Since against the current validators."""
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        return etag_matches(inm, etag)
+    ims = headers.get("if-modified-since")
+    if ims and mtime is not None:
+        try:
+            return int(mtime) <= int(parsedate_to_datetime(ims).timestamp())
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag: str, last_modified: Optional[str] = None, max_age: int = 0) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}, must-revalidate"}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+class IncrementalJsonParser:
+    """Incremental parser for a streamed top-level JSON object.
+
+    Text is fed in arbitrary pieces. Every element of the arrays stored under
+    ``array_keys`` is emitted as ``(key, element)`` as soon as it is complete;
+    other top-level members are emitted as ``(key, value)`` once their value
+    ends. Nothing is emitted for the array values themselves.
+    """
+
+    def __init__(self, array_keys: Iterable[str] = ("clauses", "changes")):
+        self.array_keys = set(array_keys)
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._str_start = 0
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self._in_array = False
+        self._elem_start: Optional[int] = None
+        self._events: List[Tuple[str, Any]] = []
+        self.done = False
+
+    @property
+    def text(self) -> str:
+        return self._buf
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        self._buf += text
+        buf = self._buf
+        for i in range(self._pos, len(buf)):
+            if self.done:
+                break
+            self._scan(i, buf[i])
+        self._pos = len(buf)
+        events, self._events = self._events, []
+        return events
+
+    def _scan(self, i: int, ch: str) -> None:
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._depth == 1 and self._expect_key:
+                    self._key = json.loads(self._buf[self._str_start:i + 1])
+                    self._expect_key = False
+            return
+        if ch.isspace():
+            return
+        if self._depth == 1 and not self._expect_key and self._value_start is None and ch not in ":,}":
+            self._value_start = i
+            if ch == "[" and self._key in self.array_keys:
+                self._in_array = True
+        if self._in_array and self._depth == 2 and self._elem_start is None and ch not in ",]":
+            self._elem_start = i
+        if ch == '"':
+            self._in_string = True
+            self._str_start = i
+        elif ch in "{[":
+            self._depth += 1
+            if self._depth == 1:
+                self._expect_key = True
+        elif ch in "}]":
+            if self._in_array and self._depth == 2 and ch == "]":
+                self._emit_element(i)
+                self._in_array = False
+            self._depth -= 1
+            if self._depth == 0:
+                self._finish_value(i)
+                self.done = True
+        elif ch == ",":
+            if self._in_array and self._depth == 2:
+                self._emit_element(i)
+            elif self._depth == 1:
+                self._finish_value(i)
+                self._expect_key = True
+
+    def _emit_element(self, end: int) -> None:
+        if self._elem_start is None:
+            return
+        raw = self._buf[self._elem_start:end].strip()
+        self._elem_start = None
+        if raw:
+            self._events.append((self._key, json.loads(raw)))
+
+    def _finish_value(self, end: int) -> None:
+        start, self._value_start = self._value_start, None
+        if start is None or self._key in self.array_keys:
+            return
+        self._events.append((self._key, json.loads(self._buf[start:end].strip())))
@@ -1,75 +1,286 @@
 from __future__ import annotations
 
 import json
-from typing import List, Literal
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Tuple
 
 import asyncio
+import threading
 import requests
-from tenacity import retry, stop_after_attempt, wait_exponential
 
 from .models import Chunk
-from .config import get_openai_key
-from . import storage
+from .json_stream import IncrementalJsonParser
+from .llm_scheduler import RETRYABLE_STATUS, get_scheduler
+from .prompting import estimate_tokens
+from .metrics import track, add_bytes, record_llm_usage
+from .config import get_openai_key, get_openai_base_url
+from . import storage, structured
 import logging
 logger = logging.getLogger(__name__)
 
 
+# dự phòng token cho phần completion khi xin ngân sách TPM trước khi gọi
+COMPLETION_TOKEN_ESTIMATE = 2000
+
+
 class LLMClient:
-    def __init__(self):
+    def __init__(self, priority: str = "interactive"):
         self.openai_key = get_openai_key()
         self.model = "gpt-4o-mini"
+        self.chat_url = f"{get_openai_base_url()}/chat/completions"
+        # "interactive" (API) được phục vụ trước "bulk" (backfill) trong scheduler
+        self.priority = priority
+        self.scheduler = get_scheduler()
+        # giữ kết nối keep-alive tới API giữa các request (client dùng chung cả process);
+        # requests.Session không được đảm bảo thread-safe → mỗi thread (to_thread/executor) một session
+        self._sessions = threading.local()
 
-    @retry(stop=stop_after_attempt(2), wait=wait_exponential(multiplier=1, min=1, max=8))
-    async def extract(self, chunks: List[Chunk], mode: Literal["base", "addendum"], source_file: str):
-        sys_prompt = (
-            "Bạn là trình trích xuất. Đầu vào là markdown giữ bảng/heading. "
-            "Trả về duy nhất JSON đúng schema. Không suy đoán; thiếu → null + missing_reason. "
-            "Mode BASE: trả object gồm keys: meta, clauses. Meta gồm hotel, sign_date (YYYY-MM-DD), currency. "
-            "Mode ADDENDUM: trả ChangeSet."
-        )
-        user_prompt = self._build_user_prompt(chunks, mode)
+    @property
+    def session(self) -> requests.Session:
+        """This thread's keep-alive session."""
+        session = getattr(self._sessions, "session", None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        return session
+
+    SYSTEM_PROMPT = (
+        "Bạn là trình trích xuất. Đầu vào là markdown giữ bảng/heading. "
+        "Trả về duy nhất JSON đúng schema. Không suy đoán; thiếu → null + missing_reason. "
+        "Mode BASE: trả object gồm keys: meta, clauses. Meta gồm hotel, sign_date (YYYY-MM-DD), currency. "
+        "Mode ADDENDUM: trả ChangeSet."
+    )
+
+    def _payload(self, chunks: List[Chunk], mode: str, stream: bool = False) -> Dict[str, Any]:
         payload = {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_prompt},
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": self._build_user_prompt(chunks, mode)},
             ],
+            # json_schema strict theo app/schemas khi provider hỗ trợ (xem app/structured.py)
+            "response_format": structured.response_format(mode),
+            "temperature": 0.1,
+            "top_p": 0.1,
+        }
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.openai_key}"}
+
+    def _estimate_tokens(self, payload: Dict[str, Any]) -> int:
+        prompt = "".join(m["content"] for m in payload["messages"])
+        return estimate_tokens(prompt) + COMPLETION_TOKEN_ESTIMATE
+
+    async def extract(
+        self,
+        chunks: List[Chunk],
+        mode: Literal["base", "addendum"],
+        source_file: str,
+        priority: Optional[str] = None,
+    ):
+        logger.info("LLM request: mode=%s model=%s chunks=%s file=%s", mode, self.model, len(chunks), source_file)
+        return await self._complete_json(self._payload(chunks, mode), mode, source_file=source_file, priority=priority)
+
+    async def complete_json(
+        self,
+        system: str,
+        user: str,
+        mode: str,
+        priority: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """One small JSON-mode chat call (e.g. targeted refinement), through the same scheduler."""
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}],
             "response_format": {"type": "json_object"},
             "temperature": 0.1,
             "top_p": 0.1,
         }
-        headers = {"Authorization": f"Bearer {self.openai_key}"}
+        return await self._complete_json(payload, mode, priority=priority)
+
+    async def _complete_json(
+        self,
+        payload: Dict[str, Any],
+        mode: str,
+        source_file: Optional[str] = None,
+        priority: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        # payload dựng một lần; 429/5xx được scheduler gửi lại nguyên payload
+        headers = self._headers()
+        tokens = self._estimate_tokens(payload)
 
         def _post():
-            r = requests.post(
-                "https://api.openai.com/v1/chat/completions",
+            return self.session.post(
+                self.chat_url,
                 json=payload,
                 headers=headers,
                 timeout=120,
             )
-            r.raise_for_status()
-            return r
 
-        logger.info("LLM request: mode=%s model=%s chunks=%s file=%s", mode, self.model, len(chunks), source_file)
-        try:
-            r = await asyncio.to_thread(_post)
-        except Exception:
-            logger.exception("LLM request failed")
-            raise
-        data = r.json()
-        content = data["choices"][0]["message"]["content"]
-        # Save raw content for debugging/traceability
-        try:
-            storage.save_llm_output(source_file=source_file, mode=mode, content=content)
-        except Exception:
-            logger.warning("Failed to save LLM raw output", exc_info=True)
-        try:
-            parsed = json.loads(content)
-        except Exception:
-            logger.exception("LLM JSON parse failed: content preview=%s", content[:200])
-            raise
-        logger.info("LLM response keys: %s", list(parsed.keys()))
-        return parsed
+        # JSON hỏng / sai schema → hỏi lại một lần
+        attempt = 0
+        while attempt < 2:
+            attempt += 1
+            try:
+                with track("llm.request"):
+                    r = await self.scheduler.run(_post, tokens=tokens, priority=priority or self.priority)
+                    if r.status_code == 400 and structured.is_structured(payload) and structured.rejects_schema(r.text):
+                        # provider không hỗ trợ json_schema: gửi lại dạng json_object, không tính là một lần thử
+                        structured.mark_unsupported(r.text)
+                        payload = {**payload, "response_format": {"type": "json_object"}}
+                        attempt -= 1
+                        continue
+                    r.raise_for_status()
+            except Exception:
+                logger.exception("LLM request failed")
+                raise
+            add_bytes("llm.request", "out", len(r.request.body or b"") if r.request is not None else 0)
+            add_bytes("llm.request", "in", len(r.content))
+            data = r.json()
+            record_llm_usage(data.get("usage"), mode)
+            content = data["choices"][0]["message"]["content"]
+            # Save raw content for debugging/traceability
+            if source_file:
+                try:
+                    storage.save_llm_output(source_file=source_file, mode=mode, content=content)
+                except Exception:
+                    logger.warning("Failed to save LLM raw output", exc_info=True)
+            try:
+                parsed = json.loads(content)
+            except Exception:
+                logger.exception("LLM JSON parse failed (attempt %s): content preview=%s", attempt, content[:200])
+                if attempt == 2:
+                    raise
+                continue
+            logger.info("LLM response keys: %s", list(parsed.keys()))
+            if mode not in structured.SCHEMA_FILES:
+                return parsed
+            fmt = "json_schema" if structured.is_structured(payload) else "json_object"
+            errors: List[str] = []
+            if fmt == "json_schema":
+                # member free-form đến dạng chuỗi JSON: giải mã rồi kiểm tra như json_object
+                parsed = structured.decode(parsed, mode, errors)
+            errors += structured.validate(parsed, mode)
+            structured.record(mode, fmt, not errors)
+            if not errors or attempt == 2:
+                # lần hai vẫn sai: để auto_repair_json / validate của pipeline xử lý như trước
+                return parsed
+            logger.warning("LLM output does not match schema (%s errors), asking for a correction: %s", len(errors), errors[:5])
+            payload = {**payload, "messages": payload["messages"] + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": "JSON chưa đúng schema:\n- " + "\n- ".join(errors[:20])
+                 + "\nTrả lại toàn bộ JSON đã sửa, chỉ JSON."},
+            ]}
+
+    async def extract_stream(
+        self,
+        chunks: List[Chunk],
+        mode: Literal["base", "addendum"],
+        source_file: str,
+        priority: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Stream the completion and yield ``(key, value)`` as JSON members complete.
+
+        Elements of ``clauses``/``changes`` are yielded one by one (key
+        ``"clauses"``/``"changes"``); other top-level members (``meta``,
+        ``source_doc``, ...) are yielded whole. Raw content received so far is
+        saved even when the stream fails midway.
+        """
+        payload = self._payload(chunks, mode, stream=True)
+        headers = self._headers()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        _END = object()
+        stop = threading.Event()
+
+        def _pump(ticket):
+            try:
+                with self.session.post(self.chat_url, json=payload, headers=headers, timeout=120, stream=True) as r:
+                    ticket.observe(r)
+                    if r.status_code == 400 and structured.is_structured(payload) and structured.rejects_schema(r.text):
+                        raise structured.SchemaRejected(r.text)
+                    r.raise_for_status()
+                    for line in r.iter_lines(decode_unicode=True):
+                        if stop.is_set():
+                            # consumer gave up → đóng kết nối, ngừng sinh token
+                            break
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        event = json.loads(data)
+                        ticket.observe_usage(event.get("usage"))
+                        choices = event.get("choices") or []
+                        delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                        if delta:
+                            add_bytes("llm.stream", "in", len(delta.encode("utf-8")))
+                            loop.call_soon_threadsafe(queue.put_nowait, delta)
+                loop.call_soon_threadsafe(queue.put_nowait, _END)
+            except Exception as e:  # forwarded to the consumer
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        logger.info("LLM stream request: mode=%s model=%s chunks=%s file=%s", mode, self.model, len(chunks), source_file)
+        parser = IncrementalJsonParser()
+        completed = False
+        attempt = 0
+        while True:
+            attempt += 1
+            retry = False
+            # slot của scheduler được giữ suốt thời gian stream
+            async with self.scheduler.slot(self._estimate_tokens(payload), priority or self.priority) as ticket:
+                with track("llm.stream"):
+                    try:
+                        add_bytes("llm.stream", "out", len(json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+                        loop.run_in_executor(None, _pump, ticket)
+                        while True:
+                            item = await queue.get()
+                            if item is _END:
+                                break
+                            if isinstance(item, structured.SchemaRejected) and not parser.text:
+                                # chưa nhận gì: gửi lại dạng json_object trong cùng slot
+                                structured.mark_unsupported(str(item))
+                                payload = {**payload, "response_format": {"type": "json_object"}}
+                                loop.run_in_executor(None, _pump, ticket)
+                                continue
+                            if isinstance(item, Exception) and not parser.text and attempt < self.scheduler.max_attempts \
+                                    and (ticket.status in RETRYABLE_STATUS
+                                         or isinstance(item, (requests.ConnectionError, requests.Timeout))):
+                                # 429/5xx trước delta đầu tiên: trả slot (scheduler tạm dừng theo Retry-After) rồi gửi lại
+                                logger.warning("LLM stream request failed before any output, retrying (attempt %s): %s", attempt, item)
+                                retry = True
+                                break
+                            if isinstance(item, Exception):
+                                logger.error("LLM stream failed after %s chars", len(parser.text))
+                                raise item
+                            decode = structured.is_structured(payload)
+                            for key, value in parser.feed(item):
+                                # member free-form (scope, policy, table...) đến dạng chuỗi JSON
+                                yield key, structured.decode_member(mode, key, value) if decode else value
+                        completed = not retry
+                    finally:
+                        if not retry:
+                            try:
+                                storage.save_llm_output(
+                                    source_file=source_file,
+                                    mode=mode if completed else f"{mode}_partial",
+                                    content=parser.text,
+                                )
+                            except Exception:
+                                logger.warning("Failed to save LLM raw output", exc_info=True)
+                            if not completed:
+                                stop.set()
+                            record_llm_usage(ticket.usage, mode)
+            if not retry:
+                break
+            self.scheduler.counters["retries"] += 1
+            if ticket.status != 429:
+                # 429 đã có pause của scheduler (Retry-After)
+                await asyncio.sleep(min(8.0, 2 ** (attempt - 1)))
+        if not parser.done:
+            raise ValueError(f"LLM stream ended before JSON completed ({len(parser.text)} chars)")
 
     def _build_user_prompt(self, chunks: List[Chunk], mode: str) -> str:
         header = (
@@ -77,4 +288,4 @@ class LLMClient:
             "Mode: ADDENDUM → trả ChangeSet theo schema. Ngày YYYY-MM-DD."
         )
         body = "\n\n".join([f"[Chunk]\n{c.markdown}" for c in chunks])
-        return f"{header}\n\n{body}" 
\ No newline at end of file
+        return f"{header}\nMode hiện tại: {mode.upper()}\n\n{body}" 
\ No newline at end of file
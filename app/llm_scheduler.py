@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import requests
+
+from .config import get_settings
+from . import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+
+# số nhỏ hơn được phục vụ trước
+PRIORITIES = {"interactive": 0, "bulk": 10}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Ticket:
+    """Handle for one scheduled call; the caller reports the outcome through it."""
+
+    def __init__(self, tokens: int, priority: int):
+        self.tokens = tokens
+        self.priority = priority
+        self.status: Optional[int] = None
+        self.retry_after: Optional[float] = None
+        self.used_tokens: Optional[int] = None
+        self.usage: Optional[Dict[str, Any]] = None
+
+    def observe(self, response: requests.Response) -> None:
+        self.status = response.status_code
+        self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+    def observe_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        if usage and usage.get("total_tokens") is not None:
+            self.usage = usage
+            self.used_tokens = int(usage["total_tokens"])
+
+
+class LLMScheduler:
+    """Process-wide admission control for LLM calls.
+
+    Calls wait in a priority queue until the request and token per-minute
+    buckets allow them and a concurrency slot is free. The concurrency limit
+    follows AIMD: it grows slowly while latency stays under target and is
+    halved on 429s. ``Retry-After`` pauses dispatch for everyone.
+    """
+
+    def __init__(
+        self,
+        rpm: int,
+        tpm: int,
+        max_concurrency: int,
+        target_latency_s: float = 60.0,
+        max_attempts: int = 4,
+    ):
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.target_latency_s = target_latency_s
+        self.max_attempts = max_attempts
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.counters: Dict[str, int] = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "retries": 0}
+        self._queue: List[Any] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # --- queue ---------------------------------------------------------
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # scheduler được dùng lại trong event loop mới (CLI, asyncio.run nhiều lần)
+            self._loop = loop
+            self._queue = []
+            self._timer = None
+            self.in_flight = 0
+
+    async def acquire(self, tokens: int, priority: str | int = "interactive") -> Ticket:
+        self._bind_loop()
+        prio = PRIORITIES.get(priority, 0) if isinstance(priority, str) else int(priority)
+        fut = self._loop.create_future()
+        ticket = Ticket(tokens, prio)
+        heapq.heappush(self._queue, (prio, next(self._seq), fut, ticket))
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(ticket, latency=None)
+            raise
+        return ticket
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        while self._queue:
+            prio, _, fut, ticket = self._queue[0]
+            if fut.cancelled():
+                heapq.heappop(self._queue)
+                continue
+            if self.in_flight >= max(1, int(self.limit)):
+                return
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.request_bucket.wait_time(1),
+                self.token_bucket.wait_time(ticket.tokens),
+            )
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = self._loop.call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(ticket.tokens)
+            self.in_flight += 1
+            self.counters["requests"] += 1
+            fut.set_result(None)
+
+    def release(self, ticket: Ticket, latency: Optional[float]) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        if ticket.used_tokens is not None:
+            # chỉnh lại ngân sách theo usage thực tế từ API
+            delta = ticket.used_tokens - ticket.tokens
+            if delta > 0:
+                self.token_bucket.consume(delta)
+            else:
+                self.token_bucket.refund(-delta)
+        if ticket.status == 429:
+            self.counters["rate_limited"] += 1
+            if ticket.used_tokens is None:
+                # request bị từ chối không tiêu token: trả lại phần đã trừ trước
+                self.token_bucket.refund(ticket.tokens)
+            self.limit = max(1.0, self.limit / 2)
+            pause = ticket.retry_after if ticket.retry_after is not None else 2.0
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            logger.warning("LLM rate limited: pause=%.1fs concurrency_limit=%.1f", pause, self.limit)
+        elif ticket.status is None or ticket.status >= 500:
+            self.counters["errors"] += 1
+            if ticket.retry_after is not None:
+                self.paused_until = max(self.paused_until, time.monotonic() + ticket.retry_after)
+        elif ticket.status >= 300:
+            # 4xx khác (400/401/404...): lỗi phía request, không phản ánh tải của API → không đụng EWMA
+            self.counters["errors"] += 1
+        else:
+            self.counters["ok"] += 1
+            if latency is not None:
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                if self.latency_ewma > self.target_latency_s:
+                    self.limit = max(1.0, self.limit * 0.9)
+                else:
+                    self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+        if self._loop is not None and not self._loop.is_closed():
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int, priority: str | int = "interactive") -> AsyncIterator[Ticket]:
+        ticket = await self.acquire(tokens, priority)
+        started = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, latency=time.monotonic() - started)
+
+    async def run(
+        self,
+        fn: Callable[[], requests.Response],
+        tokens: int,
+        priority: str | int = "interactive",
+    ) -> requests.Response:
+        """Run blocking ``fn`` (an HTTP call) under the scheduler, retrying 429/5xx.
+
+        The same request is resent; callers build the payload once. The last
+        response is returned once attempts are exhausted.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            async with self.slot(tokens, priority) as ticket:
+                try:
+                    r = await asyncio.to_thread(fn)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= self.max_attempts:
+                        raise
+                    logger.warning("LLM transport error, retrying (attempt %s)", attempt, exc_info=True)
+                    r = None
+                if r is not None:
+                    ticket.observe(r)
+                    if r.status_code not in RETRYABLE_STATUS or attempt >= self.max_attempts:
+                        if r.ok:
+                            try:
+                                ticket.observe_usage(r.json().get("usage"))
+                            except ValueError:
+                                pass
+                        return r
+            self.counters["retries"] += 1
+            if ticket.status != 429:
+                await asyncio.sleep(min(8.0, 2 ** (attempt - 1)))
+
+    def stats(self) -> Dict[str, Any]:
+        depth: Dict[str, int] = {name: 0 for name in PRIORITIES}
+        names = {v: k for k, v in PRIORITIES.items()}
+        for prio, _, fut, _ticket in self._queue:
+            if not fut.done():
+                name = names.get(prio, str(prio))
+                depth[name] = depth.get(name, 0) + 1
+        return {
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "in_flight": self.in_flight,
+            "concurrency_limit": round(self.limit, 2),
+            "max_concurrency": self.max_concurrency,
+            "paused_for_s": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            "latency_ewma_s": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "requests_available": int(self.request_bucket.tokens),
+            "tokens_available": int(self.token_bucket.tokens),
+            **self.counters,
+        }
+
+
+_scheduler: LLMScheduler | None = None
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        s = get_settings()
+        _scheduler = LLMScheduler(
+            rpm=s.llm_rpm_limit,
+            tpm=s.llm_tpm_limit,
+            max_concurrency=s.llm_max_concurrency,
+            target_latency_s=s.llm_target_latency_s,
+            max_attempts=s.llm_max_attempts,
+        )
+    return _scheduler
+
+
+def _scheduler_samples(fn):
+    def read():
+        if _scheduler is None:
+            return {}
+        return fn(_scheduler.stats())
+    return read
+
+
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    "contract_llm_queue_depth",
+    "LLM calls waiting in the scheduler queue.",
+    _scheduler_samples(lambda st: {(("priority", k),): v for k, v in st["queue_depth_by_priority"].items()}),
+))
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    "contract_llm_in_flight",
+    "LLM calls currently holding a scheduler slot.",
+    _scheduler_samples(lambda st: {(): st["in_flight"]}),
+))
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    "contract_llm_concurrency_limit",
+    "Current adaptive concurrency limit of the LLM scheduler.",
+    _scheduler_samples(lambda st: {(): st["concurrency_limit"]}),
+))
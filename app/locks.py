@@ -0,0 +1,109 @@
+"""Per-contract locks that hold across uvicorn workers and processes.
+
+An ``asyncio.Lock`` serializes coroutines of one process, then an advisory
+``fcntl.flock`` on ``DATA_DIR/locks/{contract_id}.lock`` serializes processes.
+Where ``fcntl`` is unavailable only the in-process lock applies.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+from . import storage
+from .config import get_settings
+from .metrics import track
+import logging
+logger = logging.getLogger(__name__)
+
+
+POLL_INITIAL_S = 0.01
+POLL_MAX_S = 0.5
+
+_process_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+class ContractLockTimeout(TimeoutError):
+    """Another ingest held the contract lock for longer than ``INGEST_LOCK_TIMEOUT_S``."""
+
+
+def lock_path(contract_id: str) -> str:
+    return os.path.join(storage.DATA_DIR, "locks", f"{contract_id}.lock")
+
+
+def _open_lock_file(contract_id: str) -> int:
+    path = lock_path(contract_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+
+def _try_flock(fd: int) -> bool:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _timeout(timeout_s: Optional[float]) -> float:
+    return get_settings().ingest_lock_timeout_s if timeout_s is None else timeout_s
+
+
+@asynccontextmanager
+async def contract_lock(contract_id: str, timeout_s: Optional[float] = None) -> AsyncIterator[None]:
+    """Hold the contract exclusively (coroutines of this process, then other processes)."""
+    timeout_s = _timeout(timeout_s)
+    deadline = time.monotonic() + timeout_s
+    lock = _process_locks.get(contract_id)
+    if lock is None:
+        lock = _process_locks[contract_id] = asyncio.Lock()
+    with track("lock.wait"):
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout=timeout_s)
+        except asyncio.TimeoutError:
+            raise ContractLockTimeout(f"Contract {contract_id} is busy")
+    fd = None
+    try:
+        if fcntl is not None:
+            fd = _open_lock_file(contract_id)
+            delay = POLL_INITIAL_S
+            # flock không chờ được bằng asyncio: thử non-blocking và lùi dần
+            with track("lock.wait"):
+                while not _try_flock(fd):
+                    if time.monotonic() >= deadline:
+                        raise ContractLockTimeout(f"Contract {contract_id} is busy")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, POLL_MAX_S)
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)  # đóng fd cũng nhả flock
+        lock.release()
+
+
+@contextmanager
+def contract_file_lock(contract_id: str, timeout_s: Optional[float] = None) -> Iterator[None]:
+    """Blocking, process-level variant for CLI tools that do not run an event loop."""
+    if fcntl is None:
+        yield
+        return
+    deadline = time.monotonic() + _timeout(timeout_s)
+    fd = _open_lock_file(contract_id)
+    try:
+        delay = POLL_INITIAL_S
+        while not _try_flock(fd):
+            if time.monotonic() >= deadline:
+                raise ContractLockTimeout(f"Contract {contract_id} is busy")
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_S)
+        yield
+    finally:
+        os.close(fd)
@@ -1,28 +1,64 @@
 from __future__ import annotations
 
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
 from datetime import date
-from typing import Optional
+from email.utils import formatdate
+from typing import List, Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, FileResponse, StreamingResponse
 
 from .pipeline import ContractPipeline
-
-app = FastAPI(title="Hotel Contract Pipeline (OOP)")
+from .llm_scheduler import get_scheduler
+from .docling_pool import get_pool
+from .locks import ContractLockTimeout
+from . import metrics, readmodel, changes, export
+from .profiling import profiling_requested, profile_request, save_profile
+from .http_cache import file_validators, is_not_modified, cache_headers, version_etag
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the process-wide pipeline (shared Docling/LLM clients) once at startup."""
+    try:
+        app.state.pipeline = ContractPipeline()
+    except Exception as e:
+        # để /health báo lỗi cấu hình thay vì làm worker không khởi động được
+        logger.exception("Pipeline init failed at startup: %s", e)
+    yield
+
+
+app = FastAPI(title="Hotel Contract Pipeline (OOP)", lifespan=lifespan)
+
+
 def get_pipeline() -> ContractPipeline:
-    return ContractPipeline()
+    pipe = getattr(app.state, "pipeline", None)
+    if pipe is None:
+        pipe = app.state.pipeline = ContractPipeline()
+    return pipe
+
+
+def _store_profile(prof, response: Response, contract_id: str, version: Optional[int]) -> None:
+    if prof is None or version is None:
+        return
+    try:
+        paths = save_profile(prof, contract_id, version)
+        # đường dẫn tương đối trong DATA_DIR/steps, không lộ filesystem của server
+        response.headers["X-Profile-Timeline"] = paths["timeline_rel"]
+    except Exception:
+        logger.warning("Failed to save profile: contract_id=%s version=%s", contract_id, version, exc_info=True)
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint to verify service and configuration readiness.
 
-    Returns a simple JSON with status="ok" if the pipeline can be constructed.
+    Returns a simple JSON with status="ok" if the shared pipeline is available.
 
     Returns:
         dict: {"status": "ok"} when healthy.
@@ -38,25 +74,66 @@ async def health_check():
         raise HTTPException(status_code=500, detail=f"config_error: {e}")
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text exposition of stage latency, bytes, LLM tokens, cache and queue metrics."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/llm/scheduler")
+async def llm_scheduler_stats():
+    """Expose the process-wide LLM scheduler state.
+
+    Returns:
+        dict: Queue depth (total and per priority), in-flight calls, current
+        concurrency limit, remaining rate budgets and outcome counters.
+    """
+    return get_scheduler().stats()
+
+
+@app.get("/docling/backends")
+async def docling_backends():
+    """Expose the Docling backend pool state.
+
+    Returns:
+        dict: Per backend URL: in rotation or ejected (and for how long),
+        outstanding conversions, consecutive failures, latency EWMA and
+        request/error/ejection/hedge counters.
+    """
+    return get_pool().stats()
+
+
 @app.post("/contracts/base/ingest")
-async def ingest_base_contract(file: UploadFile = File(...)):
+async def ingest_base_contract(request: Request, response: Response, file: UploadFile = File(...)):
     """Ingest a base contract PDF and create version 1.
 
+    With ``PROFILING_ENABLED`` an ``X-Profile`` header (or ``?profile=``) runs the
+    pipeline under cProfile and stores the profile and stage timeline in
+    ``DATA_DIR/steps/{contract_id}/v{version}/``.
+
     Args:
         file (UploadFile): PDF file for the base contract.
 
+    Uploads are serialized per contract (across workers), and re-uploading the
+    same PDF bytes returns the existing version with ``"duplicate": true``.
+
     Returns:
         dict: {"contract_id": str, "version": int}
 
     Raises:
-        HTTPException: 500 on processing errors.
+        HTTPException: 409 if the contract stays locked by another ingest; 500 on processing errors.
     """
     content = await file.read()
     logger.info("Ingest base request: filename=%s, bytes=%s", file.filename, len(content))
     try:
         pipe = get_pipeline()
-        result = await pipe.ingest_base(file.filename, content)
+        async with profile_request("ingest_base", profiling_requested(request.headers, request.query_params)) as prof:
+            result = await pipe.ingest_base(file.filename, content)
+        _store_profile(prof, response, result["contract_id"], result["version"])
         logger.info("Ingest base done: contract_id=%s version=%s", result.get("contract_id"), result.get("version"))
+    except ContractLockTimeout as e:
+        logger.warning("Ingest base busy: %s", e)
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.exception("Ingest base failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -64,9 +141,13 @@ async def ingest_base_contract(file: UploadFile = File(...)):
 
 
 @app.post("/contracts/{contract_id}/addenda/ingest")
-async def ingest_addendum_document(contract_id: str, file: UploadFile = File(...)):
+async def ingest_addendum_document(contract_id: str, request: Request, response: Response, file: UploadFile = File(...)):
     """Ingest an addendum PDF and merge its changes into a new version.
 
+    Addenda of one contract are merged one at a time (across workers); a
+    repeated upload of the same PDF returns the existing version with
+    ``"duplicate": true``.
+
     Args:
         contract_id (str): Existing contract identifier.
         file (UploadFile): PDF file of the addendum.
@@ -75,70 +156,466 @@ async def ingest_addendum_document(contract_id: str, file: UploadFile = File(...
         dict: {"contract_id": str, "version": int, "outputs": {"markdown": str, "redline": Optional[str]}}
 
     Raises:
-        HTTPException: 404 if contract/version not found; 500 on processing errors.
+        HTTPException: 404 if contract/version not found; 409 if the contract stays locked; 500 on processing errors.
     """
     logger.info("Ingest addendum request: contract_id=%s, filename=%s", contract_id, file.filename)
     content = await file.read()
     try:
         pipe = get_pipeline()
-        result = await pipe.ingest_addendum(contract_id, file.filename, content)
+        async with profile_request("ingest_addendum", profiling_requested(request.headers, request.query_params)) as prof:
+            result = await pipe.ingest_addendum(contract_id, file.filename, content)
+        _store_profile(prof, response, contract_id, result["version"])
         logger.info("Ingest addendum done: contract_id=%s version=%s", result.get("contract_id"), result.get("version"))
     except FileNotFoundError as e:
         logger.warning("Ingest addendum not found: %s", e)
         raise HTTPException(status_code=404, detail=str(e))
+    except ContractLockTimeout as e:
+        logger.warning("Ingest addendum busy: %s", e)
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.exception("Ingest addendum failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
     return result
 
 
+@app.post("/contracts/{contract_id}/reprocess")
+async def reprocess_contract(contract_id: str, from_stage: str = "merge", from_version: int = 1):
+    """Rebuild versions from saved step artifacts, without calling Docling again.
+
+    Versions ``from_version``..latest are redone from ``from_stage``: ``render``
+    (markdown/redline only), ``merge`` (saved base model / changeset), ``extract``
+    (saved raw LLM output, repairs re-applied) or ``segment`` (saved Docling
+    markdown, LLM called again). For many contracts use ``python -m app.reprocess``.
+
+    Args:
+        contract_id (str): Contract identifier.
+        from_stage (str): ``segment``, ``extract``, ``merge`` (default) or ``render``.
+        from_version (int): First version to rebuild (default 1).
+
+    Returns:
+        dict: {"contract_id": str, "from_stage": str, "versions": List[int]}
+
+    Raises:
+        HTTPException: 400 on unknown stage or version; 404 if the contract or a needed step artifact is missing;
+            409 if the contract stays locked; 500 on processing errors.
+    """
+    try:
+        pipe = get_pipeline()
+        return await pipe.reprocess(contract_id, from_stage=from_stage, from_version=from_version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        logger.warning("Reprocess not found: %s", e)
+        raise HTTPException(status_code=404, detail=str(e))
+    except ContractLockTimeout as e:
+        logger.warning("Reprocess busy: %s", e)
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.exception("Reprocess failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _state_validators(pipe: ContractPipeline, contract_id: str, as_of: Optional[date],
+                      query: Optional[readmodel.StateQuery] = None):
+    try:
+        version, mtime_ns = pipe.get_state_validators(contract_id)
+    except FileNotFoundError as e:
+        logger.warning("Get state not found: %s", e)
+        raise HTTPException(status_code=404, detail=str(e))
+    # tham số lọc/chiếu/phân trang là một phần của ETag; state đầy đủ giữ ETag cũ
+    key = query.key() if query is not None else None
+    parts = (as_of.isoformat() if as_of else None,) + ((key,) if key is not None else ())
+    etag = version_etag(contract_id, version, mtime_ns, *parts)
+    headers = cache_headers(etag, formatdate(mtime_ns / 1e9, usegmt=True))
+    headers["X-Contract-Version"] = str(version)
+    return version, etag, mtime_ns / 1e9, headers
+
+
+def _state_query(clause_type: Optional[List[str]], fields: Optional[str], offset: int, limit: Optional[int],
+                 rates_from: Optional[date], rates_to: Optional[date]) -> readmodel.StateQuery:
+    # clause_type lặp lại được hoặc phân tách bằng dấu phẩy
+    types = [t.strip() for v in clause_type or [] for t in v.split(",") if t.strip()]
+    names = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    try:
+        return readmodel.StateQuery(types or None, names or None, offset, limit, rates_from, rates_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/contracts/{contract_id}/state")
-async def get_contract_state(contract_id: str, as_of: Optional[date] = None):
-    """Get the contract state, optionally as of a specific date.
+async def get_contract_state(
+    contract_id: str,
+    request: Request,
+    as_of: Optional[date] = None,
+    clause_type: Optional[List[str]] = Query(None),
+    fields: Optional[str] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    rates_from: Optional[date] = None,
+    rates_to: Optional[date] = None,
+):
+    """Get the contract state, optionally as of a specific date, filtered and projected.
+
+    The strong ETag is derived from (contract_id, latest version, as_of, query
+    parameters) and the version file's mtime, so ``If-None-Match`` is answered
+    with 304 without loading the contract. Bodies larger than one block are
+    streamed while clauses are serialized.
 
     Args:
         contract_id (str): Contract identifier.
         as_of (date, optional): Date to filter effective clauses.
+        clause_type (List[str], optional): Keep only these clause types (repeatable or comma-separated).
+        fields (str, optional): Comma-separated clause fields to return; ``id`` is always included.
+        offset (int): Clauses to skip after filtering (default 0).
+        limit (int, optional): Maximum clauses to return.
+        rates_from (date, optional): Keep rate rows and dated policy entries ending on/after this date.
+        rates_to (date, optional): Keep rate rows and dated policy entries starting on/before this date.
 
     Returns:
-        JSONResponse: Contract as JSON.
+        Response: Contract JSON (same shape, selected clauses only), with
+        ETag/Last-Modified/X-Contract-Version and X-Total-Clauses headers, plus
+        X-Next-Offset when more clauses follow.
 
     Raises:
-        HTTPException: 404 if contract not found; 500 on processing errors.
+        HTTPException: 400 on unknown clause type/field or invalid paging/window; 404 if contract not found;
+            500 on processing errors.
     """
+    pipe = get_pipeline()
+    query = _state_query(clause_type, fields, offset, limit, rates_from, rates_to)
+    version, etag, mtime, headers = _state_validators(pipe, contract_id, as_of, query)
+    if is_not_modified(request.headers, etag, mtime):
+        metrics.cache_result("state_etag", hit=True)
+        return Response(status_code=304, headers=headers)
+    metrics.cache_result("state_etag", hit=False)
     try:
-        pipe = get_pipeline()
-        result = pipe.get_state(contract_id, as_of=as_of.isoformat() if as_of else None)
+        async with profile_request("get_state", profiling_requested(request.headers, request.query_params)) as prof:
+            result = pipe.get_state_view(contract_id, as_of=as_of.isoformat() if as_of else None, version=version)
+            clauses, total = query.page(result)
+            blocks = readmodel.iter_json(result, clauses, query)
+            first = next(blocks)
+            second = next(blocks, None)
     except FileNotFoundError as e:
         logger.warning("Get state not found: %s", e)
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.exception("Get state failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
-    return JSONResponse(content=result.model_dump(mode="json"))
+    headers["X-Total-Clauses"] = str(total)
+    if query.offset + len(clauses) < total:
+        headers["X-Next-Offset"] = str(query.offset + len(clauses))
+    if second is None:
+        response = Response(content=first, media_type="application/json", headers=headers)
+    else:
+        # phần còn lại được serialize trong lúc gửi
+        response = StreamingResponse(itertools.chain((first, second), blocks), media_type="application/json", headers=headers)
+    _store_profile(prof, response, contract_id, version)
+    return response
+
+
+@app.head("/contracts/{contract_id}/state")
+async def head_contract_state(
+    contract_id: str,
+    request: Request,
+    as_of: Optional[date] = None,
+    clause_type: Optional[List[str]] = Query(None),
+    fields: Optional[str] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    rates_from: Optional[date] = None,
+    rates_to: Optional[date] = None,
+):
+    """Validators of the contract state (ETag, Last-Modified, X-Contract-Version) without a body.
+
+    Accepts the same query parameters as GET, which are part of the ETag.
+
+    Raises:
+        HTTPException: 400 on invalid query parameters; 404 if contract not found.
+    """
+    pipe = get_pipeline()
+    query = _state_query(clause_type, fields, offset, limit, rates_from, rates_to)
+    _, etag, mtime, headers = _state_validators(pipe, contract_id, as_of, query)
+    status = 304 if is_not_modified(request.headers, etag, mtime) else 200
+    return Response(status_code=status, headers=headers)
+
+
+@app.get("/contracts/{contract_id}/version")
+async def get_contract_version(contract_id: str, request: Request, as_of: Optional[date] = None):
+    """Cheap version check: latest version and the state ETag, without loading the contract.
+
+    Args:
+        contract_id (str): Contract identifier.
+        as_of (date, optional): Included in the ETag exactly as for ``/state``.
+
+    Returns:
+        dict: {"contract_id": str, "version": int, "etag": str}
+
+    Raises:
+        HTTPException: 404 if contract not found.
+    """
+    pipe = get_pipeline()
+    version, etag, mtime, headers = _state_validators(pipe, contract_id, as_of)
+    if is_not_modified(request.headers, etag, mtime):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content={"contract_id": contract_id, "version": version, "etag": etag}, headers=headers)
 
 
 @app.get("/contracts/{contract_id}/versions/{version}/redline")
-async def get_contract_redline(contract_id: str, version: int):
-    """Generate a redline diff between the specified version and the previous one.
+async def get_contract_redline(
+    contract_id: str,
+    version: int,
+    request: Request,
+    response: Response,
+    base: Optional[int] = None,
+    format: str = "markdown",
+):
+    """Generate a field-level redline between the specified version and a base version.
 
     Args:
         contract_id (str): Contract identifier.
-        version (int): Version number to compare against (previous version is version-1).
+        version (int): Version number to compare.
+        base (Optional[int]): Version to compare against; defaults to version-1.
+        format (str): ``markdown`` (default) or ``json`` for the structured diff.
 
     Returns:
-        dict: {"redline": str}
+        dict: {"redline": str} for markdown, or the structured diff
+        ({"contract_id", "from_version", "to_version", "meta", "summary", "clauses"}) for json.
 
     Raises:
-        HTTPException: 404 if version not found; 500 on processing errors.
+        HTTPException: 400 on unknown format; 404 if version not found; 500 on processing errors.
     """
+    if format not in ("markdown", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'markdown' or 'json'")
     try:
         pipe = get_pipeline()
-        content = pipe.get_redline(contract_id, version)
+        async with profile_request("get_redline", profiling_requested(request.headers, request.query_params)) as prof:
+            if format == "json":
+                content = pipe.get_diff(contract_id, version, base_version=base)
+            else:
+                content = pipe.get_redline(contract_id, version, base_version=base)
+        _store_profile(prof, response, contract_id, version)
     except FileNotFoundError as e:
         logger.warning("Get redline not found: %s", e)
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         logger.exception("Get redline failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
-    return {"redline": content}
\ No newline at end of file
+    if format == "json":
+        return content
+    return {"redline": content}
+
+
+def _serve_render(request: Request, contract_id: str, version: int, kind: str) -> Response:
+    try:
+        pipe = get_pipeline()
+        path = pipe.get_render_path(contract_id, version, kind=kind)
+        etag, last_modified, mtime = file_validators(path)
+    except FileNotFoundError as e:
+        logger.warning("Get render not found: %s", e)
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.exception("Get render failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    headers = cache_headers(etag, last_modified)
+    if is_not_modified(request.headers, etag, mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="text/markdown; charset=utf-8", headers=headers)
+
+
+@app.get("/contracts/{contract_id}/versions/{version}/markdown")
+async def get_contract_markdown(contract_id: str, version: int, request: Request):
+    """Stream the stored markdown render of a version.
+
+    The file under ``renders/{contract_id}/v{version}.md`` is generated once if
+    missing. Supports ``If-None-Match``/``If-Modified-Since`` (304).
+
+    Returns:
+        FileResponse: ``text/markdown`` with ETag and Last-Modified headers.
+
+    Raises:
+        HTTPException: 404 if version not found; 500 on processing errors.
+    """
+    return _serve_render(request, contract_id, version, "markdown")
+
+
+@app.get("/contracts/{contract_id}/versions/{version}/redline.md")
+async def get_contract_redline_markdown(contract_id: str, version: int, request: Request):
+    """Stream the stored redline (version vs version-1) as markdown.
+
+    Returns:
+        FileResponse: ``text/markdown`` with ETag and Last-Modified headers.
+
+    Raises:
+        HTTPException: 404 if version not found; 500 on processing errors.
+    """
+    return _serve_render(request, contract_id, version, "redline")
+
+
+@app.get("/changes")
+async def list_changes(since: Optional[str] = None, limit: int = 100, contract_id: Optional[str] = None):
+    """Saved versions after a cursor, oldest first, from the append-only change feed.
+
+    Each entry carries contract_id, version, source_doc, the added/removed/modified
+    counts, the changed clauses with their date windows and its own ``cursor``.
+    Keep ``next_cursor`` and pass it as ``since`` on the next call.
+
+    Args:
+        since (str, optional): Cursor from a previous call; empty for the start, ``latest`` for only new entries.
+        limit (int): Max entries (max 1000).
+        contract_id (str, optional): Only entries of this contract.
+
+    Returns:
+        dict: {"changes": [...], "next_cursor": str}
+
+    Raises:
+        HTTPException: 400 on an invalid cursor; 500 on read errors.
+    """
+    try:
+        pipe = get_pipeline()
+        return pipe.versioning.read_changes(changes.parse_cursor(since), limit=limit, contract_id=contract_id)
+    except changes.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Read changes failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/changes/stream")
+async def stream_changes(request: Request, since: Optional[str] = None, contract_id: Optional[str] = None):
+    """Server-sent events of the change feed (``event: change``, ``id`` = cursor).
+
+    Starts at ``since`` or the ``Last-Event-ID`` header (reconnects resume where
+    they stopped); without either only new entries are sent.
+
+    Raises:
+        HTTPException: 400 on an invalid cursor.
+    """
+    try:
+        start = changes.parse_cursor(request.headers.get("last-event-id") or since or "latest")
+        # kiểm tra cursor trước khi mở stream
+        changes.read_changes(start, limit=1)
+    except changes.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        changes.iter_sse(start, contract_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/export/rates")
+async def export_rates(
+    format: str = "ndjson",
+    as_of: Optional[date] = None,
+    contract_id: Optional[List[str]] = Query(default=None),
+    hotel: Optional[str] = None,
+    currency: Optional[str] = None,
+    clause_type: Optional[str] = None,
+    since: Optional[str] = None,
+    since_version: Optional[int] = None,
+):
+    """Stream effective rate rows (contract, scope, date window, rate, currency, stop-sell, promotions).
+
+    Rows are rate-table rows still running on or after ``as_of``; contracts are
+    read one at a time. With ``since`` (change-feed cursor) or ``since_version``
+    only changed rows are sent, each with ``op`` = ``upsert`` or ``delete``; the
+    cursor to use next time is returned in ``X-Change-Cursor``.
+
+    Args:
+        format (str): ``ndjson`` (default) or ``csv``.
+        as_of (date, optional): Defaults to today.
+        contract_id (List[str], optional): Restrict to these contracts (repeatable).
+        hotel, currency, clause_type (str, optional): Portfolio filters as in ``/portfolio/contracts``.
+        since (str, optional): Change-feed cursor for delta mode.
+        since_version (int, optional): Compare each contract with this version instead.
+
+    Returns:
+        StreamingResponse: ``application/x-ndjson`` or ``text/csv``.
+
+    Raises:
+        HTTPException: 400 on unknown format, invalid cursor or both delta modes.
+    """
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    if since is not None and since_version is not None:
+        raise HTTPException(status_code=400, detail="use either since or since_version")
+    headers = {}
+    since_changes = None
+    if since is not None:
+        try:
+            since_changes, next_cursor = await asyncio.to_thread(export.changed_since, changes.parse_cursor(since))
+        except changes.InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers["X-Change-Cursor"] = str(next_cursor)
+    rows = export.iter_rows(as_of, contract_id, hotel, currency, clause_type,
+                            since_version=since_version, since_changes=since_changes)
+    body = export.iter_encoded(rows, format, delta=since_changes is not None or since_version is not None)
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+@app.get("/portfolio/contracts")
+async def list_portfolio_contracts(
+    hotel: Optional[str] = None,
+    currency: Optional[str] = None,
+    clause_type: Optional[str] = None,
+    on: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+):
+    """List contracts across the portfolio from the secondary index (latest state of each contract).
+
+    Args:
+        hotel (str, optional): Hotel name (case/whitespace-insensitive exact match).
+        currency (str, optional): Contract or rate-table currency.
+        clause_type (str, optional): Keep contracts having a clause of this type.
+        on (date, optional): Keep contracts with a clause (of ``clause_type`` if given) in effect on this date.
+        cursor (str, optional): ``next_cursor`` from the previous page.
+        limit (int): Page size (max 500).
+
+    Returns:
+        dict: {"items": [{"contract_id", "version", "hotel", "currency", ...}], "next_cursor": Optional[str]}
+
+    Raises:
+        HTTPException: 500 on index errors.
+    """
+    try:
+        pipe = get_pipeline()
+        return pipe.versioning.query_portfolio(
+            hotel=hotel, currency=currency, clause_type=clause_type, on=on, cursor=cursor, limit=limit
+        )
+    except Exception as e:
+        logger.exception("Portfolio query failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/search")
+async def search_contracts(
+    q: str,
+    contract_id: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+):
+    """Full-text search over clauses (latest state) and source markdown, diacritic-insensitive.
+
+    Args:
+        q (str): Words to match (all required, last one as prefix); wrap in quotes for a phrase.
+        contract_id (str, optional): Restrict to one contract.
+        kind (str, optional): ``clause`` or ``markdown``.
+        limit (int): Max hits (max 200).
+        offset (int): Hits to skip.
+
+    Returns:
+        dict: {"query": str, "hits": [{"contract_id", "version", "kind", "clause_id", "title", "snippet", "score"}]}
+
+    Raises:
+        HTTPException: 400 on unknown kind; 500 on index errors.
+    """
+    if kind not in (None, "clause", "markdown"):
+        raise HTTPException(status_code=400, detail="kind must be 'clause' or 'markdown'")
+    try:
+        pipe = get_pipeline()
+        return pipe.versioning.search(q, contract_id=contract_id, kind=kind, limit=limit, offset=offset)
+    except Exception as e:
+        logger.exception("Search failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -4,8 +4,6 @@ from dataclasses import dataclass
 from datetime import date, timedelta
 from typing import List, Dict, Any, Optional
 
-from rapidfuzz import fuzz
-
 from .models import Clause, BaseContract, ChangeSet, ChangeType, RateRow
 
 
@@ -51,6 +49,8 @@ def match_targets(clauses: List[Clause], target) -> List[Clause]:
     tgt_sig = scope_signature(target.scope)
     if not tgt_sig:
         return candidates
+    from rapidfuzz import fuzz  # lazy: chỉ cần khi match theo scope
+
     results: List[MatchResult] = []
     for c in candidates:
         score = fuzz.token_set_ratio(tgt_sig, scope_signature(c.scope))
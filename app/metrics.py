@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+# Registry tối giản, xuất định dạng text của Prometheus; không cần prometheus_client.
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items)
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        k = _key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_key(labels)] = float(value)
+
+
+class CallbackGauge(_Metric):
+    """Gauge whose samples are read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Dict[LabelKey, float]]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[LabelKey, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        k = _key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(k) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[idx] += 1
+            self._values[k] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(_key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        out: List[str] = []
+        with self._lock:
+            items = [(k, list(c), s) for k, (c, s) in self._values.items()]
+        for k, counts, total in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', _fmt_value(bound)))} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(k)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(k)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            samples = m.samples()
+            if not samples:
+                continue
+            lines.extend(m.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram("contract_stage_duration_seconds", "Latency of pipeline stages and external calls."))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge("contract_stage_in_flight", "Stage executions currently running."))
+STAGE_ERRORS = REGISTRY.register(Counter("contract_stage_errors_total", "Stage executions that raised."))
+STAGE_BYTES = REGISTRY.register(Counter("contract_stage_bytes_total", "Bytes read (in) or written/sent (out) per stage."))
+LLM_TOKENS = REGISTRY.register(Counter("contract_llm_tokens_total", "LLM token usage reported by the API."))
+CACHE_REQUESTS = REGISTRY.register(Counter("contract_cache_requests_total", "Cache lookups by cache and result (hit/miss)."))
+
+
+# timeline theo request (bật khi profiling); list dùng chung với thread của asyncio.to_thread
+_timeline: contextvars.ContextVar[Optional[List[Dict[str, object]]]] = contextvars.ContextVar("stage_timeline", default=None)
+_timeline_origin: contextvars.ContextVar[float] = contextvars.ContextVar("stage_timeline_origin", default=0.0)
+
+
+def start_timeline():
+    """Start collecting a wall-clock stage timeline in the current context."""
+    return _timeline.set([]), _timeline_origin.set(time.perf_counter())
+
+
+def stop_timeline(tokens) -> List[Dict[str, object]]:
+    events = _timeline.get() or []
+    _timeline.reset(tokens[0])
+    _timeline_origin.reset(tokens[1])
+    return sorted(events, key=lambda e: e["start_ms"])
+
+
+@contextmanager
+def track(stage: str) -> Iterator[None]:
+    """Time a stage: latency histogram, in-flight gauge and error counter."""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        timeline = _timeline.get()
+        if timeline is not None:
+            timeline.append({
+                "stage": stage,
+                "start_ms": round((t0 - _timeline_origin.get()) * 1000.0, 3),
+                "duration_ms": round(elapsed * 1000.0, 3),
+                "ok": ok,
+            })
+
+
+def timed(stage: str):
+    """Decorator form of :func:`track` for sync and async callables."""
+
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with track(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return deco
+
+
+def add_bytes(stage: str, direction: str, n: int) -> None:
+    STAGE_BYTES.inc(n, stage=stage, direction=direction)
+
+
+def record_llm_usage(usage: Optional[Dict[str, object]], mode: str) -> None:
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind)
+        if value is not None:
+            LLM_TOKENS.inc(float(value), kind=kind.split("_")[0], mode=mode)
+
+
+def cache_result(cache: str, hit: bool, n: int = 1) -> None:
+    if n:
+        CACHE_REQUESTS.inc(n, cache=cache, result="hit" if hit else "miss")
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,335 @@
+"""Local pre-flight inspection of a PDF to pick the Docling OCR settings.
+
+A small stdlib-only reader (regex over the object table + zlib for
+``FlateDecode`` streams): it walks the page tree, decodes each page's content
+streams (and the form XObjects they draw) and counts the characters shown by
+text operators, the images drawn and the ruling-line path operators.
+
+- every page has a text layer and no page draws an image → ``do_ocr=False``
+  (Docling reads the text layer)
+- no page has one (scanned, or text drawn as vector outlines) → ``do_ocr=True, force_ocr=True``
+- otherwise (image-only or empty pages, or text pages that also draw images,
+  e.g. a scanned rate table pasted into a digital contract) → ``do_ocr=True``
+  (Docling OCRs only the bitmap regions)
+- ``table_mode="accurate"`` when some page has ruled tables or draws images, else ``fast``
+
+Anything the reader cannot decode (encryption, other filters, broken files)
+falls back to the previous always-OCR defaults.
+
+    python -m app.pdf_triage contract.pdf
+"""
+from __future__ import annotations
+
+import json
+import re
+import sys
+import zlib
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# số ký tự tối thiểu để coi một trang có text layer (bỏ qua số trang, header lẻ)
+MIN_PAGE_CHARS = 40
+# số thao tác vẽ đường/khung (re, l) cho thấy trang có bảng kẻ ô
+MIN_RULING_OPS = 12
+MAX_FORM_DEPTH = 3
+
+DEFAULT_PARAMS = {"do_ocr": True, "force_ocr": False, "table_mode": "accurate"}
+
+_OBJ_RE = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+_REF_RE = re.compile(rb"(\d+)\s+\d+\s+R\b")
+_STREAM_RE = re.compile(rb"\bstream\r?\n")
+_TEXT_BLOCK_RE = re.compile(rb"\bBT\b(.*?)\bET\b", re.DOTALL)
+_LITERAL_RE = re.compile(rb"\((?:\\.|[^\\()])*\)", re.DOTALL)
+_HEX_RE = re.compile(rb"<([0-9A-Fa-f\s]*)>")
+_DO_RE = re.compile(rb"/([^\s/<>\[\]()]+)\s+Do\b")
+_INLINE_IMAGE_RE = re.compile(rb"\bBI\b.*?\bID\b", re.DOTALL)
+_RULING_RE = re.compile(rb"\s(?:re|l)\s")
+_NAME_TYPE_RE = re.compile(rb"/Type\s*/(\w+)")
+
+
+class PdfUnreadable(ValueError):
+    """The file cannot be inspected with the local reader."""
+
+
+@dataclass
+class PageInfo:
+    page: int
+    text_chars: int = 0
+    images: int = 0
+    ruling_ops: int = 0
+    decoded: bool = True
+
+    @property
+    def status(self) -> str:
+        if self.text_chars >= MIN_PAGE_CHARS:
+            # text layer + ảnh: ảnh có thể là bảng giá scan, vẫn cần OCR
+            return "mixed" if self.images else "text"
+        if self.images:
+            return "image"
+        return "empty" if self.decoded else "unknown"
+
+
+@dataclass
+class Triage:
+    pages: int
+    text_pages: int
+    image_pages: List[int]
+    text_coverage: float
+    params: Dict[str, Any]
+    reason: str
+    page_info: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class _Pdf:
+    def __init__(self, data: bytes):
+        self.objects: Dict[int, Tuple[bytes, Optional[bytes]]] = {}
+        self._decoded: Dict[int, Optional[bytes]] = {}
+        self._scan(data)
+
+    def _scan(self, data: bytes) -> None:
+        pos = 0
+        for m in _OBJ_RE.finditer(data):
+            if m.start() < pos:
+                continue  # khớp nhầm bên trong stream của object trước
+            end = data.find(b"endobj", m.end())
+            if end < 0:
+                break
+            body = data[m.end():end]
+            s = _STREAM_RE.search(body)
+            if s is not None and b"<<" in body[:s.start()]:
+                head, stream = body[:s.start()], body[s.end():body.rfind(b"endstream")]
+            else:
+                head, stream = body, None
+            # bản cập nhật tăng dần ghi lại object ở cuối file: bản sau thắng
+            self.objects[int(m.group(1))] = (head, stream)
+            pos = end
+        for num, (head, stream) in list(self.objects.items()):
+            if stream is not None and re.search(rb"/Type\s*/ObjStm", head):
+                self._unpack_object_stream(num, head)
+
+    def _unpack_object_stream(self, num: int, head: bytes) -> None:
+        raw = self.stream(num)
+        n, first = _int(head, b"/N"), _int(head, b"/First")
+        if raw is None or n is None or first is None:
+            return
+        ints = [int(x) for x in raw[:first].split()[: 2 * n]]
+        offsets = ints[1::2] + [len(raw) - first]
+        for i, obj_num in enumerate(ints[0::2]):
+            self.objects.setdefault(obj_num, (raw[first + offsets[i]:first + offsets[i + 1]].strip(), None))
+
+    def head(self, num: int) -> bytes:
+        return self.objects.get(num, (b"", None))[0]
+
+    def stream(self, num: int) -> Optional[bytes]:
+        """Decoded stream data, None when absent or not decodable here."""
+        if num in self._decoded:
+            return self._decoded[num]
+        head, raw = self.objects.get(num, (b"", None))
+        out: Optional[bytes] = None
+        if raw is not None:
+            filters = re.findall(rb"/(\w+Decode|Fl|LZW|DCT)\b", _value(head, b"/Filter") or b"")
+            if not filters:
+                out = raw
+            elif filters in ([b"FlateDecode"], [b"Fl"]) and _value(head, b"/DecodeParms") is None:
+                try:
+                    out = zlib.decompressobj().decompress(raw)
+                except zlib.error:
+                    out = None
+        self._decoded[num] = out
+        return out
+
+    def resolve(self, value: Optional[bytes]) -> Optional[bytes]:
+        if value is None:
+            return None
+        m = _REF_RE.fullmatch(value.strip())
+        return self.head(int(m.group(1))) if m else value
+
+
+def _value(head: bytes, key: bytes) -> Optional[bytes]:
+    """Raw value of ``key`` in a dictionary: a reference, ``<<...>>``, ``[...]`` or a single token."""
+    m = re.search(re.escape(key) + rb"(?![A-Za-z0-9])\s*", head)
+    if m is None:
+        return None
+    i = m.end()
+    ref = _REF_RE.match(head, i)
+    if ref:
+        return ref.group(0)
+    if head.startswith(b"<<", i) or head.startswith(b"[", i):
+        open_, close = (b"<<", b">>") if head.startswith(b"<<", i) else (b"[", b"]")
+        depth, j = 0, i
+        while j < len(head):
+            if head.startswith(open_, j):
+                depth += 1
+                j += len(open_)
+            elif head.startswith(close, j):
+                depth -= 1
+                j += len(close)
+                if depth == 0:
+                    return head[i:j]
+            else:
+                j += 1
+        return head[i:]
+    tok = re.match(rb"/?[^\s/<>\[\]()]+", head[i:])
+    return tok.group(0) if tok else None
+
+
+def _int(head: bytes, key: bytes) -> Optional[int]:
+    v = _value(head, key)
+    try:
+        return int(v) if v is not None else None
+    except ValueError:
+        return None
+
+
+def _pages(pdf: _Pdf) -> List[Tuple[int, Optional[bytes]]]:
+    """(page object number, resources dict) in document order, resources inherited from the tree."""
+    root = next((h for h, _ in pdf.objects.values() if re.search(rb"/Type\s*/Catalog", h)), None)
+    pages_ref = _value(root, b"/Pages") if root is not None else None
+    out: List[Tuple[int, Optional[bytes]]] = []
+    seen = set()
+
+    def walk(num: int, resources: Optional[bytes]) -> None:
+        if num in seen:
+            return
+        seen.add(num)
+        head = pdf.head(num)
+        resources = pdf.resolve(_value(head, b"/Resources")) or resources
+        t = _NAME_TYPE_RE.search(head)
+        if t is not None and t.group(1) == b"Page":
+            out.append((num, resources))
+            return
+        for kid in _REF_RE.findall(pdf.resolve(_value(head, b"/Kids")) or b""):
+            walk(int(kid), resources)
+
+    m = _REF_RE.fullmatch((pages_ref or b"").strip())
+    if m:
+        walk(int(m.group(1)), None)
+    if not out:
+        # cây trang hỏng: lấy mọi object /Type /Page theo số thứ tự
+        for num in sorted(pdf.objects):
+            t = _NAME_TYPE_RE.search(pdf.head(num))
+            if t is not None and t.group(1) == b"Page":
+                out.append((num, pdf.resolve(_value(pdf.head(num), b"/Resources"))))
+    return out
+
+
+def _text_chars(content: bytes) -> int:
+    n = 0
+    for block in _TEXT_BLOCK_RE.findall(content):
+        for lit in _LITERAL_RE.findall(block):
+            n += len(lit) - 2
+        for hx in _HEX_RE.findall(block):
+            n += len(re.sub(rb"\s", b"", hx)) // 2
+    return n
+
+
+def _analyze(pdf: _Pdf, content: bytes, resources: Optional[bytes], info: PageInfo, depth: int = 0) -> None:
+    info.text_chars += _text_chars(content)
+    outside = _TEXT_BLOCK_RE.sub(b" ", content)
+    info.ruling_ops += len(_RULING_RE.findall(outside))
+    info.images += len(_INLINE_IMAGE_RE.findall(outside))
+    xobjects = pdf.resolve(_value(resources or b"", b"/XObject")) or b""
+    for name in set(_DO_RE.findall(content)):
+        ref = _value(xobjects, b"/" + name)
+        m = _REF_RE.fullmatch(ref.strip()) if ref else None
+        if m is None:
+            continue
+        num = int(m.group(1))
+        head = pdf.head(num)
+        if re.search(rb"/Subtype\s*/Image", head):
+            info.images += 1
+        elif re.search(rb"/Subtype\s*/Form", head) and depth < MAX_FORM_DEPTH:
+            sub = pdf.stream(num)
+            if sub is None:
+                info.decoded = False
+                continue
+            _analyze(pdf, sub, pdf.resolve(_value(head, b"/Resources")) or resources, info, depth + 1)
+
+
+def inspect_pdf(data: bytes) -> List[PageInfo]:
+    """Per-page text/image/ruling counts; raises :class:`PdfUnreadable`."""
+    if not data.lstrip()[:5] == b"%PDF-":
+        raise PdfUnreadable("not a PDF")
+    if re.search(rb"/Encrypt\s", data[-4096:]) or re.search(rb"trailer\s*<<[^>]*/Encrypt", data):
+        raise PdfUnreadable("encrypted")
+    pdf = _Pdf(data)
+    pages = _pages(pdf)
+    if not pages:
+        raise PdfUnreadable("no pages found")
+    infos = []
+    for i, (num, resources) in enumerate(pages, start=1):
+        info = PageInfo(page=i)
+        contents = (_value(pdf.head(num), b"/Contents") or b"").strip()
+        single = _REF_RE.fullmatch(contents)
+        if single is not None and pdf.objects.get(int(single.group(1)), (b"", None))[1] is None:
+            contents = pdf.head(int(single.group(1)))  # mảng content stream đặt ở object riêng
+        refs = _REF_RE.findall(contents)
+        parts = []
+        for ref in refs:
+            part = pdf.stream(int(ref))
+            if part is None:
+                info.decoded = False
+            else:
+                parts.append(part)
+        _analyze(pdf, b"\n".join(parts), resources, info)
+        infos.append(info)
+    return infos
+
+
+def choose_params(pages: List[PageInfo]) -> Tuple[Dict[str, Any], str]:
+    statuses = [p.status for p in pages]
+    text = statuses.count("text") + statuses.count("mixed")
+    images = statuses.count("image")
+    mixed = statuses.count("mixed")
+    if "unknown" in statuses:
+        return dict(DEFAULT_PARAMS), "some page content could not be decoded"
+    ruled = any(p.ruling_ops >= MIN_RULING_OPS for p in pages)
+    table_mode = "accurate" if ruled or images or mixed else "fast"
+    empty = statuses.count("empty")
+    if statuses and statuses.count("text") == len(statuses):
+        return {"do_ocr": False, "force_ocr": False, "table_mode": table_mode}, "text layer on every page, no images"
+    if not text:
+        # trang "empty" có thể là chữ vẽ bằng vector outline: coi như bản scan
+        return {"do_ocr": True, "force_ocr": True, "table_mode": table_mode}, "no text layer (scanned or outlined text)"
+    return ({"do_ocr": True, "force_ocr": False, "table_mode": table_mode},
+            f"{images} image-only page(s), {mixed} text page(s) with images, {empty} page(s) without text")
+
+
+def triage_pdf(path: str) -> Triage:
+    """Inspect ``path`` and choose Docling OCR/table settings (defaults when unreadable)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        pages = inspect_pdf(data)
+    except PdfUnreadable as e:
+        logger.info("PDF triage fallback: file=%s reason=%s", path, e)
+        return Triage(0, 0, [], 0.0, dict(DEFAULT_PARAMS), f"unreadable: {e}")
+    except Exception as e:
+        # trình đọc tối giản: file lạ không được làm hỏng ingest
+        logger.warning("PDF triage failed: file=%s %s: %s", path, type(e).__name__, e)
+        return Triage(0, 0, [], 0.0, dict(DEFAULT_PARAMS), f"error: {type(e).__name__}")
+    params, reason = choose_params(pages)
+    text_pages = sum(1 for p in pages if p.status in ("text", "mixed"))
+    result = Triage(
+        pages=len(pages),
+        text_pages=text_pages,
+        image_pages=[p.page for p in pages if p.status == "image"],
+        text_coverage=round(text_pages / len(pages), 3),
+        params=params,
+        reason=reason,
+        page_info=[{**asdict(p), "status": p.status} for p in pages],
+    )
+    logger.info("PDF triage: file=%s pages=%s coverage=%s params=%s", path, result.pages, result.text_coverage, params)
+    return result
+
+
+if __name__ == "__main__":
+    for p in sys.argv[1:]:
+        print(json.dumps({"file": p, **triage_pdf(p).to_dict()}, indent=2))
@@ -1,20 +1,60 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import List, Optional
 
 from .services import (
     DoclingService,
     SegmentationService,
     ExtractionService,
+    RefinementService,
     ValidationService,
     MergeService,
     RenderService,
     VersioningService,
 )
-from .models import BaseContract, ChangeSet
+from .models import BaseContract, ChangeSet, Clause, Change, Chunk, Segment
+from .config import get_llm_streaming
+from .metrics import track, timed, add_bytes, cache_result
+from .diffing import DIFF_CACHE
+from .readmodel import CompactContract
+from .locks import contract_lock
+from . import structured
 import logging
 logger = logging.getLogger(__name__)
 import asyncio
+import hashlib
+import json
+import os
+
+
+# các stage có thể chạy lại từ artifact đã lưu, theo thứ tự của pipeline
+REPROCESS_STAGES = ("segment", "extract", "merge", "render")
+# tên step artifact của từng loại version (giống lúc ingest)
+STEP_NAMES = {
+    "base": {
+        "pdf_path": "01_pdf_path",
+        "triage": "01_pdf_triage",
+        "markdown": "02_docling_markdown",
+        "chunks": "03_chunks",
+        "refinements": "04_llm_refinements",
+        "extracted": "04_llm_extracted_base_raw_repaired",
+        "model": "05_base_contract_model",
+        "render": "06_render_markdown",
+    },
+    "addendum": {
+        "pdf_path": "02_pdf_path",
+        "triage": "02_pdf_triage",
+        "markdown": "03_docling_markdown",
+        "chunks": "04_chunks",
+        "selected": "04_chunks_selected",
+        "refinements": "05_llm_refinements",
+        "extracted": "05_llm_extracted_addendum_raw_repaired",
+        "model": "06_changeset_model",
+        "merged": "07_merged_state",
+        "render": "08_render_markdown",
+        "redline": "09_redline_markdown",
+    },
+}
 
 
 class ContractPipeline:
@@ -27,6 +67,8 @@ class ContractPipeline:
         merger: Optional[MergeService] = None,
         renderer: Optional[RenderService] = None,
         versioning: Optional[VersioningService] = None,
+        streaming: Optional[bool] = None,
+        refiner: Optional[RefinementService] = None,
     ):
         self.docling = docling or DoclingService()
         self.segmenter = segmenter or SegmentationService()
@@ -35,43 +77,103 @@ class ContractPipeline:
         self.merger = merger or MergeService()
         self.renderer = renderer or RenderService()
         self.versioning = versioning or VersioningService()
+        self.streaming = get_llm_streaming() if streaming is None else streaming
+        # dùng chung LLMClient (session, priority) với bước trích xuất
+        self.refiner = refiner or RefinementService(client=self.extractor.client)
 
-    async def ingest_base(self, filename: str, data: bytes) -> dict:
+    @timed("ingest_base")
+    async def ingest_base(self, filename: str, data: bytes, contract_id: Optional[str] = None) -> dict:
         logger.info("Pipeline ingest_base start: filename=%s", filename)
-        pdf_path = self.versioning.save_pdf(data, filename)
-        # pre-assign version for step logging; will persist state later
-        contract_id = filename.rsplit(".", 1)[0]
+        add_bytes("ingest_base", "in", len(data))
+        # mặc định contract_id lấy theo tên file; backfill truyền tên thư mục hợp đồng
+        contract_id = contract_id or filename.rsplit(".", 1)[0]
+        digest = hashlib.sha256(data).hexdigest()
+        # một ingest mỗi contract tại một thời điểm, kể cả giữa các worker
+        async with contract_lock(contract_id):
+            duplicate = self._find_ingested(contract_id, digest)
+            if duplicate is not None:
+                return duplicate
+            result = await self._ingest_base(contract_id, filename, data)
+            self.versioning.add_idempotency_key(contract_id, digest, result["version"])
+            return result
+
+    async def _ingest_base(self, contract_id: str, filename: str, data: bytes) -> dict:
+        # pre-assign version for step logging; will persist state later (under the contract lock)
         version = self.versioning.next_version_id(contract_id)
+        # lưu theo contract/version: upload cùng tên file của contract khác không ghi đè được
+        pdf_path = self.versioning.save_pdf(data, filename, contract_id=contract_id, version=version)
         self.versioning.save_step_text(contract_id, version, "00_input_filename", filename)
         self.versioning.save_step_text(contract_id, version, "01_pdf_path", pdf_path)
-        segments = await asyncio.to_thread(self.docling.parse_pdf, pdf_path)
+        params = await self._triage(pdf_path, contract_id, version, STEP_NAMES["base"]["triage"])
+        with track("pipeline.docling"):
+            segments = await asyncio.to_thread(self.docling.parse_pdf, pdf_path, params)
         # save raw markdown of first (and only) segment for traceability
         if segments:
             self.versioning.save_step_text(contract_id, version, "02_docling_markdown", segments[0].raw_md)
-        chunks = self.segmenter.segment(segments)
+        with track("pipeline.segment"):
+            chunks = self.segmenter.segment(segments)
         # save segmented chunks
         self.versioning.save_step_json(contract_id, version, "03_chunks", [c.model_dump(mode="json") for c in chunks])
-        extracted = await self.extractor.extract_base(chunks, source_file=pdf_path)
+        repairs: List[dict] = []
+        with track("pipeline.extract"):
+            if self.streaming:
+                extracted = await self._extract_streaming("base", chunks, pdf_path, contract_id, version, repairs)
+            else:
+                extracted = await self.extractor.extract_base(chunks, source_file=pdf_path, repairs=repairs)
+        await self._refine("base", extracted, repairs, chunks, contract_id, version)
         self.versioning.save_step_json(contract_id, version, "04_llm_extracted_base_raw_repaired", extracted)
         meta = (extracted.get("meta") or {}).copy()
         # đảm bảo có nguồn file trong meta
         meta["source_file"] = filename
         bc = BaseContract(
-            contract_id=filename.rsplit(".", 1)[0],
+            contract_id=contract_id,
             meta=meta,
             clauses=extracted.get("clauses", []),
         )
         self.versioning.save_step_json(contract_id, version, "05_base_contract_model", bc.model_dump(mode="json"))
         # removed validation step for base contract per requirement
-        self.versioning.save_contract_version(bc, version)
-        md = self.renderer.to_markdown(bc)
+        self.versioning.save_contract_version(bc, version, source_doc=filename)
+        self.versioning.add_chunk_hashes(contract_id, self.extractor.chunk_hashes(chunks))
+        self.versioning.index_source_markdown(contract_id, version, chunks)
+        with track("pipeline.render"):
+            md = self.renderer.to_markdown(bc)
         self.versioning.save_step_text(contract_id, version, "06_render_markdown", md)
         self.versioning.save_render(bc.contract_id, version, md, redline_md="")
         logger.info("Pipeline ingest_base done: contract_id=%s version=%s", bc.contract_id, version)
         return {"contract_id": bc.contract_id, "version": version}
 
+    @timed("ingest_addendum")
     async def ingest_addendum(self, contract_id: str, filename: str, data: bytes) -> dict:
         logger.info("Pipeline ingest_addendum start: contract_id=%s filename=%s", contract_id, filename)
+        add_bytes("ingest_addendum", "in", len(data))
+        digest = hashlib.sha256(data).hexdigest()
+        # merge luôn dựa trên version mới nhất: các addendum của một contract chạy tuần tự
+        async with contract_lock(contract_id):
+            duplicate = self._find_ingested(contract_id, digest, outputs=True)
+            if duplicate is not None:
+                return duplicate
+            result = await self._ingest_addendum(contract_id, filename, data)
+            self.versioning.add_idempotency_key(contract_id, digest, result["version"])
+            return result
+
+    def _find_ingested(self, contract_id: str, digest: str, outputs: bool = False) -> Optional[dict]:
+        """Result of an earlier ingest of the same PDF bytes, if its version still exists."""
+        version = self.versioning.load_idempotency_keys(contract_id).get(digest)
+        if version is None or self.versioning.version_mtime_ns(contract_id, version) is None:
+            cache_result("ingest_idempotency", hit=False)
+            return None
+        cache_result("ingest_idempotency", hit=True)
+        logger.info("Duplicate upload: contract_id=%s version=%s sha256=%s", contract_id, version, digest)
+        result = {"contract_id": contract_id, "version": version, "duplicate": True}
+        if outputs:
+            redline = self.versioning.render_path(contract_id, version, "redline")
+            result["outputs"] = {
+                "markdown": self.versioning.render_path(contract_id, version, "markdown"),
+                "redline": redline if os.path.exists(redline) else None,
+            }
+        return result
+
+    async def _ingest_addendum(self, contract_id: str, filename: str, data: bytes) -> dict:
         latest = self.versioning.latest_version(contract_id)
         if latest is None:
             logger.warning("No base contract found for contract_id=%s", contract_id)
@@ -84,32 +186,267 @@ class ContractPipeline:
         version = self.versioning.next_version_id(contract_id)
         self.versioning.save_step_text(contract_id, version, "00_input_filename", filename)
         self.versioning.save_step_json(contract_id, version, "01_loaded_base_version", base.model_dump(mode="json"))
-        pdf_path = self.versioning.save_pdf(data, filename)
+        pdf_path = self.versioning.save_pdf(data, filename, contract_id=contract_id, version=version)
         self.versioning.save_step_text(contract_id, version, "02_pdf_path", pdf_path)
-        segments = await asyncio.to_thread(self.docling.parse_pdf, pdf_path)
+        params = await self._triage(pdf_path, contract_id, version, STEP_NAMES["addendum"]["triage"])
+        with track("pipeline.docling"):
+            segments = await asyncio.to_thread(self.docling.parse_pdf, pdf_path, params)
         if segments:
             self.versioning.save_step_text(contract_id, version, "03_docling_markdown", segments[0].raw_md)
-        chunks = self.segmenter.segment(segments)
+        with track("pipeline.segment"):
+            chunks = self.segmenter.segment(segments)
         self.versioning.save_step_json(contract_id, version, "04_chunks", [c.model_dump(mode="json") for c in chunks])
-        extracted = await self.extractor.extract_addendum(chunks, source_file=pdf_path)
+        # chỉ gửi các chunk chưa xuất hiện ở tài liệu trước, ưu tiên chunk liên quan tới thay đổi
+        seen = self.versioning.load_chunk_hashes(contract_id)
+        prompt_chunks = self.extractor.select_addendum_chunks(chunks, seen_hashes=seen)
+        self.versioning.save_step_json(contract_id, version, "04_chunks_selected", [c.model_dump(mode="json") for c in prompt_chunks])
+        repairs: List[dict] = []
+        with track("pipeline.extract"):
+            if self.streaming:
+                extracted = await self._extract_streaming("addendum", prompt_chunks, pdf_path, contract_id, version, repairs)
+            else:
+                extracted = await self.extractor.extract_addendum(prompt_chunks, source_file=pdf_path, repairs=repairs)
+        await self._refine("addendum", extracted, repairs, chunks, contract_id, version)
         self.versioning.save_step_json(contract_id, version, "05_llm_extracted_addendum_raw_repaired", extracted)
         cs = ChangeSet(**extracted)
         self.versioning.save_step_json(contract_id, version, "06_changeset_model", cs.model_dump(mode="json"))
-        self.validator.validate_changeset(cs)
-        new_state = self.merger.merge(base, cs)
+        with track("pipeline.validate"):
+            self.validator.validate_changeset(cs)
+        with track("pipeline.merge"):
+            new_state = self.merger.merge(base, cs)
         self.versioning.save_step_json(contract_id, version, "07_merged_state", new_state.model_dump(mode="json"))
-        self.versioning.save_contract_version(new_state, version)
-        md = self.renderer.to_markdown(new_state)
-        self.versioning.save_step_text(contract_id, version, "08_render_markdown", md)
+        # diff tính trước khi lưu: dùng cho change feed rồi cho redline
         old = self.versioning.load_contract_version(contract_id, version - 1)
-        red = self.renderer.to_redline(old, new_state)
+        with track("pipeline.diff"):
+            diff = self.renderer.diff(old, new_state)
+        self.versioning.save_contract_version(new_state, version, diff=diff, source_doc=filename)
+        self.versioning.add_chunk_hashes(contract_id, self.extractor.chunk_hashes(chunks))
+        self.versioning.index_source_markdown(contract_id, version, chunks)
+        with track("pipeline.render"):
+            md = self.renderer.to_markdown(new_state)
+        self.versioning.save_step_text(contract_id, version, "08_render_markdown", md)
+        with track("pipeline.render"):
+            diff = self.get_diff(contract_id, version, computed=diff)
+            red = "\n".join(self.renderer.iter_diff_markdown(diff))
         self.versioning.save_step_text(contract_id, version, "09_redline_markdown", red)
         outputs = self.versioning.save_render(contract_id, version, md, redline_md=red)
         logger.info("Pipeline ingest_addendum done: contract_id=%s version=%s", contract_id, version)
         return {"contract_id": contract_id, "version": version, "outputs": outputs}
 
-    def get_state(self, contract_id: str, as_of: Optional[str] = None) -> BaseContract:
+    async def _triage(self, pdf_path: str, contract_id: str, version: int, step_name: str) -> Optional[dict]:
+        """Docling params chosen from a local look at the PDF (text layer, image-only pages), saved as a step."""
+        with track("pipeline.triage"):
+            triage = await asyncio.to_thread(self.docling.triage, pdf_path)
+        if triage is None:
+            return None
+        self.versioning.save_step_json(contract_id, version, step_name, triage)
+        return triage["params"]
+
+    async def _extract_streaming(self, mode: str, chunks: List[Chunk], pdf_path: str, contract_id: str, version: int,
+                                 repairs: Optional[List[dict]] = None) -> dict:
+        """Consume a streamed extraction, building and checking each element as it arrives.
+
+        Clauses/changes are turned into models (and changes validated) while the
+        LLM is still generating, so a bad element aborts the stream early. On any
+        failure the elements completed so far are kept as a step artifact.
+        """
+        if mode == "base":
+            doc: dict = {"clauses": []}
+            stream = self.extractor.stream_base(chunks, source_file=pdf_path, repairs=repairs)
+        else:
+            doc = {"changes": []}
+            stream = self.extractor.stream_addendum(chunks, source_file=pdf_path)
+        try:
+            async for key, value in stream:
+                if key == "clauses":
+                    Clause(**value)
+                    doc["clauses"].append(value)
+                elif key == "changes":
+                    self.validator.validate_change(Change(**value))
+                    doc["changes"].append(value)
+                else:
+                    doc[key] = value
+        except Exception:
+            logger.warning("Streaming extraction failed: contract_id=%s version=%s kept=%s", contract_id, version,
+                           len(doc.get("clauses") or doc.get("changes") or []))
+            self.versioning.save_step_json(contract_id, version, f"llm_stream_partial_{mode}", doc)
+            raise
+        finally:
+            await stream.aclose()
+        return doc
+
+    async def _refine(self, mode: str, extracted: dict, repairs: List[dict], chunks: List[Chunk],
+                      contract_id: str, version: int) -> None:
+        """Targeted re-extraction of low-confidence/defaulted items (REFINE_ENABLED); answers saved as a step."""
+        step = STEP_NAMES[mode]["refinements"]
+        if not self.refiner.enabled:
+            # trích xuất mới (reprocess từ segment): bỏ câu trả lời cũ để không bị áp dụng lại
+            if self.versioning.load_step_json(contract_id, version, step) is not None:
+                self.versioning.save_step_json(contract_id, version, step, [])
+            return
+        with track("pipeline.refine"):
+            results = await self.refiner.refine(extracted, mode, repairs, chunks)
+        self.versioning.save_step_json(contract_id, version, step, results)
+
+    @timed("reprocess")
+    async def reprocess(self, contract_id: str, from_stage: str = "merge", from_version: int = 1) -> dict:
+        """Re-run versions ``from_version``..latest from ``from_stage`` using the saved step artifacts.
+
+        ``render`` re-renders the stored states, ``merge`` rebuilds each state
+        from the saved base model / changeset, ``extract`` re-applies the
+        post-LLM repairs to the saved raw LLM output, and ``segment`` re-chunks
+        the saved Docling markdown and calls the LLM again (saved targeted
+        refinements are re-applied, not re-asked, below ``segment``). Docling is never
+        called. Every later version is redone because each merge builds on the
+        previous state.
+        """
+        if from_stage not in REPROCESS_STAGES:
+            raise ValueError(f"from_stage must be one of {', '.join(REPROCESS_STAGES)}")
+        async with contract_lock(contract_id):
+            latest = self.versioning.latest_version(contract_id)
+            if latest is None:
+                raise FileNotFoundError("Contract not found")
+            if not 1 <= from_version <= latest:
+                raise ValueError(f"from_version must be between 1 and {latest}")
+            logger.info("Reprocess start: contract_id=%s from_stage=%s versions=%s..%s", contract_id, from_stage, from_version, latest)
+            prev = self.versioning.load_contract_version(contract_id, from_version - 1) if from_version > 1 else None
+            versions = []
+            for version in range(from_version, latest + 1):
+                prev = await self._reprocess_version(contract_id, version, from_stage, prev)
+                versions.append(version)
+        logger.info("Reprocess done: contract_id=%s versions=%s", contract_id, versions)
+        return {"contract_id": contract_id, "from_stage": from_stage, "versions": versions}
+
+    def _version_kind(self, contract_id: str, version: int) -> str:
+        if self.versioning.load_step_text(contract_id, version, STEP_NAMES["addendum"]["pdf_path"]) is not None:
+            return "addendum"
+        if self.versioning.load_step_text(contract_id, version, STEP_NAMES["base"]["pdf_path"]) is not None:
+            return "base"
+        # version cũ không có step: chỉ render lại được, coi v1 là hợp đồng gốc
+        return "base" if version == 1 else "addendum"
+
+    def _require_step(self, contract_id: str, version: int, step_name: str, as_json: bool = False):
+        load = self.versioning.load_step_json if as_json else self.versioning.load_step_text
+        value = load(contract_id, version, step_name)
+        if value is None:
+            raise FileNotFoundError(f"Step {step_name} not saved for version {version}")
+        return value
+
+    def _seen_chunk_hashes(self, contract_id: str, version: int) -> set:
+        """Chunk hashes of the documents before ``version``, as they were when it was ingested."""
+        seen: set = set()
+        for v in range(1, version):
+            kind = self._version_kind(contract_id, v)
+            chunks = self.versioning.load_step_json(contract_id, v, STEP_NAMES[kind]["chunks"]) or []
+            seen.update(self.extractor.chunk_hashes([Chunk(**c) for c in chunks]))
+        return seen
+
+    def _saved_extraction(self, contract_id: str, version: int, kind: str, pdf_path: str) -> dict:
+        """Repaired extraction from the raw LLM output of this version, else the saved repaired step."""
+        steps = STEP_NAMES[kind]
+        raw = self.versioning.load_llm_output(pdf_path, kind)
+        # version cũ lưu PDF/raw phẳng theo tên file nên có thể đã bị tài liệu khác cùng tên ghi đè:
+        # chỉ dùng khi nó được ghi trong lúc ingest version này
+        started = self.versioning.step_mtime_ns(contract_id, version, "00_input_filename")
+        finished = self.versioning.step_mtime_ns(contract_id, version, steps["extracted"])
+        if raw is not None and started is not None and finished is not None and started <= raw[1] <= finished:
+            try:
+                # output lưu từ json_schema còn các field tự do dạng chuỗi JSON
+                extracted = self.extractor.repair(structured.decode(json.loads(raw[0]), kind), kind)
+            except ValueError:
+                logger.warning("Saved LLM output unreadable, using repaired step: contract_id=%s version=%s", contract_id, version)
+            else:
+                # câu trả lời refine đã lưu: áp dụng lại, không gọi LLM
+                refinements = self.versioning.load_step_json(contract_id, version, steps["refinements"])
+                return self.refiner.apply(extracted, refinements) if refinements else extracted
+        return self.extractor.repair(self._require_step(contract_id, version, steps["extracted"], as_json=True), kind)
+
+    async def _reprocess_version(self, contract_id: str, version: int, stage: str, prev: Optional[BaseContract]) -> BaseContract:
+        kind = self._version_kind(contract_id, version)
+        steps = STEP_NAMES[kind]
+        order = REPROCESS_STAGES.index(stage)
+        if order < REPROCESS_STAGES.index("render"):
+            if order <= REPROCESS_STAGES.index("extract"):
+                pdf_path = self._require_step(contract_id, version, steps["pdf_path"])
+                if stage == "segment":
+                    md = self._require_step(contract_id, version, steps["markdown"])
+                    with track("pipeline.segment"):
+                        chunks = self.segmenter.segment([Segment(page_range=[], heading=None, raw_md=md, table_blocks=[])])
+                    self.versioning.save_step_json(contract_id, version, steps["chunks"], [c.model_dump(mode="json") for c in chunks])
+                    repairs: List[dict] = []
+                    with track("pipeline.extract"):
+                        if kind == "base":
+                            extracted = await self.extractor.extract_base(chunks, source_file=pdf_path, repairs=repairs)
+                        else:
+                            prompt_chunks = self.extractor.select_addendum_chunks(
+                                chunks, seen_hashes=self._seen_chunk_hashes(contract_id, version))
+                            self.versioning.save_step_json(contract_id, version, steps["selected"],
+                                                           [c.model_dump(mode="json") for c in prompt_chunks])
+                            extracted = await self.extractor.extract_addendum(prompt_chunks, source_file=pdf_path, repairs=repairs)
+                    await self._refine(kind, extracted, repairs, chunks, contract_id, version)
+                    self.versioning.add_chunk_hashes(contract_id, self.extractor.chunk_hashes(chunks))
+                    self.versioning.index_source_markdown(contract_id, version, chunks)
+                else:
+                    extracted = self._saved_extraction(contract_id, version, kind, pdf_path)
+                self.versioning.save_step_json(contract_id, version, steps["extracted"], extracted)
+                if kind == "base":
+                    meta = (extracted.get("meta") or {}).copy()
+                    meta["source_file"] = self._require_step(contract_id, version, "00_input_filename")
+                    model = BaseContract(contract_id=contract_id, meta=meta, clauses=extracted.get("clauses", []))
+                else:
+                    model = ChangeSet(**extracted)
+                self.versioning.save_step_json(contract_id, version, steps["model"], model.model_dump(mode="json"))
+            else:
+                data = self._require_step(contract_id, version, steps["model"], as_json=True)
+                model = BaseContract(**data) if kind == "base" else ChangeSet(**data)
+            if kind == "base":
+                state = model
+            else:
+                if prev is None:
+                    raise FileNotFoundError(f"No state before version {version}")
+                with track("pipeline.validate"):
+                    self.validator.validate_changeset(model)
+                with track("pipeline.merge"):
+                    # merge sửa trực tiếp base; giữ prev nguyên vẹn cho redline
+                    state = self.merger.merge(prev.model_copy(deep=True), model)
+                self.versioning.save_step_json(contract_id, version, steps["merged"], state.model_dump(mode="json"))
+        else:
+            state = self.versioning.load_contract_version(contract_id, version)
+            if state is None:
+                raise FileNotFoundError("Contract version missing")
+        diff = None
+        if kind == "addendum":
+            # tính lại diff kể cả khi file version không đổi (stage render sau khi sửa diffing/render)
+            with track("pipeline.diff"):
+                diff = self.renderer.diff(prev, state)
+        if order < REPROCESS_STAGES.index("render"):
+            source_doc = self.versioning.load_step_text(contract_id, version, "00_input_filename")
+            self.versioning.save_contract_version(state, version, diff=diff, source_doc=source_doc)
+        with track("pipeline.render"):
+            md = self.renderer.to_markdown(state)
+        self.versioning.save_step_text(contract_id, version, steps["render"], md)
+        red = ""
+        if diff is not None:
+            with track("pipeline.render"):
+                diff = self.get_diff(contract_id, version, computed=diff)
+                red = "\n".join(self.renderer.iter_diff_markdown(diff))
+            self.versioning.save_step_text(contract_id, version, steps["redline"], red)
+        self.versioning.save_render(contract_id, version, md, redline_md=red)
+        return state
+
+    def get_state_validators(self, contract_id: str) -> tuple:
+        """(latest version, mtime_ns of its file) without loading the contract."""
         latest = self.versioning.latest_version(contract_id)
+        if latest is None:
+            raise FileNotFoundError("Contract not found")
+        mtime_ns = self.versioning.version_mtime_ns(contract_id, latest)
+        if mtime_ns is None:
+            raise FileNotFoundError("Contract version missing")
+        return latest, mtime_ns
+
+    @timed("get_state")
+    def get_state(self, contract_id: str, as_of: Optional[str] = None, version: Optional[int] = None) -> BaseContract:
+        latest = version if version is not None else self.versioning.latest_version(contract_id)
         if latest is None:
             raise FileNotFoundError("Contract not found")
         state = self.versioning.load_contract_version(contract_id, latest)
@@ -121,9 +458,91 @@ class ContractPipeline:
             state = self.versioning.state_as_of(state, dt)
         return state
 
-    def get_redline(self, contract_id: str, version: int) -> str:
-        new_state = self.versioning.load_contract_version(contract_id, version)
-        if new_state is None:
+    @timed("get_state_view")
+    def get_state_view(self, contract_id: str, as_of: Optional[str] = None, version: Optional[int] = None) -> CompactContract:
+        """Read-only compact state for serving; see :mod:`app.readmodel`."""
+        latest = version if version is not None else self.versioning.latest_version(contract_id)
+        if latest is None:
+            raise FileNotFoundError("Contract not found")
+        state = self.versioning.load_compact(contract_id, latest)
+        if state is None:
+            raise FileNotFoundError("Contract version missing")
+        if as_of:
+            from datetime import date
+            state = state.as_of(date.fromisoformat(as_of))
+        return state
+
+    @timed("get_redline")
+    def get_redline(self, contract_id: str, version: int, base_version: Optional[int] = None) -> str:
+        if base_version is not None and base_version != version - 1:
+            return "\n".join(self.renderer.iter_diff_markdown(self.get_diff(contract_id, version, base_version)))
+        path = self.get_render_path(contract_id, version, kind="redline")
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    @timed("get_diff")
+    def get_diff(self, contract_id: str, version: int, base_version: Optional[int] = None, states=None,
+                 computed: Optional[dict] = None) -> dict:
+        """Field-level diff of ``version`` against ``base_version`` (default version-1), cached per pair.
+
+        The cache key carries the mtime of both version files, so rewriting a
+        version invalidates both the in-memory and the on-disk entry.
+        ``states`` may pass the already loaded ``(old, new)`` contracts;
+        ``computed`` is a diff of the current files the caller already has,
+        stored in place of the cached entries.
+        """
+        base_version = version - 1 if base_version is None else base_version
+        validators = [
+            self.versioning.version_mtime_ns(contract_id, base_version),
+            self.versioning.version_mtime_ns(contract_id, version),
+        ]
+        if validators[1] is None:
             raise FileNotFoundError("Version not found")
-        old_state = self.versioning.load_contract_version(contract_id, version - 1)
-        return self.renderer.to_redline(old_state, new_state) 
\ No newline at end of file
+        if validators[0] is None and base_version >= 1 and base_version != version - 1:
+            raise FileNotFoundError("Base version not found")
+        key = (contract_id, base_version, version, *validators)
+        diff = DIFF_CACHE.get(key) if computed is None else None
+        if diff is not None:
+            cache_result("redline_diff", hit=True)
+            return diff
+        stored = self.versioning.load_diff(contract_id, base_version, version) if computed is None else None
+        if stored and stored.get("validators") == validators:
+            cache_result("redline_diff", hit=True)
+            diff = stored["diff"]
+        elif computed is not None:
+            diff = computed
+            diff.update({"from_version": base_version, "to_version": version})
+            self.versioning.save_diff(contract_id, base_version, version, {"validators": validators, "diff": diff})
+        else:
+            cache_result("redline_diff", hit=False)
+            if states is not None:
+                old_state, new_state = states
+            else:
+                old_state = self.versioning.load_contract_version(contract_id, base_version) if validators[0] else None
+                new_state = self.versioning.load_contract_version(contract_id, version)
+            with track("pipeline.diff"):
+                diff = self.renderer.diff(old_state, new_state)
+            diff.update({"from_version": base_version, "to_version": version})
+            self.versioning.save_diff(contract_id, base_version, version, {"validators": validators, "diff": diff})
+        DIFF_CACHE.put(key, diff)
+        return diff
+
+    def get_render_path(self, contract_id: str, version: int, kind: str = "markdown") -> str:
+        """Path of the stored markdown/redline render, generated and stored once if missing."""
+        path = self.versioning.render_path(contract_id, version, kind)
+        if os.path.exists(path):
+            cache_result("render_file", hit=True)
+            return path
+        cache_result("render_file", hit=False)
+        if kind == "markdown":
+            new_state = self.versioning.load_contract_version(contract_id, version)
+            if new_state is None:
+                raise FileNotFoundError("Version not found")
+        else:
+            diff = self.get_diff(contract_id, version)
+        with track("pipeline.render"):
+            if kind == "markdown":
+                lines = self.renderer.iter_markdown(new_state)
+            else:
+                lines = self.renderer.iter_diff_markdown(diff)
+            return self.versioning.write_render_lines(contract_id, version, kind, lines) 
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""Portfolio-wide secondary index over the latest state of every contract.
+
+SQLite file under ``DATA_DIR/index/portfolio.sqlite``; updated on each version
+save, built from the version files on first use when empty (existing
+deployments) and rebuildable from them:
+
+    python -m app.portfolio rebuild
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from . import storage
+from .metrics import timed
+from .models import BaseContract
+import logging
+logger = logging.getLogger(__name__)
+
+
+OPEN_END = "9999-12-31"
+MAX_LIMIT = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    contract_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    hotel TEXT NOT NULL,
+    hotel_key TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    sign_date TEXT NOT NULL,
+    effective_from TEXT,
+    effective_to TEXT,
+    clause_count INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_contracts_hotel ON contracts(hotel_key, contract_id);
+CREATE TABLE IF NOT EXISTS contract_currencies (
+    contract_id TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    PRIMARY KEY (currency, contract_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS clauses (
+    contract_id TEXT NOT NULL,
+    clause_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    effective_from TEXT NOT NULL,
+    effective_to TEXT NOT NULL,
+    PRIMARY KEY (contract_id, clause_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_clauses_type ON clauses(type, contract_id, effective_from, effective_to);
+"""
+
+_local = threading.local()
+
+
+def index_path() -> str:
+    return os.path.join(storage.DATA_DIR, "index", "portfolio.sqlite")
+
+
+def _connect() -> sqlite3.Connection:
+    """Per-thread connection (the pipeline writes from ``asyncio.to_thread`` workers)."""
+    path = index_path()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == path:
+        return conn
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    _local.conn, _local.path = conn, path
+    _build_if_empty(conn, path)
+    return conn
+
+
+_built: set = set()
+_built_lock = threading.Lock()
+
+
+def _build_if_empty(conn: sqlite3.Connection, path: str) -> None:
+    """First open in this process: index the stored contracts when the index is still empty.
+
+    Contracts saved before the index existed would otherwise stay out of
+    ``/portfolio`` and filtered exports until ``python -m app.portfolio rebuild``.
+    """
+    with _built_lock:
+        if path in _built:
+            return
+        _built.add(path)
+    if conn.execute("SELECT 1 FROM contracts LIMIT 1").fetchone() is None and storage.list_contract_ids():
+        logger.info("Portfolio index is empty, building it from the stored versions: %s", path)
+        rebuild_index()
+
+
+def hotel_key(hotel: str) -> str:
+    return " ".join(hotel.split()).casefold()
+
+
+def _iso(d: Optional[date]) -> str:
+    return d.isoformat() if d else OPEN_END
+
+
+@timed("portfolio.index")
+def index_contract(contract: BaseContract, version: int) -> None:
+    """Replace the index rows of ``contract`` unless a newer version is already indexed."""
+    conn = _connect()
+    clauses = [(contract.contract_id, c.id, c.type.value, c.effective_from.isoformat(), _iso(c.effective_to))
+               for c in contract.clauses]
+    currencies = {contract.meta.currency}
+    for c in contract.clauses:
+        for r in c.table or []:
+            currencies.add(r.currency if hasattr(r, "currency") else r.get("currency"))
+    currencies = {cur.upper() for cur in currencies if cur}
+    eff_from = min((row[3] for row in clauses), default=None)
+    eff_to = max((row[4] for row in clauses), default=None)
+    with conn:
+        row = conn.execute("SELECT version FROM contracts WHERE contract_id = ?", (contract.contract_id,)).fetchone()
+        if row is not None and row["version"] > version:
+            return
+        conn.execute("DELETE FROM clauses WHERE contract_id = ?", (contract.contract_id,))
+        conn.execute("DELETE FROM contract_currencies WHERE contract_id = ?", (contract.contract_id,))
+        conn.execute(
+            "INSERT OR REPLACE INTO contracts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (contract.contract_id, version, contract.meta.hotel, hotel_key(contract.meta.hotel), contract.meta.currency,
+             contract.meta.sign_date.isoformat(), eff_from, eff_to, len(clauses), datetime.now(timezone.utc).isoformat(timespec="seconds")),
+        )
+        conn.executemany("INSERT OR REPLACE INTO clauses VALUES (?, ?, ?, ?, ?)", clauses)
+        conn.executemany("INSERT OR REPLACE INTO contract_currencies VALUES (?, ?)",
+                         [(contract.contract_id, cur) for cur in sorted(currencies)])
+    logger.debug("Indexed contract: contract_id=%s version=%s clauses=%s", contract.contract_id, version, len(clauses))
+
+
+@timed("portfolio.query")
+def query_contracts(
+    hotel: Optional[str] = None,
+    currency: Optional[str] = None,
+    clause_type: Optional[str] = None,
+    on: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """Contracts matching all given filters, ordered by contract_id with keyset pagination.
+
+    ``on`` keeps contracts with at least one clause (of ``clause_type`` when
+    given) in effect on that date. ``cursor`` is the ``next_cursor`` of the
+    previous page.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    where: List[str] = []
+    params: List[Any] = []
+    if hotel:
+        where.append("c.hotel_key = ?")
+        params.append(hotel_key(hotel))
+    if currency:
+        where.append("EXISTS (SELECT 1 FROM contract_currencies x WHERE x.currency = ? AND x.contract_id = c.contract_id)")
+        params.append(currency.upper())
+    if clause_type or on:
+        sub = ["k.contract_id = c.contract_id"]
+        if clause_type:
+            sub.append("k.type = ?")
+            params.append(clause_type)
+        if on:
+            sub.append("k.effective_from <= ? AND k.effective_to >= ?")
+            params.extend([on.isoformat(), on.isoformat()])
+        where.append("EXISTS (SELECT 1 FROM clauses k WHERE " + " AND ".join(sub) + ")")
+    if cursor:
+        where.append("c.contract_id > ?")
+        params.append(cursor)
+    sql = "SELECT c.* FROM contracts c"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY c.contract_id LIMIT ?"
+    params.append(limit + 1)
+    rows = _connect().execute(sql, params).fetchall()
+    items = [{k: r[k] for k in r.keys() if k != "hotel_key"} for r in rows[:limit]]
+    for item in items:
+        if item["effective_to"] == OPEN_END:
+            item["effective_to"] = None
+    next_cursor = items[-1]["contract_id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def rebuild_index() -> int:
+    """Re-index the latest version of every contract found under ``DATA_DIR/versions``."""
+    contract_ids = storage.list_contract_ids()
+    if not contract_ids:
+        return 0
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM clauses")
+        conn.execute("DELETE FROM contract_currencies")
+        conn.execute("DELETE FROM contracts")
+    count = 0
+    for contract_id in contract_ids:
+        version = storage.latest_version(contract_id)
+        if version is None:
+            continue
+        contract = storage.load_contract_version(contract_id, version)
+        if contract is None:
+            continue
+        index_contract(contract, version)
+        count += 1
+    logger.info("Rebuilt portfolio index: %s contracts", count)
+    return count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["rebuild"]:
+        print(json.dumps({"indexed": rebuild_index(), "path": index_path()}))
+        return 0
+    print("usage: python -m app.portfolio rebuild", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
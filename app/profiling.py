@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from . import metrics, storage
+from .config import get_settings
+import logging
+logger = logging.getLogger(__name__)
+
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY = "profile"
+
+# cProfile gắn một hook cho mỗi thread và mọi request dùng chung thread event loop:
+# chỉ một phiên profile tại một thời điểm
+_active = threading.Lock()
+
+
+def profiling_requested(headers, query_params) -> bool:
+    """Whether a request asked for profiling and config allows it.
+
+    Profiling needs ``PROFILING_ENABLED``; when ``PROFILING_TOKEN`` is set the
+    header/query value must match it, otherwise any truthy flag is accepted.
+    """
+    s = get_settings()
+    if not s.profiling_enabled:
+        return False
+    flag = headers.get(PROFILE_HEADER) or query_params.get(PROFILE_QUERY)
+    if not flag:
+        return False
+    if s.profiling_token:
+        return flag == s.profiling_token
+    return flag.lower() in ("1", "true", "yes", "on")
+
+
+class ProfileSession:
+    def __init__(self, label: str):
+        self.label = label
+        self.profiler = cProfile.Profile()
+        self.timeline: List[Dict[str, object]] = []
+        self.wall_ms = 0.0
+
+
+@asynccontextmanager
+async def profile_request(label: str, enabled: bool) -> AsyncIterator[Optional[ProfileSession]]:
+    """Run the body under cProfile and collect the stage timeline when ``enabled``.
+
+    cProfile only sees the event-loop thread: work pushed to ``asyncio.to_thread``
+    (Docling/LLM HTTP calls) shows up in the timeline but not in the profile,
+    and other requests served concurrently by the same loop are included.
+    Only one session runs at a time: a request asking while another is being
+    profiled is served unprofiled (the session is None).
+    """
+    if not enabled:
+        yield None
+        return
+    if not _active.acquire(blocking=False):
+        logger.info("Profiling skipped, another profiled request is running: %s", label)
+        yield None
+        return
+    try:
+        async with _profiled(label) as session:
+            yield session
+    finally:
+        _active.release()
+
+
+@asynccontextmanager
+async def _profiled(label: str) -> AsyncIterator[ProfileSession]:
+    session = ProfileSession(label)
+    tokens = metrics.start_timeline()
+    t0 = time.perf_counter()
+    session.profiler.enable()
+    try:
+        yield session
+    finally:
+        session.profiler.disable()
+        session.wall_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+        session.timeline = metrics.stop_timeline(tokens)
+
+
+def save_profile(session: ProfileSession, contract_id: str, version: int, top: int = 60) -> Dict[str, str]:
+    """Store the profile next to the step files: ``.pstats``, a text summary and the timeline."""
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    base = f"profile_{session.label}_{stamp}"
+    pstats_path = storage.step_file_path(contract_id, version, f"{base}.pstats")
+    session.profiler.dump_stats(pstats_path)
+
+    buf = io.StringIO()
+    stats = pstats.Stats(session.profiler, stream=buf)
+    stats.sort_stats("cumulative").print_stats(top)
+    summary_path = storage.step_file_path(contract_id, version, f"{base}.txt")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+
+    timeline_path = storage.step_file_path(contract_id, version, f"{base}_timeline.json")
+    with open(timeline_path, "w", encoding="utf-8") as f:
+        json.dump({"label": session.label, "wall_ms": session.wall_ms, "stages": session.timeline}, f, ensure_ascii=False, indent=2)
+    logger.info("Saved profile: contract_id=%s version=%s files=%s", contract_id, version, base)
+    steps_dir = os.path.join(storage.DATA_DIR, "steps")
+    return {"pstats": pstats_path, "summary": summary_path, "timeline": timeline_path,
+            "timeline_rel": os.path.relpath(timeline_path, steps_dir)}
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .models import Chunk, ChangeType
+from .segmenter import split_sections
+from .metrics import cache_result
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Ước lượng thô: ~4 ký tự / token cho văn bản Anh–Việt lẫn lộn
+CHARS_PER_TOKEN = 4
+
+# Nhãn chunk (segmenter.guess_label) → các ChangeType mà chunk đó có thể chứa
+LABEL_RELEVANCE: Dict[str, Tuple[ChangeType, ...]] = {
+    "StopSell": (ChangeType.StopSell, ChangeType.OpenSell),
+    "Promotion": (ChangeType.Promotion,),
+    "Pricing": (ChangeType.RateAdjustment, ChangeType.SurchargeUpdate, ChangeType.TaxUpdate),
+    "Season": (ChangeType.RateAdjustment, ChangeType.AllotmentUpdate),
+    "Policy": (ChangeType.PolicyUpdate,),
+}
+
+# mọi nhãn có trong LABEL_RELEVANCE cùng mức ưu tiên (số ChangeType của nhãn không nói lên độ liên quan);
+# giữa các section cùng điểm, section đứng trước trong tài liệu được chọn trước
+LABELED_SCORE = 1.0
+# chunk không gán được nhãn vẫn có thể chứa thay đổi, nhưng xếp sau chunk có nhãn
+UNLABELED_SCORE = 0.5
+
+
+def normalize_chunk_text(markdown: str) -> str:
+    return re.sub(r"\s+", " ", markdown).strip().lower()
+
+
+def chunk_hash(chunk: Chunk) -> str:
+    return hashlib.sha1(normalize_chunk_text(chunk.markdown).encode("utf-8")).hexdigest()
+
+
+def prompt_units(chunks: List[Chunk]) -> List[Chunk]:
+    """Flatten chunks into heading sections, the unit used for dedup and budgeting."""
+    units: List[Chunk] = []
+    for c in chunks:
+        units.extend(split_sections(c))
+    return units
+
+
+def section_hashes(chunks: List[Chunk]) -> List[str]:
+    return [chunk_hash(u) for u in prompt_units(chunks)]
+
+
+def section_title(chunk: Chunk, max_chars: int = 80) -> str:
+    """First line of a section (its own heading when it starts with one), for logs."""
+    for line in chunk.markdown.splitlines():
+        line = line.strip().lstrip("#").strip()
+        if line:
+            return line if len(line) <= max_chars else line[: max_chars - 1] + "…"
+    return "(empty section)"
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def relevance_score(chunk: Chunk) -> float:
+    if not chunk.label:
+        return UNLABELED_SCORE
+    return LABELED_SCORE if LABEL_RELEVANCE.get(chunk.label) else 0.0
+
+
+def select_addendum_chunks(
+    chunks: List[Chunk],
+    seen_hashes: Optional[Iterable[str]] = None,
+    token_budget: Optional[int] = None,
+) -> List[Chunk]:
+    """Pick the sections of an addendum worth sending to the LLM.
+
+    Chunks are split into heading sections; sections whose normalized content was
+    already seen in the contract's earlier documents (or earlier in the same
+    addendum) are dropped, the rest are ranked by label relevance to
+    ``ChangeType`` and packed into ``token_budget``. The selection keeps the
+    original document order.
+    """
+    seen: Set[str] = set(seen_hashes or [])
+    units = prompt_units(chunks)
+    fresh: List[Tuple[int, Chunk]] = []
+    for idx, c in enumerate(units):
+        h = chunk_hash(c)
+        if h in seen:
+            continue
+        seen.add(h)
+        fresh.append((idx, c))
+    cache_result("prompt_sections", hit=True, n=len(units) - len(fresh))
+    cache_result("prompt_sections", hit=False, n=len(fresh))
+    if not fresh:
+        # toàn bộ nội dung đã thấy trước đó → vẫn gửi tài liệu gốc để LLM tự quyết định
+        logger.warning("All %s addendum sections already seen; sending them unfiltered", len(units))
+        return list(chunks)
+
+    ranked = sorted(fresh, key=lambda item: (-relevance_score(item[1]), item[0]))
+    picked: List[Tuple[int, Chunk]] = []
+    used = 0
+    for idx, c in ranked:
+        cost = estimate_tokens(c.markdown)
+        if token_budget is not None and picked and used + cost > token_budget:
+            continue
+        picked.append((idx, c))
+        used += cost
+    picked.sort(key=lambda item: item[0])
+    if len(picked) < len(fresh):
+        # section mới bị bỏ có thể chứa thay đổi thật: cần thấy trong log để chỉnh budget
+        kept = {idx for idx, _ in picked}
+        dropped = [c for idx, c in fresh if idx not in kept]
+        logger.warning(
+            "Addendum token budget dropped %s fresh section(s) (budget=%s): %s",
+            len(dropped), token_budget,
+            ", ".join(f"{section_title(c)} [{c.label or 'unlabeled'}]" for c in dropped),
+        )
+    logger.info(
+        "Addendum prompt sections: total=%s fresh=%s selected=%s est_tokens=%s budget=%s",
+        len(units), len(fresh), len(picked), used, token_budget,
+    )
+    return [c for _, c in picked]
@@ -0,0 +1,342 @@
+"""Compact read-only contract representation for query paths.
+
+Version files are parsed with orjson straight into ``__slots__`` records; rate
+tables become parallel typed arrays (date ordinals, float rates, interned
+currency codes). Pydantic models are only built at the edges via
+:func:`from_model` / :func:`to_model`, and :func:`to_dict` produces the same
+JSON shape as ``BaseContract.model_dump(mode="json")``. :class:`StateQuery` and
+:func:`iter_json` serve filtered/projected/paginated views clause by clause.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from array import array
+from datetime import date
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import orjson
+
+from . import storage
+from .metrics import timed, add_bytes, cache_result
+from .models import BaseContract, ClauseType
+
+
+_CURRENCIES: List[str] = []
+_CURRENCY_INDEX: Dict[str, int] = {}
+_currency_lock = threading.Lock()
+
+
+def currency_code(currency: str) -> int:
+    """Index of an interned currency code."""
+    idx = _CURRENCY_INDEX.get(currency)
+    if idx is None:
+        with _currency_lock:
+            idx = _CURRENCY_INDEX.get(currency)
+            if idx is None:
+                idx = len(_CURRENCIES)
+                _CURRENCIES.append(currency)
+                _CURRENCY_INDEX[currency] = idx
+    return idx
+
+
+@lru_cache(maxsize=8192)
+def _parse_ordinal(value: str) -> int:
+    return date.fromisoformat(value).toordinal()
+
+
+def _ordinal(value: Any) -> int:
+    # các bảng giá lặp lại rất nhiều ngày giống nhau nên parse qua cache
+    if isinstance(value, date):
+        return value.toordinal()
+    return _parse_ordinal(value)
+
+
+def _iso(ordinal: int) -> str:
+    return date.fromordinal(ordinal).isoformat()
+
+
+class RateTable:
+    """Rate rows as parallel arrays; ``notes`` is sparse (row index -> note)."""
+
+    __slots__ = ("date_from", "date_to", "rates", "currencies", "notes")
+
+    def __init__(self):
+        self.date_from = array("i")
+        self.date_to = array("i")
+        self.rates = array("d")
+        self.currencies = array("H")
+        self.notes: Optional[Dict[int, str]] = None
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[str, Any]]) -> "RateTable":
+        t = cls()
+        t.date_from = array("i", [_ordinal(r["date_from"]) for r in rows])
+        t.date_to = array("i", [_ordinal(r["date_to"]) for r in rows])
+        t.rates = array("d", [float(r["rate"]) for r in rows])
+        t.currencies = array("H", [currency_code(r["currency"]) for r in rows])
+        notes = {i: r["notes"] for i, r in enumerate(rows) if r.get("notes")}
+        t.notes = notes or None
+        return t
+
+    def append(self, date_from: Any, date_to: Any, rate: float, currency: str, notes: Optional[str] = None) -> None:
+        if notes:
+            if self.notes is None:
+                self.notes = {}
+            self.notes[len(self.rates)] = notes
+        self.date_from.append(_ordinal(date_from))
+        self.date_to.append(_ordinal(date_to))
+        self.rates.append(float(rate))
+        self.currencies.append(currency_code(currency))
+
+    def __len__(self) -> int:
+        return len(self.rates)
+
+    def rows(self, lo: Optional[int] = None, hi: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Rows as dicts; with ``lo``/``hi`` (ordinals) only rows overlapping that window."""
+        notes = self.notes or {}
+        for i in range(len(self.rates)):
+            if (lo is not None and self.date_to[i] < lo) or (hi is not None and self.date_from[i] > hi):
+                continue
+            yield {
+                "date_from": _iso(self.date_from[i]),
+                "date_to": _iso(self.date_to[i]),
+                "rate": self.rates[i],
+                "currency": _CURRENCIES[self.currencies[i]],
+                "notes": notes.get(i),
+            }
+
+
+class CompactClause:
+    __slots__ = ("id", "type", "title", "scope", "season", "blackout", "table", "policy", "text",
+                 "effective_from", "effective_to", "source_anchor", "confidence")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.id = data["id"]
+        self.type = data["type"]
+        self.title = data["title"]
+        self.scope = data.get("scope")
+        self.season = data.get("season")
+        self.blackout = data.get("blackout")
+        rows = data.get("table")
+        self.table = RateTable.from_rows(rows) if rows is not None else None
+        self.policy = data.get("policy")
+        self.text = data.get("text")
+        self.effective_from = _ordinal(data["effective_from"])
+        eff_to = data.get("effective_to")
+        self.effective_to = _ordinal(eff_to) if eff_to else None
+        self.source_anchor = data.get("source_anchor")
+        self.confidence = float(data["confidence"])
+
+    def in_effect(self, ordinal: int) -> bool:
+        return self.effective_from <= ordinal and (self.effective_to is None or self.effective_to >= ordinal)
+
+    def to_dict(self, fields: Optional[Sequence[str]] = None, window: Optional[Tuple[Optional[int], Optional[int]]] = None) -> Dict[str, Any]:
+        """JSON-ready clause; ``fields`` projects (``id`` always kept), ``window`` trims rate rows and dated policy entries."""
+        if fields is None and window is None:
+            return self._full_dict()
+        out: Dict[str, Any] = {}
+        for name in ("id",) + tuple(f for f in (fields or CLAUSE_FIELDS) if f != "id"):
+            if name == "table":
+                out[name] = list(self.table.rows(*(window or (None, None)))) if self.table is not None else None
+            elif name == "policy" and window is not None and self.policy:
+                out[name] = _policy_in_window(self.policy, window)
+            elif name in ("effective_from", "effective_to"):
+                value = getattr(self, name)
+                out[name] = _iso(value) if value is not None else None
+            else:
+                out[name] = getattr(self, name)
+        return out
+
+    def _full_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "title": self.title,
+            "scope": self.scope,
+            "season": self.season,
+            "blackout": self.blackout,
+            "table": list(self.table.rows()) if self.table is not None else None,
+            "policy": self.policy,
+            "text": self.text,
+            "effective_from": _iso(self.effective_from),
+            "effective_to": _iso(self.effective_to) if self.effective_to is not None else None,
+            "source_anchor": self.source_anchor,
+            "confidence": self.confidence,
+        }
+
+
+CLAUSE_FIELDS = CompactClause.__slots__
+
+
+def _policy_in_window(policy: Dict[str, Any], window: Tuple[Optional[int], Optional[int]]) -> Dict[str, Any]:
+    # promotions/stop_sell tích luỹ qua các phụ lục: chỉ giữ phần tử {"from", "to"} giao với khung ngày
+    lo = _iso(window[0]) if window[0] is not None else None
+    hi = _iso(window[1]) if window[1] is not None else None
+    out: Dict[str, Any] = {}
+    for key, value in policy.items():
+        if isinstance(value, list):
+            value = [item for item in value if not (isinstance(item, dict) and ("from" in item or "to" in item)) or (
+                (hi is None or item.get("from") is None or str(item["from"]) <= hi)
+                and (lo is None or item.get("to") is None or str(item["to"]) >= lo))]
+        out[key] = value
+    return out
+
+
+class CompactContract:
+    __slots__ = ("contract_id", "meta", "clauses")
+
+    def __init__(self, contract_id: str, meta: Dict[str, Any], clauses: List[CompactClause]):
+        self.contract_id = contract_id
+        self.meta = meta
+        self.clauses = clauses
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CompactContract":
+        """Build from a stored version document (already validated when it was written)."""
+        return cls(data["contract_id"], data["meta"], [CompactClause(c) for c in data["clauses"]])
+
+    def as_of(self, as_of: date) -> "CompactContract":
+        """Clauses in effect on ``as_of``; records are shared, not copied."""
+        o = as_of.toordinal()
+        return CompactContract(self.contract_id, self.meta, [c for c in self.clauses if c.in_effect(o)])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"contract_id": self.contract_id, "meta": self.meta, "clauses": [c.to_dict() for c in self.clauses]}
+
+
+def from_model(contract: BaseContract) -> CompactContract:
+    return CompactContract.from_dict(contract.model_dump(mode="json"))
+
+
+def to_model(contract: CompactContract) -> BaseContract:
+    return BaseContract.model_validate(contract.to_dict())
+
+
+def dumps(contract: CompactContract) -> bytes:
+    return orjson.dumps(contract.to_dict())
+
+
+class StateQuery:
+    """Clause-type filter, field projection, clause pagination and rate-row date window for state reads."""
+
+    __slots__ = ("clause_types", "fields", "offset", "limit", "rates_from", "rates_to")
+
+    def __init__(
+        self,
+        clause_types: Optional[Sequence[str]] = None,
+        fields: Optional[Sequence[str]] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        rates_from: Optional[date] = None,
+        rates_to: Optional[date] = None,
+    ):
+        known_types = {t.value for t in ClauseType}
+        bad = [t for t in clause_types or () if t not in known_types]
+        if bad:
+            raise ValueError(f"Unknown clause_type: {', '.join(bad)}")
+        bad = [f for f in fields or () if f not in CLAUSE_FIELDS]
+        if bad:
+            raise ValueError(f"Unknown field: {', '.join(bad)}")
+        if offset < 0 or (limit is not None and limit < 1):
+            raise ValueError("offset must be >= 0 and limit >= 1")
+        if rates_from and rates_to and rates_from > rates_to:
+            raise ValueError("rates_from is after rates_to")
+        self.clause_types = frozenset(clause_types) if clause_types else None
+        # giữ thứ tự field như trong Clause để output ổn định
+        self.fields = tuple(f for f in CLAUSE_FIELDS if f in set(fields)) if fields else None
+        self.offset = offset
+        self.limit = limit
+        self.rates_from = rates_from
+        self.rates_to = rates_to
+
+    @property
+    def window(self) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        if self.rates_from is None and self.rates_to is None:
+            return None
+        return (self.rates_from.toordinal() if self.rates_from else None,
+                self.rates_to.toordinal() if self.rates_to else None)
+
+    def key(self) -> Optional[str]:
+        """Canonical form for the ETag; None for the full state (so its ETag is unchanged)."""
+        if self.clause_types is None and self.fields is None and not self.offset and self.limit is None and self.window is None:
+            return None
+        return "|".join([
+            ",".join(sorted(self.clause_types or ())),
+            ",".join(self.fields or ()),
+            str(self.offset),
+            "" if self.limit is None else str(self.limit),
+            self.rates_from.isoformat() if self.rates_from else "",
+            self.rates_to.isoformat() if self.rates_to else "",
+        ])
+
+    def page(self, contract: CompactContract) -> Tuple[List[CompactClause], int]:
+        """Clauses of the requested page and the number matching the filter."""
+        clauses = contract.clauses
+        if self.clause_types is not None:
+            clauses = [c for c in clauses if c.type in self.clause_types]
+        end = None if self.limit is None else self.offset + self.limit
+        return clauses[self.offset:end], len(clauses)
+
+
+def iter_json(contract: CompactContract, clauses: List[CompactClause], query: Optional[StateQuery] = None,
+              flush_bytes: int = 64 * 1024) -> Iterator[bytes]:
+    """Serialize ``contract`` with only ``clauses``, one clause at a time, in blocks of about ``flush_bytes``.
+
+    With the default query the bytes equal :func:`dumps` of the whole contract.
+    """
+    fields = query.fields if query is not None else None
+    window = query.window if query is not None else None
+    out = bytearray(b'{"contract_id":')
+    out += orjson.dumps(contract.contract_id)
+    out += b',"meta":'
+    out += orjson.dumps(contract.meta)
+    out += b',"clauses":['
+    total = 0
+    for i, c in enumerate(clauses):
+        if i:
+            out += b","
+        out += orjson.dumps(c.to_dict(fields, window))
+        if len(out) >= flush_bytes:
+            total += len(out)
+            yield bytes(out)
+            out.clear()
+    out += b"]}"
+    total += len(out)
+    add_bytes("state.serialize", "out", total)
+    yield bytes(out)
+
+
+def _read(path: str) -> CompactContract:
+    with open(path, "rb") as f:
+        raw = f.read()
+    add_bytes("readmodel.load", "in", len(raw))
+    return CompactContract.from_dict(orjson.loads(raw))
+
+
+@lru_cache(maxsize=256)
+def _load(path: str, mtime_ns: int) -> CompactContract:
+    return _read(path)
+
+
+@timed("readmodel.load")
+def load_compact(contract_id: str, version: int) -> Optional[CompactContract]:
+    """Load a version as a :class:`CompactContract`; cached per (file, mtime), so treat it as read-only."""
+    path = storage.version_path(contract_id, version)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    hits = _load.cache_info().hits
+    contract = _load(path, mtime_ns)
+    cache_result("readmodel", hit=_load.cache_info().hits > hits)
+    return contract
+
+
+def read_compact(contract_id: str, version: int) -> Optional[CompactContract]:
+    """Uncached :func:`load_compact` for scans over many contracts (keeps the serving cache warm)."""
+    try:
+        return _read(storage.version_path(contract_id, version))
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,216 @@
+"""Targeted re-extraction of weak parts of an LLM extraction.
+
+After ``auto_repair_json`` the clauses (base) or changes (addendum) whose
+``confidence`` is below the threshold, and the fields that had to be filled with
+defaults ("Unknown Hotel", today's date, 0.5, ...), are asked again one by one
+with a small prompt: the current item, the fields wanted and only the source
+sections that mention it. Answers are validated with the models before being
+merged back; the answers are kept so reprocessing can re-apply them offline.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+from dataclasses import asdict, dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from .models import Chunk, Clause, Change
+from .prompting import estimate_tokens, prompt_units
+from .validator import validate_change
+import logging
+logger = logging.getLogger(__name__)
+
+
+META_FIELDS = ("hotel", "sign_date", "currency")
+CLAUSE_FIELDS = ("type", "title", "scope", "season", "blackout", "table", "policy", "text", "effective_from", "effective_to")
+CHANGE_FIELDS = ("type", "target", "payload", "effective_from", "effective_to", "notes")
+# phần văn bản nguồn gửi kèm mỗi câu hỏi
+CONTEXT_TOKEN_BUDGET = 2500
+_WORD_RE = re.compile(r"\w{3,}", re.UNICODE)
+
+SYSTEM_PROMPT = (
+    "Bạn kiểm tra lại một phần kết quả trích xuất hợp đồng khách sạn, chỉ dựa vào đoạn văn bản được cung cấp. "
+    "Trả về duy nhất JSON {\"fields\": {...}, \"confidence\": số 0..1}; \"fields\" chỉ gồm các field được hỏi, "
+    "không tìm thấy trong văn bản → null. Ngày YYYY-MM-DD. Không suy đoán."
+)
+
+
+@dataclass
+class Target:
+    kind: str  # "meta" | "clause" | "change"
+    index: Optional[int]
+    fields: List[str]
+    reason: str  # "repaired" | "low_confidence"
+    confidence: Optional[float] = None
+    answer: Optional[Dict[str, Any]] = None
+    applied: bool = False
+    error: Optional[str] = None
+    item_id: Optional[str] = None
+
+
+def find_targets(doc: Dict[str, Any], mode: str, repairs: List[Dict[str, Any]], threshold: float,
+                 max_targets: int) -> List[Target]:
+    """Items worth asking again, weakest first, at most ``max_targets``."""
+    targets: List[Target] = []
+    meta_fields = [r["field"] for r in repairs if r["target"] == "meta" and r["field"] in META_FIELDS]
+    if mode == "base" and meta_fields:
+        targets.append(Target("meta", None, meta_fields, "repaired", confidence=0.0))
+    key = "clauses" if mode == "base" else "changes"
+    all_fields = CLAUSE_FIELDS if mode == "base" else CHANGE_FIELDS
+    repaired: Dict[int, List[str]] = {}
+    guessed = set()
+    for r in repairs:
+        if r["target"] == "clause" and r["field"] in all_fields:
+            repaired.setdefault(r["index"], []).append(r["field"])
+        elif r["target"] == "clause" and r["field"] == "confidence":
+            guessed.add(r["index"])  # LLM không trả confidence: coi như thấp
+    for idx, item in enumerate(doc.get(key) or []):
+        conf = item.get("confidence")
+        kind = "clause" if mode == "base" else "change"
+        if idx in guessed or (conf is not None and float(conf) < threshold):
+            # độ tin cậy thấp: hỏi lại toàn bộ nội dung của phần tử
+            targets.append(Target(kind, idx, list(all_fields), "low_confidence", confidence=float(conf), item_id=item.get("id")))
+        elif idx in repaired:
+            targets.append(Target(kind, idx, repaired[idx], "repaired", confidence=float(conf or 0.0), item_id=item.get("id")))
+    targets.sort(key=lambda t: t.confidence if t.confidence is not None else 0.0)
+    if len(targets) > max_targets:
+        logger.info("Refine: %s targets, keeping the %s weakest", len(targets), max_targets)
+    return targets[:max_targets]
+
+
+def _words(value: Any) -> set:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return {w.lower() for w in _WORD_RE.findall(text)}
+
+
+def select_context(chunks: List[Chunk], target: Target, item: Optional[Dict[str, Any]]) -> List[Chunk]:
+    """Source sections for one target, in document order, within ``CONTEXT_TOKEN_BUDGET``."""
+    sections = prompt_units(chunks)
+    if not sections:
+        return []
+    if target.kind == "meta" or not item:
+        # tên khách sạn/ngày ký thường ở đầu và cuối hợp đồng
+        ranked = [0, len(sections) - 1] + list(range(1, len(sections) - 1))
+    else:
+        anchor = item.get("source_anchor") or {}
+        wanted = _words([item.get("title"), item.get("text"), item.get("scope"), item.get("target"),
+                         item.get("payload"), anchor.get("heading")])
+        scores = [len(wanted & _words(s.markdown)) for s in sections]
+        ranked = sorted((i for i in range(len(sections)) if scores[i] > 0), key=lambda i: -scores[i])
+        if not ranked:
+            ranked = list(range(len(sections)))
+    picked: List[int] = []
+    used = 0
+    for i in dict.fromkeys(ranked):
+        cost = estimate_tokens(sections[i].markdown)
+        if picked and used + cost > CONTEXT_TOKEN_BUDGET:
+            continue
+        picked.append(i)
+        used += cost
+    return [sections[i] for i in sorted(picked)]
+
+
+def build_prompt(target: Target, doc: Dict[str, Any], context: List[Chunk]) -> str:
+    if target.kind == "meta":
+        current = {k: doc.get("meta", {}).get(k) for k in META_FIELDS}
+        what = "Thông tin chung của hợp đồng (meta: hotel, sign_date, currency)"
+    else:
+        key = "clauses" if target.kind == "clause" else "changes"
+        current = doc[key][target.index]
+        what = "Một clause của hợp đồng gốc" if target.kind == "clause" else "Một thay đổi (change) của phụ lục"
+    reason = ("các field dưới đây đang là giá trị mặc định, cần điền từ văn bản" if target.reason == "repaired"
+              else "độ tin cậy thấp, cần kiểm tra và sửa các field dưới đây")
+    body = "\n\n".join(c.markdown for c in context)
+    return (
+        f"{what}; {reason}.\n"
+        f"Field cần trả: {', '.join(target.fields)}\n"
+        f"Giá trị hiện tại:\n{json.dumps(current, ensure_ascii=False, default=str)}\n\n"
+        f"Văn bản nguồn:\n{body}"
+    )
+
+
+def _confidence(value: Any, default: Optional[float]) -> Optional[float]:
+    try:
+        return min(1.0, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+def apply_answer(doc: Dict[str, Any], target: Target, answer: Dict[str, Any]) -> bool:
+    """Merge one answer into ``doc`` if the result still validates; returns whether it was applied."""
+    fields = {k: v for k, v in (answer.get("fields") or {}).items() if k in target.fields and v is not None}
+    if target.kind == "meta":
+        meta = dict(doc.get("meta") or {})
+        for k, v in fields.items():
+            if k == "sign_date":
+                date.fromisoformat(str(v))
+            elif not isinstance(v, str) or not v.strip():
+                raise ValueError(f"meta.{k} must be a non-empty string")
+            meta[k] = v
+        doc["meta"] = meta
+        return bool(fields)
+    key = "clauses" if target.kind == "clause" else "changes"
+    merged = {**doc[key][target.index], **fields}
+    conf = _confidence(answer.get("confidence"), None)
+    if conf is not None:
+        merged["confidence"] = conf
+    # giữ id cũ: merger/diff dựa vào id
+    merged["id"] = doc[key][target.index]["id"]
+    if target.kind == "clause":
+        Clause(**merged)
+    else:
+        validate_change(Change(**merged))
+    doc[key][target.index] = merged
+    return True
+
+
+def apply_refinements(doc: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Re-apply the answers recorded by :meth:`Refiner.refine` (offline reprocessing)."""
+    for r in results:
+        if not r.get("applied") or not r.get("answer"):
+            continue
+        target = Target(r["kind"], r["index"], r["fields"], r["reason"])
+        try:
+            apply_answer(doc, target, r["answer"])
+        except Exception as e:
+            logger.warning("Saved refinement no longer applies: %s[%s] %s", r["kind"], r["index"], e)
+    return doc
+
+
+class Refiner:
+    def __init__(self, client, threshold: float, max_targets: int):
+        self.client = client
+        self.threshold = threshold
+        self.max_targets = max_targets
+
+    async def _ask(self, doc: Dict[str, Any], target: Target, chunks: List[Chunk]) -> None:
+        item = None
+        if target.kind != "meta":
+            item = doc["clauses" if target.kind == "clause" else "changes"][target.index]
+        prompt = build_prompt(target, doc, select_context(chunks, target, item))
+        try:
+            target.answer = await self.client.complete_json(SYSTEM_PROMPT, prompt, mode=f"refine_{target.kind}")
+        except Exception as e:
+            logger.warning("Refine request failed: %s[%s] %s", target.kind, target.index, e)
+            target.error = f"{type(e).__name__}: {e}"
+
+    async def refine(self, doc: Dict[str, Any], mode: str, repairs: List[Dict[str, Any]],
+                     chunks: List[Chunk]) -> List[Dict[str, Any]]:
+        """Ask every target concurrently (the LLM scheduler paces them) and merge valid answers into ``doc``."""
+        targets = find_targets(doc, mode, repairs, self.threshold, self.max_targets)
+        if not targets:
+            return []
+        logger.info("Refine: mode=%s targets=%s", mode, len(targets))
+        await asyncio.gather(*(self._ask(doc, t, chunks) for t in targets))
+        # áp dụng tuần tự sau khi có đủ câu trả lời: index của phần tử không đổi
+        for t in targets:
+            if t.answer is None:
+                continue
+            try:
+                t.applied = apply_answer(doc, t, t.answer)
+            except Exception as e:
+                t.error = f"{type(e).__name__}: {e}"
+                logger.info("Refine answer rejected: %s[%s] %s", t.kind, t.index, t.error)
+        return [asdict(t) for t in targets]
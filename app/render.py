@@ -1,58 +1,54 @@
 from __future__ import annotations
 
-from typing import List
+from typing import Iterator
 
+from .diffing import diff_contracts, iter_diff_markdown
 from .models import BaseContract, Clause, RateRow
 
 
-def render_markdown(contract: BaseContract) -> str:
-    lines: List[str] = []
+def iter_markdown(contract: BaseContract) -> Iterator[str]:
+    """Yield the markdown render line by line (without trailing newlines)."""
     m = contract.meta
-    lines.append(f"# Contract {contract.contract_id}")
-    lines.append("")
-    lines.append(f"Hotel: {m.hotel} | Sign date: {m.sign_date} | Currency: {m.currency}")
-    lines.append("")
+    yield f"# Contract {contract.contract_id}"
+    yield ""
+    yield f"Hotel: {m.hotel} | Sign date: {m.sign_date} | Currency: {m.currency}"
+    yield ""
     for c in contract.clauses:
-        lines.append(f"## {c.type.value}: {c.title}")
+        yield f"## {c.type.value}: {c.title}"
         if c.scope:
-            lines.append(f"- Scope: `{c.scope}`")
-        lines.append(f"- Effective: {c.effective_from} → {c.effective_to or 'open'}")
+            yield f"- Scope: `{c.scope}`"
+        yield f"- Effective: {c.effective_from} → {c.effective_to or 'open'}"
         if c.table:
-            lines.append("")
-            lines.append("| date_from | date_to | rate | currency | notes |")
-            lines.append("|-----------|---------|------|----------|-------|")
+            yield ""
+            yield "| date_from | date_to | rate | currency | notes |"
+            yield "|-----------|---------|------|----------|-------|"
             for r in c.table:
                 if isinstance(r, RateRow):
-                    lines.append(f"| {r.date_from} | {r.date_to} | {r.rate} | {r.currency} | {r.notes or ''} |")
+                    yield f"| {r.date_from} | {r.date_to} | {r.rate} | {r.currency} | {r.notes or ''} |"
                 else:
-                    lines.append(f"| {r['date_from']} | {r['date_to']} | {r['rate']} | {r['currency']} | {r.get('notes') or ''} |")
-            lines.append("")
+                    yield f"| {r['date_from']} | {r['date_to']} | {r['rate']} | {r['currency']} | {r.get('notes') or ''} |"
+            yield ""
         if c.policy:
-            lines.append(f"- Policy: `{c.policy}`")
+            yield f"- Policy: `{c.policy}`"
         if c.blackout:
-            lines.append(f"- Blackout: {c.blackout}")
+            yield f"- Blackout: {c.blackout}"
         if c.season:
             season_str = ", ".join([f"{s.from_}..{s.to}" for s in c.season])
-            lines.append(f"- Season: {season_str}")
+            yield f"- Season: {season_str}"
         if c.text:
-            lines.append("")
-            lines.append("> " + c.text.replace("\n", "\n> "))
-        lines.append("")
-    return "\n".join(lines)
+            yield ""
+            yield "> " + c.text.replace("\n", "\n> ")
+        yield ""
+
+
+def render_markdown(contract: BaseContract) -> str:
+    return "\n".join(iter_markdown(contract))
+
+
+def iter_redline(old: BaseContract | None, new: BaseContract) -> Iterator[str]:
+    """Yield the field-level redline of ``new`` against ``old`` (see :mod:`app.diffing`)."""
+    yield from iter_diff_markdown(diff_contracts(old, new))
 
 
 def redline(old: BaseContract | None, new: BaseContract) -> str:
-    old_ids = {c.id for c in (old.clauses if old else [])}
-    new_ids = {c.id for c in new.clauses}
-    added = new_ids - (old_ids if old else set())
-    removed = (old_ids if old else set()) - new_ids
-    lines: List[str] = ["# Redline", ""]
-    for c in new.clauses:
-        if c.id in added:
-            lines.append(f"+ ADD {c.id} {c.type.value} {c.title} {c.effective_from}→{c.effective_to or 'open'}")
-    if old:
-        for c in old.clauses:
-            if c.id in removed:
-                lines.append(f"- REMOVE {c.id} {c.type.value} {c.title} {c.effective_from}→{c.effective_to or 'open'}")
-    lines.append("")
-    return "\n".join(lines) 
\ No newline at end of file
+    return "\n".join(iter_redline(old, new))
@@ -0,0 +1,87 @@
+"""Rebuild stored versions from their step artifacts after a segmenter/merger/render fix.
+
+    python -m app.reprocess --from merge                    # every contract
+    python -m app.reprocess HOTEL_A HOTEL_B --from render --workers 8
+    python -m app.reprocess HOTEL_A --from extract --from-version 3
+
+Docling is never called; only ``--from segment`` calls the LLM again (bulk
+priority). Contracts are independent, so they are spread over a process pool.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from .pipeline import REPROCESS_STAGES
+import logging
+logger = logging.getLogger(__name__)
+
+
+def all_contract_ids() -> List[str]:
+    from . import storage
+
+    return storage.list_contract_ids()
+
+
+_pipeline = None
+
+
+def _reprocess_one(contract_id: str, from_stage: str, from_version: int) -> Dict[str, object]:
+    global _pipeline
+    from .llm_client import LLMClient
+    from .pipeline import ContractPipeline
+    from .services import ExtractionService
+
+    if _pipeline is None:
+        _pipeline = ContractPipeline(extractor=ExtractionService(client=LLMClient(priority="bulk")))
+    t0 = time.perf_counter()
+    try:
+        result = asyncio.run(_pipeline.reprocess(contract_id, from_stage=from_stage, from_version=from_version))
+    except Exception as e:
+        logger.exception("Reprocess failed: %s", contract_id)
+        return {"contract_id": contract_id, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+    return {**result, "status": "done", "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def reprocess_many(contract_ids: List[str], from_stage: str, from_version: int = 1, workers: int = 1) -> Dict[str, object]:
+    t0 = time.perf_counter()
+    results: List[Dict[str, object]] = []
+    if workers <= 1:
+        results = [_reprocess_one(cid, from_stage, from_version) for cid in contract_ids]
+    elif contract_ids:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(contract_ids)), mp_context=ctx) as pool:
+            futures = [pool.submit(_reprocess_one, cid, from_stage, from_version) for cid in contract_ids]
+            for fut in as_completed(futures):
+                results.append(fut.result())
+    failed = [r for r in results if r["status"] == "failed"]
+    return {
+        "contracts": len(results),
+        "versions": sum(len(r.get("versions") or []) for r in results),
+        "failed": failed,
+        "elapsed_s": round(time.perf_counter() - t0, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("contract_ids", nargs="*", help="contracts to rebuild (default: all)")
+    ap.add_argument("--from", dest="from_stage", choices=REPROCESS_STAGES, default="merge")
+    ap.add_argument("--from-version", type=int, default=1)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args(argv)
+
+    summary = reprocess_many(args.contract_ids or all_contract_ids(), args.from_stage, args.from_version, args.workers)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
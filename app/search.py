@@ -0,0 +1,264 @@
+"""Full-text index over clauses (latest state) and the Docling markdown of each version.
+
+SQLite FTS5 file under ``DATA_DIR/index/search.sqlite``. Text is folded before
+indexing (lower case, Vietnamese diacritics stripped, đ → d) so "phong doi"
+finds "Phòng đôi". Maintained on each version save; rebuild with:
+
+    python -m app.search rebuild
+    python -m app.search "hồ bơi"
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import storage
+from .metrics import timed
+from .models import BaseContract, Chunk
+from .segmenter import split_sections
+import logging
+logger = logging.getLogger(__name__)
+
+
+MAX_LIMIT = 200
+SNIPPET_CHARS = 160
+# bm25 weights theo thứ tự cột FTS: title, body, attrs
+BM25_WEIGHTS = (5.0, 1.0, 2.0)
+MARKDOWN_STEPS = ("02_docling_markdown", "03_docling_markdown")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    contract_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    clause_id TEXT,
+    title TEXT,
+    body TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_entries_contract ON entries(contract_id, kind, version);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(title, body, attrs, tokenize = 'unicode61');
+"""
+
+_local = threading.local()
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold(text: str) -> str:
+    """Lower-case and strip diacritics (NFD + drop combining marks, đ → d)."""
+    text = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+
+def index_path() -> str:
+    return os.path.join(storage.DATA_DIR, "index", "search.sqlite")
+
+
+def _connect() -> sqlite3.Connection:
+    path = index_path()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == path:
+        return conn
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    _local.conn, _local.path = conn, path
+    return conn
+
+
+def _flatten(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        return " ".join(f"{k} {_flatten(v)}" for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return " ".join(_flatten(v) for v in value)
+    return str(value)
+
+
+def _delete(conn: sqlite3.Connection, contract_id: str, kind: str, version: Optional[int] = None) -> None:
+    sql = "SELECT id FROM entries WHERE contract_id = ? AND kind = ?"
+    params: List[Any] = [contract_id, kind]
+    if version is not None:
+        sql += " AND version = ?"
+        params.append(version)
+    ids = [(r["id"],) for r in conn.execute(sql, params)]
+    conn.executemany("DELETE FROM entries_fts WHERE rowid = ?", ids)
+    conn.executemany("DELETE FROM entries WHERE id = ?", ids)
+
+
+def _insert(conn: sqlite3.Connection, rows: Iterable[tuple]) -> None:
+    for contract_id, version, kind, clause_id, title, body, attrs in rows:
+        cur = conn.execute(
+            "INSERT INTO entries (contract_id, version, kind, clause_id, title, body) VALUES (?, ?, ?, ?, ?, ?)",
+            (contract_id, version, kind, clause_id, title, body),
+        )
+        conn.execute(
+            "INSERT INTO entries_fts (rowid, title, body, attrs) VALUES (?, ?, ?, ?)",
+            (cur.lastrowid, fold(title or ""), fold(body or ""), fold(attrs)),
+        )
+
+
+@timed("search.index_clauses")
+def index_clauses(contract: BaseContract, version: int) -> None:
+    """Replace the clause entries of a contract with those of ``version`` (latest state only)."""
+    conn = _connect()
+    with conn:
+        row = conn.execute("SELECT MAX(version) AS v FROM entries WHERE contract_id = ? AND kind = 'clause'",
+                           (contract.contract_id,)).fetchone()
+        if row["v"] is not None and row["v"] > version:
+            return
+        _delete(conn, contract.contract_id, "clause")
+        _insert(conn, (
+            (contract.contract_id, version, "clause", c.id, c.title, c.text or "",
+             " ".join([c.type.value, _flatten(c.scope), _flatten(c.policy)]))
+            for c in contract.clauses
+        ))
+
+
+@timed("search.index_markdown")
+def index_markdown(contract_id: str, version: int, chunks: List[Chunk]) -> None:
+    """Index the source markdown of one version, one entry per heading/table section."""
+    conn = _connect()
+    rows = []
+    for chunk in chunks:
+        for section in split_sections(chunk):
+            first = section.markdown.lstrip().split("\n", 1)[0]
+            title = first.lstrip("# ").strip() if first.startswith("#") else (section.source_heading or "")
+            rows.append((contract_id, version, "markdown", None, title, section.markdown, section.label or ""))
+    with conn:
+        _delete(conn, contract_id, "markdown", version)
+        _insert(conn, rows)
+
+
+def _match_expr(query: str) -> Optional[str]:
+    q = query.strip()
+    words = _WORD_RE.findall(fold(q))
+    if not words:
+        return None
+    if len(q) > 1 and q.startswith('"') and q.endswith('"'):
+        return '"' + " ".join(words) + '"'
+    # mọi từ đều phải có; từ cuối khớp theo tiền tố để gõ dở vẫn ra kết quả
+    terms = [f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+
+def _snippet(body: str, words: List[str]) -> str:
+    if not body:
+        return ""
+    folded = fold(body)
+    pos = -1
+    for w in words:
+        m = re.search(r"\b" + re.escape(w), folded)
+        if m and (pos < 0 or m.start() < pos):
+            pos = m.start()
+    # fold giữ nguyên số ký tự với văn bản NFC nên có thể cắt trên bản gốc
+    source = unicodedata.normalize("NFC", body)
+    if len(source) != len(folded):
+        source = folded
+    start = max(0, pos - SNIPPET_CHARS // 3) if pos >= 0 else 0
+    text = " ".join(source[start:start + SNIPPET_CHARS].split())
+    return ("…" if start else "") + text + ("…" if start + SNIPPET_CHARS < len(source) else "")
+
+
+@timed("search.query")
+def search(
+    query: str,
+    contract_id: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """Ranked hits (bm25, best first) for ``query``; ``kind`` is ``clause`` or ``markdown``."""
+    limit = max(1, min(limit, MAX_LIMIT))
+    expr = _match_expr(query)
+    if expr is None:
+        return {"query": query, "hits": []}
+    sql = (
+        "SELECT e.contract_id, e.version, e.kind, e.clause_id, e.title, e.body, "
+        "bm25(entries_fts, ?, ?, ?) AS score "
+        "FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid WHERE entries_fts MATCH ?"
+    )
+    params: List[Any] = [*BM25_WEIGHTS, expr]
+    if contract_id:
+        sql += " AND e.contract_id = ?"
+        params.append(contract_id)
+    if kind:
+        sql += " AND e.kind = ?"
+        params.append(kind)
+    sql += " ORDER BY score LIMIT ? OFFSET ?"
+    params.extend([limit, max(0, offset)])
+    words = _WORD_RE.findall(fold(query))
+    hits = []
+    for r in _connect().execute(sql, params):
+        hits.append({
+            "contract_id": r["contract_id"],
+            "version": r["version"],
+            "kind": r["kind"],
+            "clause_id": r["clause_id"],
+            "title": r["title"],
+            "snippet": _snippet(r["body"], words),
+            "score": round(-r["score"], 4),
+        })
+    return {"query": query, "hits": hits}
+
+
+def _stored_markdown(contract_id: str, version: int) -> Optional[str]:
+    for step in MARKDOWN_STEPS:
+        path = os.path.join(storage.DATA_DIR, "steps", contract_id, f"v{version}", f"{step}.txt")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+    return None
+
+
+def rebuild_index() -> Dict[str, int]:
+    """Re-create the index from the version files and the stored Docling markdown steps."""
+    base = os.path.join(storage.DATA_DIR, "versions")
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM entries_fts")
+        conn.execute("DELETE FROM entries")
+    counts = {"contracts": 0, "markdown": 0}
+    if not os.path.isdir(base):
+        return counts
+    for contract_id in sorted(os.listdir(base)):
+        latest = storage.latest_version(contract_id)
+        if latest is None:
+            continue
+        contract = storage.load_contract_version(contract_id, latest)
+        if contract is not None:
+            index_clauses(contract, latest)
+            counts["contracts"] += 1
+        for version in range(1, latest + 1):
+            md = _stored_markdown(contract_id, version)
+            if md:
+                index_markdown(contract_id, version, [Chunk(markdown=md)])
+                counts["markdown"] += 1
+    logger.info("Rebuilt search index: %s", counts)
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("usage: python -m app.search rebuild | QUERY", file=sys.stderr)
+        return 2
+    if argv == ["rebuild"]:
+        print(json.dumps(rebuild_index()))
+        return 0
+    print(json.dumps(search(" ".join(argv)), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,9 @@ POLICY_KEYS = ["cancellation", "no show", "non-refundable", "hoàn", "huỷ"]
 STOPSELL_KEYS = ["stop sell", "đóng bán", "ngừng bán"]
 PROMO_KEYS = ["promotion", "khuyến mãi", "ưu đãi"]
 
+# top-level headings hoặc marker bảng
+SECTION_SPLIT_RE = re.compile(r"(?m)^(# .+|<<<TABLE:[^>]+>>>)$")
+
 
 def guess_label(text: str) -> str | None:
     t = text.lower()
@@ -33,7 +36,7 @@ def segment_to_chunks(segments: List[Segment], max_chars: int = 5000) -> List[Ch
     for seg in segments:
         text = seg.raw_md
         # simple split on top-level headings or tables markers
-        parts = re.split(r"(?m)^(# .+|<<<TABLE:[^>]+>>>)$", text)
+        parts = SECTION_SPLIT_RE.split(text)
         buffer = ""
         for p in parts:
             if not p:
@@ -48,4 +51,22 @@ def segment_to_chunks(segments: List[Segment], max_chars: int = 5000) -> List[Ch
         if buffer:
             label = guess_label(buffer)
             chunks.append(Chunk(label=label, markdown=buffer, page_range=seg.page_range, source_heading=seg.heading))
-    return chunks 
\ No newline at end of file
+    return chunks 
+
+def split_sections(chunk: Chunk) -> List[Chunk]:
+    """Split a chunk back into its heading/table sections, each labelled on its own."""
+    parts = [p for p in SECTION_SPLIT_RE.split(chunk.markdown) if p and p.strip()]
+    sections: List[Chunk] = []
+    buffer = ""
+    for p in parts:
+        if SECTION_SPLIT_RE.fullmatch(p.strip()) and buffer:
+            sections.append(buffer)
+            buffer = p
+        else:
+            buffer = (buffer + "\n\n" + p).strip() if buffer else p.strip()
+    if buffer:
+        sections.append(buffer)
+    return [
+        Chunk(label=guess_label(s), markdown=s, page_range=chunk.page_range, source_heading=chunk.source_heading)
+        for s in sections
+    ]
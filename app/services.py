@@ -1,23 +1,45 @@
 from __future__ import annotations
 
-from typing import List, Optional, Dict, Any
+import os
+from datetime import date
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 from .docling_client import DoclingClient
+from .pdf_triage import triage_pdf
 from .segmenter import segment_to_chunks
 from .llm_client import LLMClient
-from .models import Segment, Chunk, BaseContract, ChangeSet
-from .validator import validate_base_contract, validate_changeset, auto_repair_json
+from .prompting import select_addendum_chunks, section_hashes
+from .config import get_addendum_token_budget, get_settings
+from .models import Segment, Chunk, BaseContract, ChangeSet, Change
+from .validator import (
+    validate_base_contract,
+    validate_changeset,
+    validate_change,
+    auto_repair_json,
+    repair_meta,
+    repair_clause,
+)
 from .merger import apply_changes
-from .render import render_markdown, redline
-from . import storage
+from .refine import Refiner, apply_refinements
+from .render import render_markdown, redline, iter_markdown, iter_redline
+from .diffing import diff_contracts, iter_diff_markdown
+from . import storage, portfolio, search, readmodel, changes
+import logging
+logger = logging.getLogger(__name__)
 
 
 class DoclingService:
     def __init__(self, client: Optional[DoclingClient] = None):
         self.client = client or DoclingClient()
 
-    def parse_pdf(self, file_path: str) -> List[Segment]:
-        return self.client.parse_pdf(file_path)
+    def triage(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """Local PDF inspection choosing the OCR/table params, None when PDF_TRIAGE_ENABLED is off."""
+        if not get_settings().pdf_triage_enabled:
+            return None
+        return triage_pdf(file_path).to_dict()
+
+    def parse_pdf(self, file_path: str, params_override: Optional[Dict[str, Any]] = None) -> List[Segment]:
+        return self.client.parse_pdf(file_path, params_override=params_override)
 
 
 class SegmentationService:
@@ -29,16 +51,85 @@ class SegmentationService:
 
 
 class ExtractionService:
-    def __init__(self, client: Optional[LLMClient] = None):
+    def __init__(self, client: Optional[LLMClient] = None, token_budget: Optional[int] = None):
         self.client = client or LLMClient()
+        self.token_budget = token_budget if token_budget is not None else get_addendum_token_budget()
+
+    def chunk_hashes(self, chunks: List[Chunk]) -> List[str]:
+        return section_hashes(chunks)
+
+    def select_addendum_chunks(self, chunks: List[Chunk], seen_hashes=None) -> List[Chunk]:
+        return select_addendum_chunks(chunks, seen_hashes=seen_hashes, token_budget=self.token_budget)
 
-    async def extract_base(self, chunks: List[Chunk], source_file: str) -> Dict[str, Any]:
+    async def extract_base(self, chunks: List[Chunk], source_file: str, repairs: Optional[List[dict]] = None) -> Dict[str, Any]:
         data = await self.client.extract(chunks, mode="base", source_file=source_file)
-        return auto_repair_json(data, kind="base")
+        return auto_repair_json(data, kind="base", repairs=repairs)
 
-    async def extract_addendum(self, chunks: List[Chunk], source_file: str) -> Dict[str, Any]:
+    async def extract_addendum(self, chunks: List[Chunk], source_file: str, repairs: Optional[List[dict]] = None) -> Dict[str, Any]:
         data = await self.client.extract(chunks, mode="addendum", source_file=source_file)
-        return auto_repair_json(data, kind="addendum")
+        return auto_repair_json(data, kind="addendum", repairs=repairs)
+
+    def repair(self, data: Dict[str, Any], kind: str) -> Dict[str, Any]:
+        """Apply the post-LLM repairs to an already received extraction (reprocessing)."""
+        return auto_repair_json(data, kind=kind)
+
+    async def stream_base(self, chunks: List[Chunk], source_file: str,
+                          repairs: Optional[List[dict]] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Yield repaired ``("meta", dict)`` and ``("clauses", dict)`` items as the LLM streams them.
+
+        A clause without ``effective_from`` that arrives before ``meta`` (member
+        order is not guaranteed) is held back, with every clause after it, until
+        ``meta`` gives the ``sign_date`` default, as in ``auto_repair_json``.
+        """
+        meta: Optional[Dict[str, Any]] = None
+        pending: List[Tuple[int, Dict[str, Any]]] = []
+        idx = 0
+        async for key, value in self.client.extract_stream(chunks, mode="base", source_file=source_file):
+            if key == "meta":
+                meta = repair_meta(value or {}, repairs)
+                yield key, meta
+                for i, clause in pending:
+                    yield "clauses", repair_clause(clause, i, meta["sign_date"], repairs)
+                pending = []
+            elif key == "clauses":
+                if meta is None and (pending or not (value or {}).get("effective_from")):
+                    # giữ thứ tự clause: index được dùng cho repairs/refine
+                    pending.append((idx, value))
+                else:
+                    default_from = (meta or {}).get("sign_date") or date.today().isoformat()
+                    yield key, repair_clause(value, idx, default_from, repairs)
+                idx += 1
+            else:
+                yield key, value
+        if meta is None:
+            meta = repair_meta({}, repairs)
+            yield "meta", meta
+            for i, clause in pending:
+                yield "clauses", repair_clause(clause, i, meta["sign_date"], repairs)
+
+    async def stream_addendum(self, chunks: List[Chunk], source_file: str) -> AsyncIterator[Tuple[str, Any]]:
+        """Yield ``("changes", dict)`` items and other ChangeSet members as the LLM streams them."""
+        async for key, value in self.client.extract_stream(chunks, mode="addendum", source_file=source_file):
+            yield key, value
+
+
+class RefinementService:
+    def __init__(self, client: Optional[LLMClient] = None, threshold: Optional[float] = None,
+                 max_targets: Optional[int] = None):
+        settings = get_settings()
+        self.enabled = settings.refine_enabled
+        self.refiner = Refiner(
+            client or LLMClient(),
+            settings.refine_confidence_threshold if threshold is None else threshold,
+            settings.refine_max_targets if max_targets is None else max_targets,
+        )
+
+    async def refine(self, doc: Dict[str, Any], mode: str, repairs: List[dict], chunks: List[Chunk]) -> List[dict]:
+        """Re-ask the weak items of ``doc`` (modified in place); returns the per-target results."""
+        return await self.refiner.refine(doc, mode, repairs, chunks)
+
+    def apply(self, doc: Dict[str, Any], results: List[dict]) -> Dict[str, Any]:
+        return apply_refinements(doc, results)
 
 
 class ValidationService:
@@ -51,6 +142,9 @@ class ValidationService:
     def validate_changeset(self, cs: ChangeSet) -> None:
         validate_changeset(cs)
 
+    def validate_change(self, ch: Change) -> None:
+        validate_change(ch)
+
 
 class MergeService:
     def __init__(self):
@@ -70,19 +164,60 @@ class RenderService:
     def to_redline(self, old: Optional[BaseContract], new: BaseContract) -> str:
         return redline(old, new)
 
+    def iter_markdown(self, contract: BaseContract) -> Iterator[str]:
+        return iter_markdown(contract)
+
+    def iter_redline(self, old: Optional[BaseContract], new: BaseContract) -> Iterator[str]:
+        return iter_redline(old, new)
+
+    def diff(self, old: Optional[BaseContract], new: BaseContract) -> dict:
+        return diff_contracts(old, new)
+
+    def iter_diff_markdown(self, diff: dict) -> Iterator[str]:
+        return iter_diff_markdown(diff)
+
 
 class VersioningService:
     def __init__(self):
         pass
 
-    def save_pdf(self, doc_bytes: bytes, filename: str) -> str:
-        return storage.save_pdf(doc_bytes, filename)
+    def save_pdf(self, doc_bytes: bytes, filename: str, contract_id: Optional[str] = None,
+                 version: Optional[int] = None) -> str:
+        return storage.save_pdf(doc_bytes, filename, contract_id=contract_id, version=version)
 
     def next_version_id(self, contract_id: str) -> int:
         return storage.next_version_id(contract_id)
 
-    def save_contract_version(self, contract: BaseContract, version: int) -> str:
-        return storage.save_contract_version(contract, version)
+    def save_contract_version(self, contract: BaseContract, version: int, diff: Optional[dict] = None,
+                              source_doc: Optional[str] = None) -> str:
+        """Persist a version, update the indexes and append it to the change feed.
+
+        ``diff`` is the structured diff against version-1 when the caller already has it.
+        """
+        if diff is None:
+            previous = storage.load_contract_version(contract.contract_id, version - 1) if version > 1 else None
+            diff = diff_contracts(previous, contract)
+        path = storage.save_contract_version(contract, version)
+        # index lỗi không được làm hỏng ingest; rebuild lại bằng `python -m app.portfolio rebuild` / `python -m app.search rebuild`
+        for name, index in (("portfolio", portfolio.index_contract), ("search", search.index_clauses)):
+            try:
+                index(contract, version)
+            except Exception as e:
+                logger.warning("%s index update failed: contract_id=%s version=%s error=%s", name, contract.contract_id, version, e)
+        try:
+            changes.append_change(contract, version, diff, source_doc=source_doc)
+        except Exception as e:
+            logger.warning("change feed append failed: contract_id=%s version=%s error=%s", contract.contract_id, version, e)
+        return path
+
+    def index_source_markdown(self, contract_id: str, version: int, chunks: List[Chunk]) -> None:
+        try:
+            search.index_markdown(contract_id, version, chunks)
+        except Exception as e:
+            logger.warning("search index update failed: contract_id=%s version=%s error=%s", contract_id, version, e)
+
+    def search(self, query: str, **filters) -> Dict[str, Any]:
+        return search.search(query, **filters)
 
     def load_contract_version(self, contract_id: str, version: int) -> Optional[BaseContract]:
         return storage.load_contract_version(contract_id, version)
@@ -90,15 +225,72 @@ class VersioningService:
     def latest_version(self, contract_id: str) -> Optional[int]:
         return storage.latest_version(contract_id)
 
+    def read_changes(self, since: int = 0, limit: int = 100, contract_id: Optional[str] = None) -> Dict[str, Any]:
+        return changes.read_changes(since, limit=limit, contract_id=contract_id)
+
+    def query_portfolio(self, **filters) -> Dict[str, Any]:
+        return portfolio.query_contracts(**filters)
+
     def state_as_of(self, contract: BaseContract, as_of) -> BaseContract:
         return storage.state_as_of(contract, as_of)
 
+    def load_compact(self, contract_id: str, version: int) -> Optional[readmodel.CompactContract]:
+        return readmodel.load_compact(contract_id, version)
+
+    def load_idempotency_keys(self, contract_id: str) -> Dict[str, int]:
+        return storage.load_idempotency_keys(contract_id)
+
+    def add_idempotency_key(self, contract_id: str, key: str, version: int) -> str:
+        return storage.add_idempotency_key(contract_id, key, version)
+
+    def load_chunk_hashes(self, contract_id: str) -> set:
+        return storage.load_chunk_hashes(contract_id)
+
+    def add_chunk_hashes(self, contract_id: str, hashes) -> str:
+        return storage.add_chunk_hashes(contract_id, hashes)
+
+    def render_path(self, contract_id: str, version: int, kind: str = "markdown") -> str:
+        return storage.render_path(contract_id, version, kind)
+
+    def write_render_lines(self, contract_id: str, version: int, kind: str, lines) -> str:
+        return storage.write_render_lines(contract_id, version, kind, lines)
+
     def save_render(self, contract_id: str, version: int, content_md: str, redline_md: Optional[str] = None) -> dict:
         return storage.save_render(contract_id, version, content_md, redline_md)
 
+    def version_mtime_ns(self, contract_id: str, version: int) -> Optional[int]:
+        return storage.version_mtime_ns(contract_id, version)
+
+    def load_diff(self, contract_id: str, from_version: int, to_version: int) -> Optional[dict]:
+        return storage.load_diff(contract_id, from_version, to_version)
+
+    def save_diff(self, contract_id: str, from_version: int, to_version: int, payload: dict) -> str:
+        return storage.save_diff(contract_id, from_version, to_version, payload)
+
     # Per-step logging helpers
     def save_step_text(self, contract_id: str, version: int, step_name: str, content: str) -> str:
         return storage.save_step_text(contract_id, version, step_name, content)
 
     def save_step_json(self, contract_id: str, version: int, step_name: str, obj) -> str:
-        return storage.save_step_json(contract_id, version, step_name, obj) 
\ No newline at end of file
+        return storage.save_step_json(contract_id, version, step_name, obj) 
+
+    def load_step_text(self, contract_id: str, version: int, step_name: str) -> Optional[str]:
+        return storage.load_step_text(contract_id, version, step_name)
+
+    def load_step_json(self, contract_id: str, version: int, step_name: str):
+        return storage.load_step_json(contract_id, version, step_name)
+
+    def step_mtime_ns(self, contract_id: str, version: int, step_name: str) -> Optional[int]:
+        try:
+            return os.stat(storage.step_path(contract_id, version, step_name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load_llm_output(self, source_file: str, mode: str) -> Optional[Tuple[str, int]]:
+        """Raw LLM content saved for ``source_file`` and its mtime_ns, if present."""
+        path = storage.llm_output_path(source_file, mode)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read(), os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return None
@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import os
 import json
+import tempfile
+from contextlib import contextmanager
 from datetime import date, datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 from pydantic import TypeAdapter
 
@@ -11,34 +13,81 @@ from .models import BaseContract, ChangeSet
 import logging
 logger = logging.getLogger(__name__)
 from .config import get_data_dir
+from .metrics import timed, add_bytes
 import re
 
 
-DATA_DIR = get_data_dir()
+def _data_dir() -> str:
+    # đọc lúc gọi thay vì lúc import, để import nhẹ và đổi DATA_DIR được trước lần dùng đầu
+    return get_data_dir()
+
+
+def __getattr__(name: str):
+    if name == "DATA_DIR":
+        return _data_dir()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _ensure_dirs():
-    logger.debug("Ensuring data directories under %s", DATA_DIR)
-    os.makedirs(DATA_DIR, exist_ok=True)
-    os.makedirs(os.path.join(DATA_DIR, "contracts"), exist_ok=True)
-    os.makedirs(os.path.join(DATA_DIR, "docs"), exist_ok=True)
-    os.makedirs(os.path.join(DATA_DIR, "versions"), exist_ok=True)
-    os.makedirs(os.path.join(DATA_DIR, "renders"), exist_ok=True)
-    os.makedirs(os.path.join(DATA_DIR, "steps"), exist_ok=True)
+    root = _data_dir()
+    logger.debug("Ensuring data directories under %s", root)
+    os.makedirs(root, exist_ok=True)
+    os.makedirs(os.path.join(root, "contracts"), exist_ok=True)
+    os.makedirs(os.path.join(root, "docs"), exist_ok=True)
+    os.makedirs(os.path.join(root, "versions"), exist_ok=True)
+    os.makedirs(os.path.join(root, "renders"), exist_ok=True)
+    os.makedirs(os.path.join(root, "steps"), exist_ok=True)
+
+
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
-def save_pdf(doc_bytes: bytes, filename: str) -> str:
+@contextmanager
+def _atomic_open(path: str, mode: str = "w"):
+    """Write to a unique temp file in the target directory and rename it over ``path`` on success.
+
+    Readers (and other workers) see either the old or the new file, never a partial one.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-", suffix=".part")
+    try:
+        # mkstemp tạo file 0600; giữ quyền như open() thông thường
+        os.fchmod(fd, 0o666 & ~_UMASK)
+        with os.fdopen(fd, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@timed("storage.save_pdf")
+def save_pdf(doc_bytes: bytes, filename: str, contract_id: Optional[str] = None, version: Optional[int] = None) -> str:
+    """Store an uploaded PDF; with ``contract_id``/``version`` under ``docs/{contract_id}/v{version}/``.
+
+    Callers pass the version reserved under the contract lock so uploads with the
+    same file name for different contracts never replace each other's PDF.
+    """
     _ensure_dirs()
-    path = os.path.join(DATA_DIR, "docs", filename)
+    add_bytes("storage.save_pdf", "out", len(doc_bytes))
+    if contract_id is not None and version is not None:
+        path = os.path.join(_data_dir(), "docs", contract_id, f"v{version}", os.path.basename(filename))
+    else:
+        path = os.path.join(_data_dir(), "docs", filename)
     logger.info("Saving PDF: %s", path)
-    with open(path, "wb") as f:
+    with _atomic_open(path, "wb") as f:
         f.write(doc_bytes)
     return path
 
 
 def next_version_id(contract_id: str) -> int:
+    """Next free version number; callers hold the contract lock (see :mod:`app.locks`)."""
     _ensure_dirs()
-    base = os.path.join(DATA_DIR, "versions", contract_id)
+    base = os.path.join(_data_dir(), "versions", contract_id)
     os.makedirs(base, exist_ok=True)
     existing = [int(p.split(".")[0]) for p in os.listdir(base) if p.endswith(".json")]
     next_v = max(existing or [0]) + 1
@@ -46,29 +95,39 @@ def next_version_id(contract_id: str) -> int:
     return next_v
 
 
+@timed("storage.save_version")
 def save_contract_version(contract: BaseContract, version: int) -> str:
     _ensure_dirs()
-    base = os.path.join(DATA_DIR, "versions", contract.contract_id)
+    base = os.path.join(_data_dir(), "versions", contract.contract_id)
     os.makedirs(base, exist_ok=True)
     path = os.path.join(base, f"{version}.json")
     logger.info("Saving contract version: %s", path)
-    with open(path, "w", encoding="utf-8") as f:
+    with _atomic_open(path) as f:
         json.dump(contract.model_dump(mode="json"), f, ensure_ascii=False, indent=2, default=str)
+        add_bytes("storage.save_version", "out", f.tell())
     return path
 
 
+@timed("storage.load_version")
 def load_contract_version(contract_id: str, version: int) -> Optional[BaseContract]:
-    path = os.path.join(DATA_DIR, "versions", contract_id, f"{version}.json")
+    path = os.path.join(_data_dir(), "versions", contract_id, f"{version}.json")
     if not os.path.exists(path):
         logger.warning("Version not found: %s", path)
         return None
     with open(path, "r", encoding="utf-8") as f:
         data = json.load(f)
+        add_bytes("storage.load_version", "in", f.tell())
     return TypeAdapter(BaseContract).validate_python(data)
 
 
+def list_contract_ids() -> List[str]:
+    """Every contract with a version directory, sorted (the source of truth the indexes are built from)."""
+    base = os.path.join(_data_dir(), "versions")
+    return sorted(os.listdir(base)) if os.path.isdir(base) else []
+
+
 def latest_version(contract_id: str) -> Optional[int]:
-    base = os.path.join(DATA_DIR, "versions", contract_id)
+    base = os.path.join(_data_dir(), "versions", contract_id)
     if not os.path.exists(base):
         return None
     versions = [int(p.split(".")[0]) for p in os.listdir(base) if p.endswith(".json")]
@@ -82,23 +141,80 @@ def state_as_of(contract: BaseContract, as_of: date) -> BaseContract:
     return BaseContract(contract_id=contract.contract_id, meta=contract.meta, clauses=filtered)
 
 
+@timed("storage.save_render")
 def save_render(contract_id: str, version: int, content_md: str, redline_md: str | None = None) -> dict:
     _ensure_dirs()
-    base = os.path.join(DATA_DIR, "renders", contract_id)
+    base = os.path.join(_data_dir(), "renders", contract_id)
     os.makedirs(base, exist_ok=True)
     out_md = os.path.join(base, f"v{version}.md")
     logger.info("Saving render markdown: %s", out_md)
-    with open(out_md, "w", encoding="utf-8") as f:
+    with _atomic_open(out_md) as f:
         f.write(content_md)
     out_red = None
     if redline_md:
         out_red = os.path.join(base, f"v{version}_redline.md")
         logger.info("Saving redline markdown: %s", out_red)
-        with open(out_red, "w", encoding="utf-8") as f:
+        with _atomic_open(out_red) as f:
             f.write(redline_md)
     return {"markdown": out_md, "redline": out_red} 
 
 
+def render_path(contract_id: str, version: int, kind: str = "markdown") -> str:
+    """Path of the stored render: ``v{N}.md`` (markdown) or ``v{N}_redline.md`` (redline)."""
+    name = f"v{version}.md" if kind == "markdown" else f"v{version}_redline.md"
+    return os.path.join(_data_dir(), "renders", contract_id, name)
+
+
+@timed("storage.write_render")
+def write_render_lines(contract_id: str, version: int, kind: str, lines) -> str:
+    """Stream rendered lines to the render file (joined with newlines), replacing it atomically."""
+    path = render_path(contract_id, version, kind)
+    with _atomic_open(path) as f:
+        for i, line in enumerate(lines):
+            if i:
+                f.write("\n")
+            f.write(line)
+        add_bytes("storage.write_render", "out", f.tell())
+    logger.info("Saved render (%s): %s", kind, path)
+    return path
+
+
+def version_path(contract_id: str, version: int) -> str:
+    return os.path.join(_data_dir(), "versions", contract_id, f"{version}.json")
+
+
+def version_mtime_ns(contract_id: str, version: int) -> Optional[int]:
+    """mtime (ns) of a stored version file, or None if the version does not exist."""
+    try:
+        return os.stat(version_path(contract_id, version)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _diff_path(contract_id: str, from_version: int, to_version: int) -> str:
+    return os.path.join(_data_dir(), "renders", contract_id, f"diff_v{from_version}_v{to_version}.json")
+
+
+def load_diff(contract_id: str, from_version: int, to_version: int) -> Optional[dict]:
+    path = _diff_path(contract_id, from_version, to_version)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning("Failed to load diff %s: %s", path, e)
+        return None
+
+
+def save_diff(contract_id: str, from_version: int, to_version: int, payload: dict) -> str:
+    """Store a version-pair diff next to the renders, replacing it atomically."""
+    path = _diff_path(contract_id, from_version, to_version)
+    with _atomic_open(path) as f:
+        json.dump(payload, f, ensure_ascii=False, default=str)
+    return path
+
+
 def save_llm_output(source_file: str, mode: str, content: str) -> str:
     """Save raw LLM response content to a txt file under DATA_DIR/llm.
 
@@ -111,28 +227,43 @@ def save_llm_output(source_file: str, mode: str, content: str) -> str:
         Output file path.
     """
     _ensure_dirs()
-    out_dir = os.path.join(DATA_DIR, "llm")
-    os.makedirs(out_dir, exist_ok=True)
-    base_name = os.path.splitext(os.path.basename(source_file))[0]
-    out_path = os.path.join(out_dir, f"{base_name}_{mode}.txt")
+    out_path = llm_output_path(source_file, mode)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
     logger.info("Saving LLM raw output: %s", out_path)
     with open(out_path, "w", encoding="utf-8") as f:
         f.write(content)
     return out_path
 
 
+def llm_output_path(source_file: str, mode: str) -> str:
+    """``llm/{contract_id}/v{N}/{name}_{mode}.txt`` for PDFs stored per version, ``llm/{name}_{mode}.txt`` otherwise."""
+    base_name = os.path.splitext(os.path.basename(source_file))[0]
+    docs = os.path.join(_data_dir(), "docs")
+    rel = os.path.relpath(os.path.dirname(os.path.abspath(source_file)), os.path.abspath(docs))
+    if rel == "." or rel.startswith(".."):
+        # PDF lưu phẳng (version cũ) hoặc ngoài DATA_DIR/docs
+        return os.path.join(_data_dir(), "llm", f"{base_name}_{mode}.txt")
+    return os.path.join(_data_dir(), "llm", rel, f"{base_name}_{mode}.txt")
+
+
 def _steps_dir(contract_id: str, version: int) -> str:
     _ensure_dirs()
-    path = os.path.join(DATA_DIR, "steps", contract_id, f"v{version}")
+    path = os.path.join(_data_dir(), "steps", contract_id, f"v{version}")
     os.makedirs(path, exist_ok=True)
     return path
 
 
+def step_file_path(contract_id: str, version: int, file_name: str) -> str:
+    """Path of an arbitrary artifact next to the step files of a version."""
+    return os.path.join(_steps_dir(contract_id, version), _sanitize_step_name(file_name))
+
+
 def _sanitize_step_name(step_name: str) -> str:
     name = step_name.strip().replace(" ", "_")
     return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
 
 
+@timed("storage.save_step")
 def save_step_text(contract_id: str, version: int, step_name: str, content: str) -> str:
     """Save free-form text content for a pipeline step.
 
@@ -144,10 +275,81 @@ def save_step_text(contract_id: str, version: int, step_name: str, content: str)
     logger.info("Saving step text: %s", out_path)
     with open(out_path, "w", encoding="utf-8") as f:
         f.write(content)
+        add_bytes("storage.save_step", "out", f.tell())
     return out_path
 
 
 def save_step_json(contract_id: str, version: int, step_name: str, obj) -> str:
     """Save JSON-serialized content for a pipeline step as .txt (pretty JSON)."""
     text = json.dumps(obj, ensure_ascii=False, indent=2, default=str)
-    return save_step_text(contract_id, version, step_name, text)
\ No newline at end of file
+    return save_step_text(contract_id, version, step_name, text)
+
+
+def step_path(contract_id: str, version: int, step_name: str) -> str:
+    return os.path.join(_data_dir(), "steps", contract_id, f"v{version}", f"{_sanitize_step_name(step_name)}.txt")
+
+
+def load_step_text(contract_id: str, version: int, step_name: str) -> Optional[str]:
+    """Content saved by :func:`save_step_text`, or None if the step was not recorded."""
+    try:
+        with open(step_path(contract_id, version, step_name), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def load_step_json(contract_id: str, version: int, step_name: str):
+    text = load_step_text(contract_id, version, step_name)
+    return json.loads(text) if text is not None else None
+
+
+def _chunk_hashes_path(contract_id: str) -> str:
+    return os.path.join(_data_dir(), "chunks", f"{contract_id}.json")
+
+
+def load_chunk_hashes(contract_id: str) -> set:
+    """Load content hashes of chunks seen in the contract's earlier documents."""
+    path = _chunk_hashes_path(contract_id)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return set(json.load(f))
+
+
+def add_chunk_hashes(contract_id: str, hashes) -> str:
+    """Merge new chunk hashes into DATA_DIR/chunks/{contract_id}.json."""
+    _ensure_dirs()
+    os.makedirs(os.path.join(_data_dir(), "chunks"), exist_ok=True)
+    merged = load_chunk_hashes(contract_id) | set(hashes)
+    path = _chunk_hashes_path(contract_id)
+    logger.info("Saving chunk hashes: %s (%s)", path, len(merged))
+    with _atomic_open(path) as f:
+        json.dump(sorted(merged), f)
+    return path
+
+
+def _idempotency_path(contract_id: str) -> str:
+    return os.path.join(_data_dir(), "idempotency", f"{contract_id}.json")
+
+
+def load_idempotency_keys(contract_id: str) -> Dict[str, int]:
+    """PDF sha256 -> version already produced from that upload."""
+    path = _idempotency_path(contract_id)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {k: int(v) for k, v in json.load(f).items()}
+    except Exception as e:
+        logger.warning("Failed to load idempotency keys %s: %s", path, e)
+        return {}
+
+
+def add_idempotency_key(contract_id: str, key: str, version: int) -> str:
+    """Record ``key`` -> ``version``; callers hold the contract lock."""
+    keys = load_idempotency_keys(contract_id)
+    keys[key] = version
+    path = _idempotency_path(contract_id)
+    with _atomic_open(path) as f:
+        json.dump(keys, f, indent=2, sort_keys=True)
+    return path
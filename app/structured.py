@@ -0,0 +1,215 @@
+"""Structured-output response formats derived from ``app/schemas/*.schema.json``.
+
+Extraction asks for ``response_format={"type": "json_schema", "strict": true}``
+so the model can only emit documents with every required member and valid enum
+values. Strict mode needs closed objects with every property required, so the
+repo schemas are converted:
+
+- members the pipeline fills itself (``contract_id``, ``meta.source_file``) are dropped;
+- optional properties become required but nullable;
+- free-form members (objects without ``properties``, arrays without ``items``,
+  e.g. ``scope``, ``policy``, ``table``, ``payload``) are sent as JSON-encoded
+  strings and decoded by :func:`decode` / :func:`decode_member`, so decoded
+  outputs are still checked locally against the repo schema;
+- keywords strict mode rejects (``format``, ``minimum``, ...) are dropped and
+  checked locally instead.
+
+``LLM_STRUCTURED_OUTPUTS``: ``on`` always uses the schema, ``off`` sends plain
+``json_object`` and validates locally with jsonschema, ``auto`` (default) uses
+the schema until the provider rejects it once, then falls back to ``off`` for
+the rest of the process.
+"""
+from __future__ import annotations
+
+import copy
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import get_settings
+from .validator import BASE_SCHEMA_PATH, CHANGESET_SCHEMA_PATH, _load_schema
+from . import metrics
+import logging
+logger = logging.getLogger(__name__)
+
+
+SCHEMA_FILES = {"base": BASE_SCHEMA_PATH, "addendum": CHANGESET_SCHEMA_PATH}
+SCHEMA_NAMES = {"base": "base_contract", "addendum": "changeset"}
+# các field pipeline tự điền, không bắt LLM trả
+PIPELINE_FIELDS = {"base": {(): {"contract_id"}, ("meta",): {"source_file"}}, "addendum": {}}
+_STRICT_UNSUPPORTED = ("$schema", "$id", "title", "format", "minimum", "maximum")
+
+STRUCTURED_RESULTS = metrics.REGISTRY.register(metrics.Counter(
+    "contract_llm_structured_total",
+    "Extraction outputs by response format (schema/json_object) and local validation result.",
+))
+
+_unsupported: Optional[str] = None
+
+
+class SchemaRejected(RuntimeError):
+    """The provider answered 400 to a json_schema response format."""
+
+
+def _types(schema: Dict[str, Any]) -> List[str]:
+    t = schema.get("type")
+    return list(t) if isinstance(t, list) else [t] if t else []
+
+
+def response_schema(mode: str) -> Dict[str, Any]:
+    """The repo schema of ``mode`` without the members the pipeline fills in."""
+    schema = copy.deepcopy(_load_schema(SCHEMA_FILES[mode]))
+    for path, names in PIPELINE_FIELDS[mode].items():
+        node = schema
+        for key in path:
+            node = node["properties"][key]
+        for name in names:
+            node["properties"].pop(name, None)
+        node["required"] = [r for r in node.get("required", []) if r not in names]
+    return schema
+
+
+def _strict(schema: Dict[str, Any], required: bool) -> Tuple[Dict[str, Any], Any]:
+    """(strict-mode schema, decode plan) of one node; the plan says which values were JSON-encoded."""
+    types = _types(schema)
+    nullable = "null" in types or not required
+    kinds = [t for t in types if t != "null"]
+    kind = kinds[0] if len(kinds) == 1 else None
+    plan: Any = None
+    if kind == "object" and schema.get("properties"):
+        req = set(schema.get("required", []))
+        props: Dict[str, Any] = {}
+        plans: Dict[str, Any] = {}
+        for name, sub in schema["properties"].items():
+            props[name], p = _strict(sub, name in req)
+            if p is not None:
+                plans[name] = p
+        out: Dict[str, Any] = {"type": "object", "properties": props, "required": list(props), "additionalProperties": False}
+        plan = {"props": plans} if plans else None
+    elif kind == "array" and "items" in schema:
+        items, p = _strict(schema["items"], True)
+        out = {"type": "array", "items": items}
+        plan = {"items": p} if p is not None else None
+    elif kind in ("object", "array") or kind is None:
+        # object/array tự do: strict mode không cho phép → gửi dạng chuỗi JSON
+        out = {"type": "string", "description": f"JSON-encoded {kind or 'value'}"}
+        plan = "json"
+    else:
+        out = {k: v for k, v in schema.items() if k not in _STRICT_UNSUPPORTED}
+        out["type"] = kind
+        if schema.get("format") == "date":
+            out["description"] = "YYYY-MM-DD"
+    if nullable:
+        out["type"] = [out["type"], "null"]
+        if "enum" in out:
+            out["enum"] = out["enum"] + [None]
+    return out, plan
+
+
+@lru_cache(maxsize=None)
+def _compiled(mode: str) -> Tuple[str, Any]:
+    schema, plan = _strict(response_schema(mode), True)
+    return json.dumps(schema), plan
+
+
+def response_format(mode: str) -> Dict[str, Any]:
+    """``response_format`` for ``mode``: strict json_schema when enabled, else json_object."""
+    if mode not in SCHEMA_FILES or not enabled():
+        return {"type": "json_object"}
+    return {"type": "json_schema", "json_schema": {"name": SCHEMA_NAMES[mode], "strict": True,
+                                                   "schema": json.loads(_compiled(mode)[0])}}
+
+
+def is_structured(payload: Dict[str, Any]) -> bool:
+    return (payload.get("response_format") or {}).get("type") == "json_schema"
+
+
+def enabled() -> bool:
+    setting = get_settings().llm_structured_outputs
+    return setting == "on" or (setting == "auto" and _unsupported is None)
+
+
+def can_fall_back() -> bool:
+    return get_settings().llm_structured_outputs == "auto"
+
+
+def rejects_schema(body: str) -> bool:
+    """Whether a 400 body says the provider does not support the json_schema response format."""
+    text = (body or "").lower()
+    return can_fall_back() and ("response_format" in text or "json_schema" in text)
+
+
+def mark_unsupported(reason: str) -> None:
+    global _unsupported
+    if _unsupported is None:
+        logger.warning("Structured outputs rejected by provider, using json_object + local validation: %s", reason[:300])
+    _unsupported = reason
+
+
+def _decode(value: Any, plan: Any, errors: Optional[List[str]] = None, path: Tuple[Any, ...] = ()) -> Any:
+    if plan is None or value is None:
+        return value
+    if plan == "json":
+        if not isinstance(value, str):
+            return value
+        if not value.strip() or value.strip() == "null":
+            return None
+        try:
+            return json.loads(value)
+        except ValueError as e:
+            if errors is not None:
+                errors.append(f"{'/'.join(str(p) for p in path) or '(root)'}: not a valid JSON-encoded value ({e})")
+            return value  # chuỗi thô: validate báo sai kiểu
+    if isinstance(value, dict) and "props" in plan:
+        for key, p in plan["props"].items():
+            if key in value:
+                value[key] = _decode(value[key], p, errors, path + (key,))
+    elif isinstance(value, list) and "items" in plan:
+        return [_decode(v, plan["items"], errors, path + (i,)) for i, v in enumerate(value)]
+    return value
+
+
+def decode(doc: Dict[str, Any], mode: str, errors: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Decode the JSON-encoded free-form members of a structured output (in place).
+
+    Members that are not valid JSON are left as the raw string; when ``errors``
+    is given a message is appended for each of them.
+    """
+    if mode not in SCHEMA_FILES:
+        return doc
+    return _decode(doc, _compiled(mode)[1], errors)
+
+
+def decode_member(mode: str, key: str, value: Any) -> Any:
+    """:func:`decode` for one streamed top-level member, or one element of ``clauses``/``changes``.
+
+    Raises ``ValueError`` when a JSON-encoded member cannot be decoded; other
+    schema mismatches are left to the repairs and model checks downstream.
+    """
+    if mode not in SCHEMA_FILES:
+        return value
+    plan = ((_compiled(mode)[1] or {}).get("props") or {}).get(key)
+    if isinstance(plan, dict) and "items" in plan and not isinstance(value, list):
+        plan = plan["items"]
+    errors: List[str] = []
+    value = _decode(value, plan, errors, (key,))
+    if errors:
+        raise ValueError(f"LLM output has undecodable members: {'; '.join(errors[:5])}")
+    return value
+
+
+@lru_cache(maxsize=None)
+def _validator(mode: str):
+    from jsonschema import Draft202012Validator, FormatChecker
+
+    return Draft202012Validator(response_schema(mode), format_checker=FormatChecker())
+
+
+def validate(doc: Dict[str, Any], mode: str) -> List[str]:
+    """Local schema check of an extraction (also run on decoded json_schema outputs)."""
+    errors = sorted(_validator(mode).iter_errors(doc), key=lambda e: list(e.path))
+    return [f"{'/'.join(str(p) for p in e.path) or '(root)'}: {e.message}" for e in errors]
+
+
+def record(mode: str, fmt: str, valid: bool) -> None:
+    STRUCTURED_RESULTS.inc(mode=mode, format=fmt, result="valid" if valid else "invalid")
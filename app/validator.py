@@ -3,11 +3,11 @@ from __future__ import annotations
 import json
 import os
 from datetime import date
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-from jsonschema import Draft202012Validator
+from functools import lru_cache
 
-from .models import BaseContract, Clause, ChangeSet
+from .models import BaseContract, Clause, ChangeSet, Change
 
 
 def _load_schema(path: str) -> Dict[str, Any]:
@@ -19,8 +19,28 @@ BASE_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schemas", "base_cont
 CHANGESET_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schemas", "changeset.schema.json")
 
 
-base_validator = Draft202012Validator(_load_schema(BASE_SCHEMA_PATH))
-changeset_validator = Draft202012Validator(_load_schema(CHANGESET_SCHEMA_PATH))
+@lru_cache(maxsize=None)
+def _schema_validator(path: str):
+    # jsonschema và việc compile schema chỉ tốn chi phí ở lần validate đầu tiên
+    from jsonschema import Draft202012Validator
+
+    return Draft202012Validator(_load_schema(path))
+
+
+def get_base_validator():
+    return _schema_validator(BASE_SCHEMA_PATH)
+
+
+def get_changeset_validator():
+    return _schema_validator(CHANGESET_SCHEMA_PATH)
+
+
+def __getattr__(name: str):
+    if name == "base_validator":
+        return get_base_validator()
+    if name == "changeset_validator":
+        return get_changeset_validator()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class ValidationError(Exception):
@@ -28,7 +48,7 @@ class ValidationError(Exception):
 
 
 def validate_base_contract(bc: BaseContract):
-    errors = sorted(base_validator.iter_errors(bc.model_dump(mode="json")), key=lambda e: e.path)
+    errors = sorted(get_base_validator().iter_errors(bc.model_dump(mode="json")), key=lambda e: e.path)
     if errors:
         raise ValidationError("; ".join([e.message for e in errors]))
     for c in bc.clauses:
@@ -36,18 +56,22 @@ def validate_base_contract(bc: BaseContract):
 
 
 def validate_changeset(cs: ChangeSet):
-    errors = sorted(changeset_validator.iter_errors(cs.model_dump(mode="json")), key=lambda e: e.path)
+    errors = sorted(get_changeset_validator().iter_errors(cs.model_dump(mode="json")), key=lambda e: e.path)
     if errors:
         raise ValidationError("; ".join([e.message for e in errors]))
     # simple business checks
     for ch in cs.changes:
-        if ch.type.name == "RateAdjustment":
-            if ch.payload is None or float(ch.payload.get("rate", 0)) <= 0:
-                raise ValidationError("RateAdjustment requires payload.rate > 0")
-        if ch.payload and "discount_pct" in ch.payload:
-            dp = float(ch.payload["discount_pct"])  # may be nested rule but this is simple guard
-            if dp < 0 or dp > 100:
-                raise ValidationError("discount_pct must be between 0 and 100")
+        validate_change(ch)
+
+
+def validate_change(ch: Change):
+    if ch.type.name == "RateAdjustment":
+        if ch.payload is None or float(ch.payload.get("rate", 0)) <= 0:
+            raise ValidationError("RateAdjustment requires payload.rate > 0")
+    if ch.payload and "discount_pct" in ch.payload:
+        dp = float(ch.payload["discount_pct"])  # may be nested rule but this is simple guard
+        if dp < 0 or dp > 100:
+            raise ValidationError("discount_pct must be between 0 and 100")
 
 
 def _validate_clause_business(c: Clause):
@@ -66,41 +90,62 @@ def _validate_clause_business(c: Clause):
         raise ValidationError("effective_to earlier than effective_from")
 
 
-def auto_repair_json(doc: Dict[str, Any], kind: str) -> Dict[str, Any]:
+def auto_repair_json(doc: Dict[str, Any], kind: str, repairs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     """Best-effort repair of extracted JSON to satisfy minimum schema.
 
     - base: ensure meta keys and required clause fields exist with sensible defaults
     - addendum: ensure changes array exists (light repair)
+
+    Every default filled in is appended to ``repairs`` (when given) as
+    ``{"target": "meta"|"clause", "index": int|None, "field": str}``.
     """
     if kind == "base":
-        # meta defaults
-        meta = doc.get("meta") or {}
-        if not meta.get("hotel"):
-            meta["hotel"] = "Unknown Hotel"
-        if not meta.get("sign_date"):
-            meta["sign_date"] = date.today().isoformat()
-        if not meta.get("currency"):
-            meta["currency"] = "VND"
+        meta = repair_meta(doc.get("meta") or {}, repairs)
         doc["meta"] = meta
 
         # clauses defaults
         clauses = doc.get("clauses") or []
-        repaired: List[Dict[str, Any]] = []
         default_from = meta.get("sign_date") or date.today().isoformat()
-        for idx, c in enumerate(clauses):
-            c = dict(c or {})
-            if not c.get("id"):
-                c["id"] = f"c{idx+1}"
-            if not c.get("type"):
-                c["type"] = "Other"
-            if not c.get("title"):
-                c["title"] = f"Clause {idx+1}"
-            if not c.get("effective_from"):
-                c["effective_from"] = default_from
-            if c.get("confidence") is None:
-                c["confidence"] = 0.5
-            repaired.append(c)
-        doc["clauses"] = repaired
+        doc["clauses"] = [repair_clause(c, idx, default_from, repairs) for idx, c in enumerate(clauses)]
     elif kind == "addendum":
         doc.setdefault("changes", [])
-    return doc
\ No newline at end of file
+    return doc
+
+
+def _note(repairs: Optional[List[Dict[str, Any]]], target: str, index: Optional[int], field: str) -> None:
+    if repairs is not None:
+        repairs.append({"target": target, "index": index, "field": field})
+
+
+def repair_meta(meta: Dict[str, Any], repairs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    if not meta.get("hotel"):
+        meta["hotel"] = "Unknown Hotel"
+        _note(repairs, "meta", None, "hotel")
+    if not meta.get("sign_date"):
+        meta["sign_date"] = date.today().isoformat()
+        _note(repairs, "meta", None, "sign_date")
+    if not meta.get("currency"):
+        meta["currency"] = "VND"
+        _note(repairs, "meta", None, "currency")
+    return meta
+
+
+def repair_clause(c: Dict[str, Any] | None, idx: int, default_from: str,
+                  repairs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    c = dict(c or {})
+    if not c.get("id"):
+        c["id"] = f"c{idx+1}"
+        _note(repairs, "clause", idx, "id")
+    if not c.get("type"):
+        c["type"] = "Other"
+        _note(repairs, "clause", idx, "type")
+    if not c.get("title"):
+        c["title"] = f"Clause {idx+1}"
+        _note(repairs, "clause", idx, "title")
+    if not c.get("effective_from"):
+        c["effective_from"] = default_from
+        _note(repairs, "clause", idx, "effective_from")
+    if c.get("confidence") is None:
+        c["confidence"] = 0.5
+        _note(repairs, "clause", idx, "confidence")
+    return c
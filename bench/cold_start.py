@@ -0,0 +1,119 @@
+"""Cold-start benchmark: import time of ``app.main`` and spawn-to-ready time of uvicorn.
+
+    python -m bench.cold_start                  # 5 runs, check against the default targets
+    python -m bench.cold_start --runs 10 --ready-target-ms 1200
+
+Each run starts a fresh interpreter with a throw-away ``DATA_DIR``. "ready" is
+the first ``200`` from ``/health``; "first_request" is the latency of that
+first health call once the socket accepts. Exit status is 1 when a median
+exceeds its target.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# mục tiêu cho máy dev; phần lớn thời gian import là FastAPI/pydantic
+DEFAULT_IMPORT_TARGET_MS = 500.0
+DEFAULT_READY_TARGET_MS = 800.0
+
+IMPORT_SNIPPET = (
+    "import time; t0 = time.perf_counter(); import app.main; "
+    "print((time.perf_counter() - t0) * 1000.0)"
+)
+
+
+def _env(data_dir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("DOCLING_API_URL", "http://127.0.0.1:5001/v1/convert/file")
+    env.setdefault("OPENAI_API_KEY", "sk-bench")
+    env["DATA_DIR"] = data_dir
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(data_dir: str) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, env=_env(data_dir),
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_ready(data_dir: str, timeout_s: float = 30.0) -> Dict[str, float]:
+    port = _free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=_env(data_dir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if time.perf_counter() - t0 > timeout_s:
+                raise TimeoutError("app did not become ready")
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {proc.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.05):
+                    break
+            except OSError:
+                time.sleep(0.005)
+        t1 = time.perf_counter()
+        r = requests.get(f"http://127.0.0.1:{port}/health", timeout=5)
+        r.raise_for_status()
+        t2 = time.perf_counter()
+        return {"ready_ms": (t2 - t0) * 1000.0, "first_request_ms": (t2 - t1) * 1000.0}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--import-target-ms", type=float, default=DEFAULT_IMPORT_TARGET_MS)
+    ap.add_argument("--ready-target-ms", type=float, default=DEFAULT_READY_TARGET_MS)
+    args = ap.parse_args(argv)
+
+    samples: Dict[str, List[float]] = {"import_ms": [], "ready_ms": [], "first_request_ms": []}
+    for _ in range(args.runs):
+        data_dir = tempfile.mkdtemp(prefix="contract-cold-")
+        try:
+            samples["import_ms"].append(measure_import(data_dir))
+            for k, v in measure_ready(data_dir).items():
+                samples[k].append(v)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {k: {"median": round(statistics.median(v), 1), "max": round(max(v), 1)} for k, v in samples.items()}
+    report["targets"] = {"import_ms": args.import_target_ms, "ready_ms": args.ready_target_ms}
+    print(json.dumps(report, indent=2))
+    failed = []
+    if report["import_ms"]["median"] > args.import_target_ms:
+        failed.append("import_ms")
+    if report["ready_ms"]["median"] > args.ready_target_ms:
+        failed.append("ready_ms")
+    for name in failed:
+        print(f"OVER TARGET {name}: {report[name]['median']} ms > {report['targets'][name]} ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""End-to-end load benchmark for the FastAPI app.
+
+By default the benchmark spawns the Docling and OpenAI stand-ins plus the app
+(``uvicorn app.main:app``) on local ports with a throw-away ``DATA_DIR``, then
+drives four stages in order:
+
+- ``ingest_base``: POST /contracts/base/ingest, one PDF per contract
+- ``ingest_addendum``: POST /contracts/{id}/addenda/ingest, one per contract
+- ``state``: GET /contracts/{id}/state
+- ``redline``: GET /contracts/{id}/versions/2/redline
+
+and reports p50/p95/p99 latency and documents (requests) per minute per stage::
+
+    python -m bench.load --contracts 50 --concurrency 8 --llm-latency-ms 1500
+    python -m bench.load --base-url http://127.0.0.1:8000 --contracts 20   # existing app
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+
+STAGES = ["ingest_base", "ingest_addendum", "state", "redline"]
+
+
+@dataclass
+class StageResult:
+    name: str
+    latencies_ms: List[float] = field(default_factory=list)
+    errors: int = 0
+    wall_s: float = 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies_ms:
+            return None
+        data = sorted(self.latencies_ms)
+        # nearest-rank: phần tử thứ ceil(q/100 * n)
+        k = max(0, min(len(data) - 1, math.ceil(q / 100.0 * len(data)) - 1))
+        return data[k]
+
+    def summary(self) -> Dict[str, object]:
+        ok = len(self.latencies_ms)
+        return {
+            "stage": self.name,
+            "ok": ok,
+            "errors": self.errors,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "docs_per_min": round(ok * 60.0 / self.wall_s, 1) if self.wall_s else None,
+        }
+
+
+def _run_stage(name: str, calls: List[Callable[[], requests.Response]], concurrency: int) -> StageResult:
+    result = StageResult(name)
+
+    def _one(fn):
+        t0 = time.perf_counter()
+        try:
+            r = fn()
+            ok = r.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return ok, (time.perf_counter() - t0) * 1000.0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ok, ms in pool.map(_one, calls):
+            if ok:
+                result.latencies_ms.append(ms)
+            else:
+                result.errors += 1
+    result.wall_s = time.perf_counter() - t0
+    return result
+
+
+def _fake_pdf(tag: str) -> bytes:
+    # stand-in Docling không đọc nội dung; chỉ cần bytes khác nhau mỗi tài liệu
+    return f"%PDF-1.4\n% synthetic {tag}\n%%EOF\n".encode()
+
+
+def run_benchmark(base_url: str, contracts: int, concurrency: int, timeout: float = 300.0) -> List[StageResult]:
+    session = requests.Session()
+    ids = [f"bench-{i:05d}" for i in range(contracts)]
+
+    def ingest_base(cid):
+        return lambda: session.post(
+            f"{base_url}/contracts/base/ingest",
+            files={"file": (f"{cid}.pdf", _fake_pdf(cid), "application/pdf")},
+            timeout=timeout,
+        )
+
+    def ingest_addendum(cid):
+        return lambda: session.post(
+            f"{base_url}/contracts/{cid}/addenda/ingest",
+            files={"file": (f"{cid}-add1.pdf", _fake_pdf(cid + "-add1"), "application/pdf")},
+            timeout=timeout,
+        )
+
+    def state(cid):
+        return lambda: session.get(f"{base_url}/contracts/{cid}/state", params={"as_of": "2025-06-15"}, timeout=timeout)
+
+    def redline(cid):
+        return lambda: session.get(f"{base_url}/contracts/{cid}/versions/2/redline", timeout=timeout)
+
+    builders = {"ingest_base": ingest_base, "ingest_addendum": ingest_addendum, "state": state, "redline": redline}
+    return [_run_stage(name, [builders[name](cid) for cid in ids], concurrency) for name in STAGES]
+
+
+def _wait_ready(url: str, deadline_s: float = 30.0) -> None:
+    end = time.time() + deadline_s
+    while time.time() < end:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service not ready: {url}")
+
+
+def _spawn(args, data_dir: str) -> List[subprocess.Popen]:
+    py = sys.executable
+    common = ["--latency-ms", str(args.docling_latency_ms), "--failure-rate", str(args.failure_rate), "--clauses", str(args.clauses)]
+    procs = [
+        subprocess.Popen([py, "-m", "bench.standins", "docling", "--port", str(args.docling_port), *common]),
+        subprocess.Popen([
+            py, "-m", "bench.standins", "openai", "--port", str(args.openai_port),
+            "--latency-ms", str(args.llm_latency_ms), "--failure-rate", str(args.failure_rate), "--clauses", str(args.clauses),
+        ]),
+    ]
+    env = dict(os.environ)
+    env.update({
+        "DOCLING_API_URL": f"http://127.0.0.1:{args.docling_port}/v1/convert/file",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "sk-standin"),
+        "DATA_DIR": data_dir,
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+    })
+    procs.append(subprocess.Popen(
+        [py, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.app_port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=env,
+    ))
+    _wait_ready(f"http://127.0.0.1:{args.docling_port}/health")
+    _wait_ready(f"http://127.0.0.1:{args.openai_port}/health")
+    _wait_ready(f"http://127.0.0.1:{args.app_port}/health")
+    return procs
+
+
+def _print_table(results: List[StageResult]) -> None:
+    def fmt(v):
+        return "-" if v is None else f"{v:.1f}"
+
+    print(f"{'stage':<16}{'ok':>6}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'docs/min':>10}")
+    for r in results:
+        s = r.summary()
+        print(f"{s['stage']:<16}{s['ok']:>6}{s['errors']:>6}{fmt(s['p50_ms']):>10}{fmt(s['p95_ms']):>10}"
+              f"{fmt(s['p99_ms']):>10}{fmt(s['docs_per_min']):>10}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base-url", help="benchmark an already running app instead of spawning one")
+    ap.add_argument("--contracts", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn workers for the spawned app")
+    ap.add_argument("--docling-latency-ms", type=float, default=500.0)
+    ap.add_argument("--llm-latency-ms", type=float, default=1000.0)
+    ap.add_argument("--failure-rate", type=float, default=0.0)
+    ap.add_argument("--clauses", type=int, default=20)
+    ap.add_argument("--app-port", type=int, default=8765)
+    ap.add_argument("--docling-port", type=int, default=8766)
+    ap.add_argument("--openai-port", type=int, default=8767)
+    ap.add_argument("--json", dest="json_out", help="write the stage summaries to this file")
+    args = ap.parse_args(argv)
+
+    procs: List[subprocess.Popen] = []
+    tmp = None
+    try:
+        if args.base_url:
+            base_url = args.base_url.rstrip("/")
+        else:
+            tmp = tempfile.TemporaryDirectory(prefix="contract-bench-")
+            procs = _spawn(args, tmp.name)
+            base_url = f"http://127.0.0.1:{args.app_port}"
+        results = run_benchmark(base_url, args.contracts, args.concurrency)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+        if tmp is not None:
+            tmp.cleanup()
+
+    _print_table(results)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "stages": [r.summary() for r in results]}, f, indent=2)
+    return 0 if all(r.errors == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
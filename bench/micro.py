@@ -0,0 +1,164 @@
+"""Micro-benchmarks for the merge / query / render / validate / storage hot paths.
+
+    python -m bench.micro                         # default sizes, compare to baseline
+    python -m bench.micro --sizes 10 1000 50000 --repeat 3
+    python -m bench.micro --save-baseline         # record current numbers as the baseline
+
+Results go to ``bench/results/micro-latest.json``. When a baseline exists
+(``bench/baseline/micro.json``) every case is compared on its median time and
+the exit status is 1 if any case regressed by more than ``--tolerance``.
+Timings depend on the machine, so no baseline is committed: run
+``--save-baseline`` once on the measuring machine before comparing.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+# app.config đòi hai biến này; benchmark không gọi dịch vụ ngoài
+os.environ.setdefault("DOCLING_API_URL", "http://127.0.0.1:5001/v1/convert/file")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="contract-micro-")
+atexit.register(shutil.rmtree, os.environ["DATA_DIR"], True)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app import diffing, merger, readmodel, render, storage, validator  # noqa: E402
+from bench.synthetic import make_changeset, make_contract  # noqa: E402
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS = os.path.join(HERE, "results", "micro-latest.json")
+DEFAULT_BASELINE = os.path.join(HERE, "baseline", "micro.json")
+DEFAULT_SIZES = [10, 100, 1000, 10000, 50000]
+
+
+def _time(fn: Callable[[], object], setup: Optional[Callable[[], object]], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg) if setup else fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples
+
+
+def _at_least(minimum: int) -> Callable[[str], int]:
+    def parse(value: str) -> int:
+        n = int(value)
+        if n < minimum:
+            raise argparse.ArgumentTypeError(f"must be >= {minimum}, got {n}")
+        return n
+
+    return parse
+
+
+def cases_for(size: int, rows_per_clause: int, changes: int):
+    contract = make_contract(size, rows_per_clause=rows_per_clause, contract_id=f"micro-{size}")
+    cs = make_changeset(contract, changes=changes)
+    older = make_contract(max(1, size - max(1, size // 10)), rows_per_clause=rows_per_clause, contract_id=f"micro-{size}")
+    as_of = date(2025, 6, 15)
+    target = cs.changes[1].target
+    merged = merger.apply_changes(contract.model_copy(deep=True), cs)
+    storage.save_contract_version(contract, 1)
+    compact = readmodel.from_model(contract)
+
+    return [
+        ("apply_changes", lambda bc: merger.apply_changes(bc, cs), lambda: contract.model_copy(deep=True)),
+        ("match_targets", lambda: merger.match_targets(contract.clauses, target), None),
+        ("state_as_of", lambda: storage.state_as_of(contract, as_of), None),
+        ("render_markdown", lambda: render.render_markdown(contract), None),
+        ("redline", lambda: render.redline(older, contract), None),
+        ("diff_contracts", lambda: diffing.diff_contracts(contract, merged), None),
+        ("validate_base_contract", lambda: validator.validate_base_contract(contract), None),
+        ("storage_save", lambda: storage.save_contract_version(contract, 1), None),
+        ("storage_load", lambda: storage.load_contract_version(contract.contract_id, 1), None),
+        ("compact_load", lambda _: readmodel.load_compact(contract.contract_id, 1), readmodel._load.cache_clear),
+        ("compact_state_as_of", lambda: compact.as_of(as_of), None),
+        ("compact_dumps", lambda: readmodel.dumps(compact), None),
+    ]
+
+
+def run(sizes: List[int], repeat: int, rows_per_clause: int, changes: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for size in sizes:
+        for name, fn, setup in cases_for(size, rows_per_clause, changes):
+            samples = _time(fn, setup, repeat)
+            key = f"{name}[{size}]"
+            results[key] = {
+                "median_ms": round(statistics.median(samples), 3),
+                "min_ms": round(min(samples), 3),
+                "max_ms": round(max(samples), 3),
+                "repeat": repeat,
+            }
+            print(f"{key:<36}{results[key]['median_ms']:>12.3f} ms", flush=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    regressions = []
+    for key, cur in results.items():
+        ref = baseline.get(key)
+        if not ref:
+            continue
+        # bỏ qua nhiễu ở các case rất nhanh
+        limit = ref["median_ms"] * (1.0 + tolerance) + 0.05
+        if cur["median_ms"] > limit:
+            regressions.append(f"{key}: {cur['median_ms']:.3f} ms > baseline {ref['median_ms']:.3f} ms (+{tolerance:.0%})")
+    return regressions
+
+
+def _write(path: str, payload: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=_at_least(1), nargs="+", default=DEFAULT_SIZES, help="clause counts")
+    ap.add_argument("--rows-per-clause", type=_at_least(1), default=4, help="rate rows per Pricing clause")
+    # match_targets đo với target của change thứ hai
+    ap.add_argument("--changes", type=_at_least(2), default=20, help="changes in the synthetic ChangeSet (>= 2)")
+    ap.add_argument("--repeat", type=_at_least(1), default=5)
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    ap.add_argument("--results", default=DEFAULT_RESULTS)
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true")
+    args = ap.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.rows_per_clause, args.changes)
+    payload = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"rows_per_clause": args.rows_per_clause, "changes": args.changes, "repeat": args.repeat},
+        "results": results,
+    }
+    _write(args.results, payload)
+    if args.save_baseline:
+        _write(args.baseline, payload)
+        print(f"baseline saved: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; nothing compared. Run with --save-baseline once on this machine first")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
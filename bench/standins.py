@@ -0,0 +1,211 @@
+"""Local stand-ins for the Docling convert endpoint and OpenAI chat completions.
+
+Run one server per process::
+
+    python -m bench.standins docling --port 5001 --latency-ms 800 --failure-rate 0.02
+    python -m bench.standins openai --port 5002 --latency-ms 1500 --stream-chunk 64
+
+then point the app at them::
+
+    DOCLING_API_URL=http://127.0.0.1:5001/v1/convert/file
+    OPENAI_BASE_URL=http://127.0.0.1:5002/v1
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class StandinConfig:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    failure_rate: float = 0.0
+    # status trả về khi "hỏng" (429 để thử scheduler, 500/503 để thử retry)
+    failure_status: int = 503
+    clauses: int = 5
+    stream_chunk: int = 64
+    canned_path: Optional[str] = None
+
+
+async def _delay(cfg: StandinConfig) -> None:
+    ms = cfg.latency_ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+    if ms > 0:
+        await asyncio.sleep(ms / 1000.0)
+
+
+def _should_fail(cfg: StandinConfig) -> bool:
+    return cfg.failure_rate > 0 and random.random() < cfg.failure_rate
+
+
+def _failure(cfg: StandinConfig) -> JSONResponse:
+    headers = {"Retry-After": "1"} if cfg.failure_status == 429 else {}
+    return JSONResponse({"error": "standin_injected_failure"}, status_code=cfg.failure_status, headers=headers)
+
+
+def _load_canned(cfg: StandinConfig, name: str) -> Optional[str]:
+    if not cfg.canned_path:
+        return None
+    path = os.path.join(cfg.canned_path, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def synthetic_markdown(clauses: int) -> str:
+    lines = ["# Hợp đồng cung cấp dịch vụ phòng", "", "Khách sạn Standin Resort", ""]
+    for i in range(clauses):
+        lines += [
+            f"# Bảng giá phòng {i + 1}",
+            "| room | date_from | date_to | rate |",
+            "|------|-----------|---------|------|",
+            f"| Room{i + 1} | 2025-01-01 | 2025-12-31 | {1000000 + i * 1000} |",
+            "",
+        ]
+    lines += ["# Khuyến mãi", "Giảm 10% cho đặt phòng sớm", "", "# Signatures", "Đại diện hai bên ký tên"]
+    return "\n".join(lines)
+
+
+def synthetic_base(clauses: int) -> Dict[str, Any]:
+    return {
+        "meta": {"hotel": "Standin Resort", "sign_date": "2025-01-01", "currency": "VND"},
+        "clauses": [
+            {
+                "id": f"p{i + 1}",
+                "type": "Pricing",
+                "title": f"Room{i + 1} rates",
+                "scope": {"room": f"Room{i + 1}"},
+                "table": [{"date_from": "2025-01-01", "date_to": "2025-12-31", "rate": 1000000 + i * 1000, "currency": "VND"}],
+                "effective_from": "2025-01-01",
+                "confidence": 0.9,
+            }
+            for i in range(clauses)
+        ],
+    }
+
+
+def synthetic_addendum() -> Dict[str, Any]:
+    return {
+        "source_doc": "standin-addendum.pdf",
+        "issued_date": "2025-05-01",
+        "changes": [
+            {"id": "ch1", "op": "add", "type": "RateAdjustment", "target": {"clause_id": "p1"},
+             "payload": {"rate": 1200000}, "effective_from": "2025-06-01", "confidence": 0.9},
+            {"id": "ch2", "op": "add", "type": "Promotion", "target": {"type": "Pricing", "scope": {"room": "Room1"}},
+             "payload": {"discount_pct": 10}, "effective_from": "2025-06-01", "effective_to": "2025-06-30", "confidence": 0.8},
+            {"id": "ch3", "op": "add", "type": "StopSell", "target": {"scope": {"room": "Room1"}},
+             "effective_from": "2025-07-01", "effective_to": "2025-07-03", "confidence": 0.8},
+        ],
+    }
+
+
+def build_docling_app(cfg: StandinConfig) -> FastAPI:
+    app = FastAPI(title="Docling stand-in")
+    markdown = _load_canned(cfg, "docling.md") or synthetic_markdown(cfg.clauses)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/v1/convert/file")
+    async def convert_file(request: Request):
+        form = await request.form()
+        await _delay(cfg)
+        if _should_fail(cfg):
+            return _failure(cfg)
+        upload = form.get("files")
+        name = getattr(upload, "filename", "document.pdf")
+        return {"document": {"filename": name, "md_content": markdown, "text_content": markdown}, "status": "success"}
+
+    return app
+
+
+def build_openai_app(cfg: StandinConfig) -> FastAPI:
+    app = FastAPI(title="OpenAI stand-in")
+    base = _load_canned(cfg, "base.json") or json.dumps(synthetic_base(cfg.clauses), ensure_ascii=False)
+    addendum = _load_canned(cfg, "addendum.json") or json.dumps(synthetic_addendum(), ensure_ascii=False)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "".join(m.get("content") or "" for m in body.get("messages", []))
+        content = addendum if "Mode hiện tại: ADDENDUM" in prompt else base
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        }
+        if _should_fail(cfg):
+            await _delay(cfg)
+            return _failure(cfg)
+        if not body.get("stream"):
+            await _delay(cfg)
+            return {
+                "id": "standin",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            pieces: List[str] = [content[i:i + cfg.stream_chunk] for i in range(0, len(content), cfg.stream_chunk)]
+            per_piece = (cfg.latency_ms / 1000.0) / max(1, len(pieces))
+            for piece in pieces:
+                await asyncio.sleep(per_piece)
+                chunk = {"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("kind", choices=["docling", "openai"])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--failure-rate", type=float, default=0.0)
+    ap.add_argument("--failure-status", type=int, default=503)
+    ap.add_argument("--clauses", type=int, default=5, help="size of the synthetic canned contract")
+    ap.add_argument("--stream-chunk", type=int, default=64, help="characters per SSE delta")
+    ap.add_argument("--canned", dest="canned_path", help="directory with docling.md / base.json / addendum.json")
+    args = ap.parse_args(argv)
+    cfg = StandinConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        clauses=args.clauses,
+        stream_chunk=args.stream_chunk,
+        canned_path=args.canned_path,
+    )
+    app = build_docling_app(cfg) if args.kind == "docling" else build_openai_app(cfg)
+    port = args.port or (5001 if args.kind == "docling" else 5002)
+    uvicorn.run(app, host=args.host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
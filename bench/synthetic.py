@@ -0,0 +1,76 @@
+"""Synthetic BaseContract / ChangeSet generator for benchmarks."""
+from __future__ import annotations
+
+import random
+from datetime import date, timedelta
+from typing import List
+
+from app.models import BaseContract, ChangeSet, Clause, ContractMeta, RateRow
+
+
+CLAUSE_TYPES = ["Pricing", "Pricing", "Pricing", "Cancellation", "Surcharge", "Promotion", "Allotment", "Other"]
+ROOMS = ["Deluxe", "Superior", "Suite", "Family", "Villa", "Bungalow"]
+MARKETS = ["VN", "KR", "CN", "EU", "US"]
+
+
+def make_contract(clauses: int, rows_per_clause: int = 4, seed: int = 42, contract_id: str = "synthetic") -> BaseContract:
+    """Build a contract with ``clauses`` clauses; Pricing clauses carry ``rows_per_clause`` rate rows."""
+    rnd = random.Random(seed)
+    start = date(2025, 1, 1)
+    out: List[Clause] = []
+    for i in range(clauses):
+        ctype = CLAUSE_TYPES[i % len(CLAUSE_TYPES)]
+        scope = {"room": ROOMS[i % len(ROOMS)], "market": MARKETS[(i // len(ROOMS)) % len(MARKETS)], "block": i // 30}
+        table = None
+        if ctype == "Pricing":
+            table = []
+            span = max(1, 365 // rows_per_clause)
+            for r in range(rows_per_clause):
+                d0 = start + timedelta(days=r * span)
+                table.append(RateRow(
+                    date_from=d0,
+                    date_to=d0 + timedelta(days=span - 1),
+                    rate=float(rnd.randrange(800_000, 5_000_000, 1000)),
+                    currency="VND" if rnd.random() < 0.8 else "USD",
+                ))
+        eff_from = start + timedelta(days=rnd.randrange(0, 60))
+        out.append(Clause(
+            id=f"c{i + 1}",
+            type=ctype,
+            title=f"{ctype} {scope['room']} {scope['market']} #{i + 1}",
+            scope=scope,
+            table=table,
+            policy={"note": "standard"} if ctype in ("Cancellation", "Surcharge") else None,
+            text=f"Điều khoản {i + 1}: áp dụng cho phòng {scope['room']} thị trường {scope['market']}.",
+            effective_from=eff_from,
+            effective_to=eff_from + timedelta(days=rnd.randrange(180, 720)) if rnd.random() < 0.5 else None,
+            confidence=round(rnd.uniform(0.5, 1.0), 2),
+        ))
+    meta = ContractMeta(hotel="Synthetic Hotel", sign_date=start, currency="VND", source_file=f"{contract_id}.pdf")
+    return BaseContract(contract_id=contract_id, meta=meta, clauses=out)
+
+
+def make_changeset(contract: BaseContract, changes: int = 20, seed: int = 7) -> ChangeSet:
+    """Build a ChangeSet mixing id-targeted and scope-targeted changes against ``contract``."""
+    rnd = random.Random(seed)
+    pricing = [c for c in contract.clauses if c.type.value == "Pricing"] or contract.clauses
+    items = []
+    for i in range(changes):
+        cl = pricing[rnd.randrange(len(pricing))]
+        eff = date(2025, 6, 1) + timedelta(days=rnd.randrange(0, 90))
+        kind = i % 4
+        if kind == 0:
+            items.append({"id": f"ch{i}", "op": "replace", "type": "RateAdjustment", "target": {"clause_id": cl.id},
+                          "payload": {"rate": 1_500_000 + i}, "effective_from": eff, "confidence": 0.9})
+        elif kind == 1:
+            items.append({"id": f"ch{i}", "op": "add", "type": "Promotion",
+                          "target": {"type": "Pricing", "scope": {"room": cl.scope["room"], "market": cl.scope["market"]}},
+                          "payload": {"discount_pct": 10}, "effective_from": eff,
+                          "effective_to": eff + timedelta(days=30), "confidence": 0.8})
+        elif kind == 2:
+            items.append({"id": f"ch{i}", "op": "add", "type": "StopSell", "target": {"scope": {"room": cl.scope["room"]}},
+                          "effective_from": eff, "effective_to": eff + timedelta(days=3), "confidence": 0.8})
+        else:
+            items.append({"id": f"ch{i}", "op": "replace", "type": "PolicyUpdate", "target": {"clause_id": cl.id},
+                          "payload": {"cancel_days": 7}, "effective_from": eff, "confidence": 0.8})
+    return ChangeSet(source_doc="synthetic-addendum.pdf", issued_date=date(2025, 5, 1), changes=items)
@@ -0,0 +1,34 @@
+import pytest
+
+from app import config
+from app.models import BaseContract
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("DOCLING_API_URL", "http://127.0.0.1:5001")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(config, "_settings", None)
+    yield tmp_path
+    config._settings = None
+
+
+def _contract(contract_id: str, hotel: str = "Legacy Hotel") -> BaseContract:
+    return BaseContract(
+        contract_id=contract_id,
+        meta={"hotel": hotel, "sign_date": "2025-01-01", "currency": "USD", "source_file": "legacy.pdf"},
+        clauses=[{
+            "id": "c1",
+            "type": "Pricing",
+            "title": "Room rates",
+            "effective_from": "2025-01-01",
+            "table": [{"date_from": "2025-06-01", "date_to": "2025-08-31", "rate": 120.0, "currency": "USD"}],
+            "confidence": 0.9,
+        }],
+    )
+
+
+@pytest.fixture
+def make_contract():
+    return _contract
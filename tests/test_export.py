@@ -0,0 +1,25 @@
+from datetime import date
+
+from app import export, portfolio, storage
+
+
+def test_exports_contract_missing_from_portfolio_index(data_dir, make_contract):
+    indexed = make_contract("indexed", hotel="Indexed Hotel")
+    storage.save_contract_version(indexed, 1)
+    portfolio.index_contract(indexed, 1)
+    storage.save_contract_version(make_contract("legacy"), 1)
+    assert [c["contract_id"] for c in portfolio.query_contracts()["items"]] == ["indexed"]
+
+    explicit = list(export.iter_rows(date(2025, 1, 1), contract_ids=["legacy"]))
+    everything = list(export.iter_rows(date(2025, 1, 1)))
+
+    assert [(r["contract_id"], r["rate"]) for r in explicit] == [("legacy", 120.0)]
+    assert [r["contract_id"] for r in everything] == ["indexed", "legacy"]
+
+
+def test_explicit_contract_ids_still_apply_filters(data_dir, make_contract):
+    storage.save_contract_version(make_contract("legacy"), 1)
+
+    assert list(export.iter_rows(date(2025, 1, 1), contract_ids=["legacy"], hotel="other hotel")) == []
+    assert len(list(export.iter_rows(date(2025, 1, 1), contract_ids=["legacy"], hotel="legacy  HOTEL",
+                                     currency="usd", clause_type="Pricing"))) == 1
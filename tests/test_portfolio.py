@@ -0,0 +1,11 @@
+from app import portfolio, storage
+
+
+def test_empty_index_is_built_from_stored_versions(data_dir, make_contract):
+    storage.save_contract_version(make_contract("legacy"), 1)
+    storage.save_contract_version(make_contract("legacy"), 2)
+
+    items = portfolio.query_contracts()["items"]
+
+    assert [(c["contract_id"], c["version"]) for c in items] == [("legacy", 2)]
+    assert items[0]["updated_at"].endswith("+00:00")